@@ -0,0 +1,292 @@
+#!/usr/bin/python3.11
+
+"""
+bench_collectors.py
+Run every collector's parse and aggregate path against recorded slurm output.
+
+The fixtures in benchmarks/fixtures are scaled up to the requested number of
+records (renaming the copies so nodes, jobs and users stay distinct) and
+handed to the collectors in place of the real commands, so nothing but the
+collector itself is measured.  Each collector and scale runs in a child
+process and reports wall time, peak RSS (and how much of it the collect added
+on top of the replayed output) and the peak memory allocated while collecting,
+per record.
+"""
+
+import sys,os
+import argparse
+import json
+import re
+import resource
+import subprocess
+import time
+import tracemalloc
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+fixtures = os.path.join(prefix, 'benchmarks', 'fixtures')
+
+#Recorded output of each command, filled in per scale before collecting.
+outputs = {}
+
+def read(name):
+  with open(os.path.join(fixtures, name)) as f:
+    return [l.rstrip('\n') for l in f if l.strip()]
+
+def scale(lines, records, rename):
+  """Repeat lines up to records, passing each copy after the first through rename(line, copy)."""
+  out = []
+  copy = 0
+  while len(out) < records:
+    for line in lines:
+      out.append(rename(line, copy) if copy else line)
+      if len(out) == records:
+        break
+    copy = copy + 1
+  return '\n'.join(out) + '\n'
+
+def rename_node(line, copy):
+  return re.sub(r'^NodeName=(\S+)', lambda m: f"NodeName={m.group(1)}x{copy}", line)
+
+def rename_job(line, copy):
+  return re.sub(r'^JobId=(\d+)', lambda m: f"JobId={int(m.group(1)) + copy * 10000000}", line)
+
+def rename_share(line, copy):
+  fields = line.split('|')
+  fields[0] = fields[0] + str(copy) if fields[0].strip() else fields[0]
+  fields[1] = fields[1] + str(copy)
+  return '|'.join(fields)
+
+def rename_sacct(line, copy):
+  fields = line.split('|')
+  fields[0] = fields[1] = str(int(fields[1]) + copy * 10000000)
+  return '|'.join(fields)
+
+def rename_ksacct(line, copy):
+  fields = line.split('|')
+  fields[0] = str(int(fields[0]) + copy * 10000000)
+  fields[2] = fields[2] + str(copy % 1000)
+  return '|'.join(fields)
+
+def setup(records, nodes=None):
+  """Build the output of every command at the given scale, with up to nodes nodes if given."""
+  nodes = scale(read('scontrol_show_node.txt'), nodes or records, rename_node)
+  node_names = re.findall(r'^NodeName=(\S+)', nodes, re.M)
+  partitions = read('scontrol_show_partition.txt')
+  #Only the root account is not repeated
+  shares = read('sshare.txt')
+
+  outputs.clear()
+  outputs.update({
+    'scontrol node': nodes,
+    'scontrol partition': '\n'.join(partitions) + '\n',
+    'scontrol job': scale(read('scontrol_show_job.txt'), records, rename_job),
+    'sdiag': '\n'.join(read('sdiag.txt')) + '\n',
+    'sshare': shares[0] + '\n' + scale(shares[1:], records, rename_share),
+    'showq': '\n'.join(read('showq.txt')) + '\n',
+    'squeue': scale(read('squeue_seas.txt'), records, lambda l, c: l),
+    'sacct kjm': scale(read('sacct_kjm.txt'), records, rename_sacct),
+    'sacct ksacct': scale(read('sacct_ksacct.txt'), records, rename_ksacct),
+    'sinfo partitions': '\n'.join(re.match(r'PartitionName=(\S+)', p).group(1) for p in partitions) + '\nkempner\nkempner_requeue\n',
+    'sinfo nodes': ''.join(f"{n} {'mixed' if i % 3 else 'idle'} kempner_h100\n" for i, n in enumerate(node_names)),
+    'sinfo nodelist': ','.join(node_names[:64]) + '\n',
+  })
+
+def lookup(args):
+  """Find the recorded output for a command line."""
+  if isinstance(args, str):
+    args = args.split()
+  args = list(args)
+  while args and args[0] == 'timeout':
+    args = args[4:]
+  prog = os.path.basename(args[0])
+  if prog == 'scontrol':
+    for kind in ('node', 'partition', 'job'):
+      if kind in args:
+        return outputs['scontrol ' + kind]
+  if prog == 'sacct':
+    return outputs['sacct kjm' if '--parsable2' in args else 'sacct ksacct']
+  if prog == 'sinfo':
+    if '-Nh' in args:
+      return outputs['sinfo nodes']
+    if '%R' in args:
+      return outputs['sinfo partitions']
+    return outputs['sinfo nodelist']
+  return outputs.get(prog, '')
+
+class Replay:
+  """Output of a replayed command, handed out line by line without copying it."""
+  def __init__(self, output):
+    self.output = output
+
+  def __iter__(self):
+    return (m.group(0) for m in re.finditer(r'.*\n', self.output))
+
+  def read(self):
+    return self.output
+
+  def close(self):
+    pass
+
+class ReplayPopen:
+  """Stands in for subprocess.Popen, answering with the recorded output."""
+  def __init__(self, args, stdout=None, stderr=None, **kwargs):
+    self.args = args
+    self.pid = 0
+    self.returncode = None
+    self.stdout = Replay(lookup(args)) if stdout == subprocess.PIPE else None
+    self.stderr = Replay('') if stderr == subprocess.PIPE else None
+
+  def communicate(self, input=None, timeout=None):
+    self.returncode = 0
+    return (self.stdout.read() if self.stdout else None, self.stderr.read() if self.stderr else None)
+
+  def wait(self, timeout=None):
+    self.returncode = 0
+    return 0
+
+  def poll(self):
+    return self.returncode
+
+  def kill(self):
+    pass
+
+  terminate = kill
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.wait()
+
+def ksacct():
+  """The Kempner sacct ingest path: one windowed query split into days and rolled up."""
+  import slurm_kempner_sacct_collector as ksacct
+  class Ingest:
+    def collect(self):
+      for lines in ksacct.run_command('2024-01-01T00:00:00', '2024-01-03T00:00:00').values():
+        ksacct.process_cpu_gpu_usage(lines)
+      return []
+  return Ingest()
+
+def collectors():
+  import slurm_exporter
+  found = {}
+  for name in slurm_exporter.COLLECTORS:
+    if name == 'ksacct':
+      found[name] = ksacct
+    else:
+      found[name] = lambda name=name: slurm_exporter.load(name)[0]
+  return found
+
+def status(key):
+  """Read a memory figure in MB from /proc/self/status."""
+  with open('/proc/self/status') as f:
+    return int(re.search(r'^%s:\s+(\d+)' % key, f.read(), re.M).group(1)) / 1024
+
+def reset_peak_rss():
+  """Start measuring peak RSS afresh and return the current RSS in MB.
+
+  Linux lets the high water mark be reset through /proc/self/clear_refs,
+  elsewhere the peak since the process started is the best there is.
+  """
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+    return status('VmRSS')
+  except OSError:
+    return peak_rss()
+
+def peak_rss():
+  try:
+    return status('VmHWM')
+  except OSError:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(name, factory, records, nodes=None, warm=False):
+  """Collect once for wall time and RSS, then again under tracemalloc for allocations.
+
+  With warm set, command output is kept between collects and one collect is
+  run beforehand, so only the work done on output that was already parsed
+  (the shared node inventory for one) is measured.
+  """
+  setup(records, nodes)
+  collector = factory()
+  if warm:
+    import slurm_source
+    slurm_source.source.ttl = 3600
+    list(collector.collect())
+  base = reset_peak_rss()
+
+  start = time.perf_counter()
+  families = list(collector.collect())
+  wall = time.perf_counter() - start
+  rss = peak_rss()
+
+  tracemalloc.start()
+  list(collector.collect())
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  samples = sum(len(f.samples) for f in families)
+  return {'collector': name, 'records': records, 'wall': wall, 'rss': rss, 'growth': rss - base, 'alloc': peak / records, 'samples': samples}
+
+def run_child(name, factory, records, nodes=None, warm=False):
+  """Measure in a forked child so each result has its own peak RSS."""
+  r, w = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(r)
+    try:
+      result = measure(name, factory, records, nodes, warm)
+    except Exception as e:
+      result = {'collector': name, 'records': records, 'error': repr(e)}
+    os.write(w, json.dumps(result).encode())
+    os._exit(0)
+  os.close(w)
+  with os.fdopen(r) as f:
+    data = f.read()
+  os.waitpid(pid, 0)
+  return json.loads(data)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark each collector against recorded slurm output.')
+  parser.add_argument('--records', default='100,10000,100000', help='comma separated scales to run')
+  parser.add_argument('--nodes', type=int, default=None, help='number of nodes, defaults to the number of records')
+  parser.add_argument('--collectors', default=None, help='comma separated collectors, defaults to all')
+  parser.add_argument('--warm', action='store_true', help='collect once first and reuse command output, timing only the aggregation')
+  parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+  parser.add_argument('--max-rss', type=float, default=None,
+    help='fail if any collector grows peak RSS by more than this many MB while collecting')
+  args = parser.parse_args()
+
+  os.environ.pop('SLURMRESTD_URL', None)
+  subprocess.Popen = ReplayPopen
+  found = collectors()
+  names = args.collectors.split(',') if args.collectors else list(found)
+
+  over = []
+  if not args.json:
+    print(f"{'collector':<10} {'records':>8} {'wall s':>9} {'us/rec':>9} {'peak RSS MB':>12} {'growth MB':>10} {'alloc B/rec':>12} {'samples':>8}")
+  for name in names:
+    for records in [int(r) for r in args.records.split(',')]:
+      result = run_child(name, found[name], records, args.nodes, args.warm)
+      if args.max_rss is not None and result.get('growth', 0) > args.max_rss:
+        over.append(result)
+      if args.json:
+        print(json.dumps(result))
+      elif 'error' in result:
+        print(f"{name:<10} {records:>8} {result['error']}")
+      else:
+        print(f"{name:<10} {records:>8} {result['wall']:>9.3f} {result['wall'] / records * 1e6:>9.1f} {result['rss']:>12.1f} {result['growth']:>10.1f} {result['alloc']:>12.0f} {result['samples']:>8}")
+
+  for result in over:
+    print(f"{result['collector']} grew peak RSS by {result['growth']:.1f} MB at {result['records']} records, over the {args.max_rss:g} MB budget", file=sys.stderr)
+  sys.exit(1 if over else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python3.11
+
+"""
+bench_json.py
+Time slurm_json.iter_array against json.loads on pretty printed --json output.
+
+scontrol and sacct print --json indented, one value a line, and the collectors
+stream that output line by line into iter_array.  The jobs of the --json
+fixtures are repeated up to the requested number of records, padded with
+extra lines per job the way a job with a long environment or many steps is,
+and decoded both ways from the same text.  iter_array must keep up with
+json.loads to within --max-ratio, which it does not if it decodes each job
+again for every line that arrives.
+"""
+
+import sys,os
+import argparse
+import json
+import time
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+from slurm_json import iter_array
+
+fixtures = os.path.join(prefix, 'benchmarks', 'fixtures')
+
+CASES = ['scontrol_show_job.json', 'sacct_kjm.json']
+
+def document(name, records, padding):
+  """Pretty printed text of the fixture with its jobs repeated to records."""
+  with open(os.path.join(fixtures, name)) as f:
+    doc = json.load(f)
+  jobs = doc['jobs']
+  doc['jobs'] = []
+  for i in range(records):
+    job = dict(jobs[i % len(jobs)])
+    job['padding'] = [f"line {n}" for n in range(padding)]
+    doc['jobs'].append(job)
+  return json.dumps(doc, indent=2)
+
+def timed(func, *args):
+  start = time.perf_counter()
+  result = func(*args)
+  return result, time.perf_counter() - start
+
+def streamed(lines):
+  return sum(1 for _ in iter_array(lines, 'jobs'))
+
+def loaded(text):
+  return len(json.loads(text)['jobs'])
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark streaming pretty printed --json.')
+  parser.add_argument('--records', type=int, default=5000, help='jobs in each document')
+  parser.add_argument('--padding', type=int, default=600, help='extra lines per job')
+  parser.add_argument('--repeat', type=int, default=3, help='runs of each, the fastest is reported')
+  parser.add_argument('--max-ratio', type=float, default=10, help='fail when iter_array is this many times slower')
+  args = parser.parse_args()
+
+  print(f"{'fixture':<24} {'MB':>7} {'lines':>9} {'loads s':>8} {'stream s':>8} {'ratio':>6}")
+  failed = False
+  for name in CASES:
+    text = document(name, args.records, args.padding)
+    lines = text.splitlines(keepends=True)
+    best = {}
+    for i in range(args.repeat):
+      for label, func, arg in (('loads', loaded, text), ('stream', streamed, lines)):
+        count, seconds = timed(func, arg)
+        if count != args.records:
+          print(f"{name}: {label} decoded {count} of {args.records} jobs")
+          failed = True
+        best[label] = min(best.get(label, seconds), seconds)
+    ratio = best['stream'] / best['loads']
+    print(f"{name:<24} {len(text) / 1e6:>7.1f} {len(lines):>9} {best['loads']:>8.3f} {best['stream']:>8.3f} {ratio:>6.1f}")
+    failed = failed or ratio > args.max_ratio
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
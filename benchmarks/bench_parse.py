@@ -0,0 +1,89 @@
+#!/usr/bin/python3.11
+
+"""
+bench_parse.py
+Compare slurm_parse against the shlex based parsing the collectors used to do.
+
+Each fixture in benchmarks/fixtures is repeated up to the requested number of
+records and parsed both ways.
+"""
+
+import sys,os
+import argparse
+import shlex
+import time
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+from slurm_parse import parse_job, parse_record, parse_tres
+
+fixtures = os.path.join(prefix, 'benchmarks', 'fixtures')
+
+def shlex_record(line):
+  #Sanitize input
+  line = line.replace("'", "\\'")
+  line = line.replace('"', '\\"')
+  return dict(s.split("=", 1) for s in shlex.split(line) if '=' in s)
+
+def shlex_tres(tres):
+  return dict(s.split("=", 1) for s in shlex.split(tres.replace(",", " ")) if '=' in s)
+
+def shlex_job(line):
+  job = shlex_record(line)
+  details = []
+  for i in line.split(' Nodes='):
+    if "NumNodes=" not in i and "CPU_IDs=" in i:
+      details.append(shlex_record("Nodes=" + i))
+  if 'AllocTRES' in job:
+    shlex_tres(job['AllocTRES'])
+  return job, details
+
+def fast_job(line):
+  job, details = parse_job(line)
+  if 'AllocTRES' in job:
+    parse_tres(job['AllocTRES'])
+  return job, details
+
+def shlex_node(line):
+  node = shlex_record(line)
+  return node, shlex_tres(node['CfgTRES']), shlex_tres(node['AllocTRES'])
+
+def fast_node(line):
+  node = parse_record(line)
+  return node, parse_tres(node['CfgTRES']), parse_tres(node['AllocTRES'])
+
+CASES = [
+  ('scontrol_show_node.txt', shlex_node, fast_node),
+  ('scontrol_show_partition.txt', shlex_record, parse_record),
+  ('scontrol_show_job.txt', shlex_job, fast_job),
+]
+
+def load(name, records):
+  with open(os.path.join(fixtures, name)) as f:
+    lines = [l for l in f if l.strip()]
+  return (lines * (records // len(lines) + 1))[:records]
+
+def timeit(func, lines):
+  start = time.perf_counter()
+  for line in lines:
+    func(line)
+  return time.perf_counter() - start
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark scontrol record parsing.')
+  parser.add_argument('--records', type=int, default=10000, help='records to parse per fixture')
+  args = parser.parse_args()
+
+  print(f"{'fixture':<30} {'records':>8} {'shlex s':>10} {'fast s':>10} {'speedup':>8}")
+  for name, old, new in CASES:
+    lines = load(name, args.records)
+    told = timeit(old, lines)
+    tnew = timeit(new, lines)
+    print(f"{name:<30} {len(lines):>8} {told:>10.3f} {tnew:>10.3f} {told/tnew:>7.1f}x")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3.11
+
+"""
+bench_sacct_usage.py
+Compare the columnar sacct usage aggregation of the ksacct collector against
+the per job loop it used to do.
+
+A month of finished jobs is generated in the sacct format ksacct reads (a
+million by default) from the users, groups, partitions, GPUs and nodes of a
+mid sized cluster, then summed per partition, group and user both ways.  The
+totals must come out the same, give or take rounding.
+"""
+
+import sys,os
+import argparse
+import random
+import time
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+import slurm_weights
+from slurm_hostlist import expand
+from slurm_kempner_sacct_collector import (UsageColumns, check_kempner_node, convert_to_hours, extract_gpu_type,
+  extract_gres_gpu)
+
+STATES = ['COMPLETED'] * 6 + ['FAILED', 'TIMEOUT', 'CANCELLED by 0', 'OUT_OF_MEMORY']
+PARTITIONS = ['kempner', 'kempner_h100', 'kempner_requeue', 'kempner_dev', 'gpu', 'gpu_requeue', 'seas_gpu', 'serial_requeue']
+GPUS = ['nvidia_h100_80gb_hbm3', 'nvidia_a100-sxm4-80gb', 'nvidia_a100_1g.10gb', 'nvidia_a40', 'tesla_v100-pcie-32gb']
+
+def generate(jobs, users, groups, nodes, seed=0):
+  """Lines of sacct -X -p output for jobs finished GPU jobs over a month.
+
+  Each user belongs to one group and submits to a couple of partitions with a
+  few job shapes of their own, as users do, while the nodes, states and run
+  times vary from job to job.
+  """
+  rnd = random.Random(seed)
+  group_names = [f"kempner_lab{i:03d}" if i % 2 else f"lab{i:03d}" for i in range(groups)]
+  node_names = [f"holygpu8a{i:03d}" for i in range(nodes)]
+  profiles = []
+  for i in range(users):
+    shapes = []
+    for s in range(rnd.randint(1, 3)):
+      cpus = rnd.choice([1, 2, 4, 8, 16, 32, 64])
+      gpus = rnd.choice([1, 1, 1, 2, 4, 8])
+      shapes.append((cpus, f"billing={cpus},cpu={cpus},gres/gpu={gpus},gres/gpu:{rnd.choice(GPUS)}={gpus},mem={cpus * 4}G,node=1"))
+    profiles.append((f"user{i:04d}", group_names[i % groups], rnd.sample(PARTITIONS, 2), shapes))
+  lines = []
+  for job in range(jobs):
+    user, group, partitions, shapes = rnd.choice(profiles)
+    cpus, tres = rnd.choice(shapes)
+    seconds = int(rnd.expovariate(1 / 14400))
+    days, rest = divmod(seconds, 86400)
+    elapsed = f"{rest // 3600:02d}:{rest % 3600 // 60:02d}:{rest % 60:02d}"
+    if days:
+      elapsed = f"{days}-{elapsed}"
+    day = rnd.randrange(1, 31)
+    lines.append(f"{1000000 + job}|{rnd.choice(STATES)}|{user}|{group}|{rnd.choice(partitions)}|{elapsed}|{tres}|"
+      f"{rnd.choice(node_names)}|{cpus * 4}G||0:0|{cpus}|00:10:00|{elapsed}|cpu={cpus}|"
+      f"2024-01-{day:02d}T00:00:00|2024-01-{day:02d}T12:00:00|")
+  return lines
+
+def update_dictionary(data_dict, name, t_time, g_time, g_tr_time, c_time):
+  if name in data_dict:
+    data_dict[name]['total_hours'] += t_time
+    data_dict[name]['gpu_hours'] += g_time
+    data_dict[name]['gpu_tres_hours'] += g_tr_time
+    data_dict[name]['cpu_hours'] += c_time
+  else:
+    data_dict[name] = {'total_hours': t_time, 'gpu_hours': g_time, 'gpu_tres_hours': g_tr_time, 'cpu_hours': c_time}
+
+def loop_usage(lines, kempner_nodes, weights):
+  """The per job loop process_cpu_gpu_usage used to run."""
+  partition_dict = {}
+  user_dict = {}
+  group_dict = {}
+  for line in lines:
+    if ("gpu" in line and "RUNNING" not in line) or ("gpu" in line and "PENDING" not in line):
+      fields = line.strip().split('|')
+      gpu_tres_hours = 0
+      if len(fields) >= 8:
+        user_key = fields[2]
+        group_key = fields[3].split(',')[0]
+        partition_key = fields[4].split(',')[0]
+        gpu_thours = convert_to_hours(fields[5])
+        gpu_count = extract_gres_gpu(fields[6])
+        node_name = fields[7]
+        cpu_count = int(fields[11])
+        cpu_hours = gpu_thours*cpu_count
+        gpu_hours = gpu_count*gpu_thours
+        gpu_type = extract_gpu_type(fields[6], weights)
+        tres_factor = weights.gpu[gpu_type] if gpu_type else 0.0
+        if tres_factor > 0:
+          gpu_tres_hours = gpu_hours*tres_factor
+        partition_name = check_kempner_node(node_name, kempner_nodes, partition_key, gpu_type)
+        update_dictionary(partition_dict, partition_name, gpu_thours, gpu_hours, gpu_tres_hours, cpu_hours)
+        update_dictionary(user_dict, user_key, gpu_thours, gpu_hours, gpu_tres_hours, cpu_hours)
+        if "kempner" in group_key:
+          update_dictionary(group_dict, group_key, gpu_thours, gpu_hours, gpu_tres_hours, cpu_hours)
+  return partition_dict, group_dict, user_dict
+
+def columnar_usage(lines, kempner_nodes, weights):
+  usage = UsageColumns(lines, kempner_nodes, weights)
+  columns = usage.columns()
+  return usage.totals('partition', columns), usage.totals('group', columns), usage.totals('user', columns)
+
+def differences(old, new):
+  """Number of names missing from either side and the largest relative difference of the rest."""
+  missing = 0
+  worst = 0.0
+  for a, b in zip(old, new):
+    missing = missing + len(a.keys() ^ b.keys())
+    for name in a.keys() & b.keys():
+      for column, value in a[name].items():
+        worst = max(worst, abs(value - b[name][column]) / max(abs(value), 1e-12))
+  return missing, worst
+
+def timed(func, *args):
+  start = time.perf_counter()
+  result = func(*args)
+  return result, time.perf_counter() - start
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the ksacct usage aggregation.')
+  parser.add_argument('--jobs', type=int, default=1000000, help='finished jobs in the month')
+  parser.add_argument('--users', type=int, default=2000, help='distinct users')
+  parser.add_argument('--groups', type=int, default=300, help='distinct groups, half of them kempner labs')
+  parser.add_argument('--nodes', type=int, default=400, help='distinct GPU nodes')
+  parser.add_argument('--repeat', type=int, default=3, help='runs of each, the fastest is reported')
+  args = parser.parse_args()
+
+  lines = generate(args.jobs, args.users, args.groups, args.nodes)
+  #The kempner_dev nodes, a tenth of them
+  kempner_nodes = frozenset(expand(f"holygpu8a[000-{args.nodes // 10:03d}]"))
+  weights = slurm_weights.weights
+
+  print(f"{'aggregation':<12} {'jobs':>8} {'seconds':>10} {'us/job':>8}")
+  best = {}
+  results = {}
+  for i in range(args.repeat):
+    for name, func in (('loop', loop_usage), ('columnar', columnar_usage)):
+      results[name], seconds = timed(func, lines, kempner_nodes, weights)
+      best[name] = min(best.get(name, seconds), seconds)
+  for name, seconds in best.items():
+    print(f"{name:<12} {len(lines):>8} {seconds:>10.3f} {seconds / len(lines) * 1e6:>8.2f}")
+  print(f"speedup {best['loop'] / best['columnar']:.1f}x")
+
+  missing, worst = differences(results['loop'], results['columnar'])
+  print(f"names differing {missing}, largest relative difference {worst:.3g}")
+  if missing or worst > 1e-9:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python3.11
+
+"""
+bench_scrape.py
+Scrape a running exporter over and over and report throughput and tail latency.
+
+Pair it with synthetic_cluster.py to load test the exporter end to end without
+a slurm cluster:
+
+  benchmarks/synthetic_cluster.py /tmp/cluster --nodes 5000 --jobs 100000 --latency 0.05
+  ./slurm_exporter.py --slurm-bin-dir /tmp/cluster/bin --mode inline --port 9100 &
+  benchmarks/bench_scrape.py http://localhost:9100/metrics --requests 50 --concurrency 4
+"""
+
+import sys,os
+import argparse
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def scrape(url, timeout):
+  """Fetch url once, returning (seconds, bytes, error)."""
+  start = time.perf_counter()
+  try:
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+      size = len(resp.read())
+    return time.perf_counter() - start, size, None
+  except Exception as e:
+    return time.perf_counter() - start, 0, repr(e)
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure scrape throughput and latency of an exporter.')
+  parser.add_argument('url', help='metrics URL to scrape')
+  parser.add_argument('--requests', type=int, default=20, help='number of scrapes')
+  parser.add_argument('--concurrency', type=int, default=1, help='scrapes in flight at once')
+  parser.add_argument('--timeout', type=float, default=120, help='seconds before a scrape is counted as failed')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+    results = list(pool.map(lambda i: scrape(args.url, args.timeout), range(args.requests)))
+  wall = time.perf_counter() - start
+
+  times = [t for t, size, error in results if error is None]
+  errors = [error for t, size, error in results if error is not None]
+  print(f"{len(results)} scrapes in {wall:.2f}s ({len(results) / wall:.2f}/s) with {args.concurrency} in flight, {len(errors)} failed")
+  if times:
+    sizes = [size for t, size, error in results if error is None]
+    print(f"latency p50 {percentile(times, 50):.3f}s p90 {percentile(times, 90):.3f}s p99 {percentile(times, 99):.3f}s max {max(times):.3f}s")
+    print(f"response {sum(sizes) / len(sizes) / 1024:.1f} KiB")
+  for error in sorted(set(errors)):
+    print(f"  {errors.count(error)} x {error}")
+  sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,317 @@
+#!/usr/bin/python3.11
+
+"""
+fake_slurm.py
+Stand in for scontrol, sinfo, squeue, sacct, sdiag, sshare and showq.
+
+Replays a cluster written by synthetic_cluster.py, honouring the options the
+collectors use (output formats, partition, account, state and time filters)
+after sleeping for the configured latency.  synthetic_cluster.py writes a
+wrapper per command into DIR/bin that runs
+
+  fake_slurm.py <command> [args...]
+
+with FAKE_SLURM_DIR pointing at the cluster.  FAKE_SLURM_LATENCY (e.g. 0.05
+or 0.05,sacct=0.5) and FAKE_SLURM_TAIL (e.g. 0.01:5) override the latency the
+cluster was written with.
+"""
+
+import sys,os
+import json
+import random
+import re
+import time
+from collections import defaultdict
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+sys.path = [prefix] + sys.path
+
+from slurm_hostlist import expand
+from synthetic_cluster import SACCT_FIELDS, SQUEUE_FIELDS, SSHARE_FIELDS, compress, parse_latency
+
+directory = os.environ.get('FAKE_SLURM_DIR', '.')
+
+def data(name):
+  return open(os.path.join(directory, name))
+
+def fail(message):
+  sys.stderr.write(message + '\n')
+  sys.exit(1)
+
+def delay(command, config):
+  """Sleep for as long as the real command would take."""
+  latency = config.get('latency') or {}
+  if os.environ.get('FAKE_SLURM_LATENCY'):
+    latency = parse_latency(os.environ['FAKE_SLURM_LATENCY'])
+  tail = config.get('tail')
+  if os.environ.get('FAKE_SLURM_TAIL'):
+    tail = [float(x) for x in os.environ['FAKE_SLURM_TAIL'].split(':')]
+  seconds = latency.get(command, latency.get('default', 0.0)) * random.uniform(0.5, 1.5)
+  if tail and random.random() < tail[0]:
+    seconds = tail[1]
+  time.sleep(seconds)
+
+def option(args, *names, default=None):
+  """Value of an option given as -p X, --partition X or --partition=X."""
+  for i, arg in enumerate(args):
+    for name in names:
+      if arg == name and i + 1 < len(args):
+        return args[i + 1]
+      if name.startswith('--') and arg.startswith(name + '='):
+        return arg[len(name) + 1:]
+      if not name.startswith('--') and arg.startswith(name) and len(arg) > len(name):
+        return arg[len(name):]
+  return default
+
+def flag(args, *names):
+  return any(a in names for a in args)
+
+def table(name):
+  """Rows of a pipe separated file as dicts keyed by its header."""
+  with data(name) as f:
+    header = next(f).rstrip('\n').split('|')
+    for line in f:
+      yield dict(zip(header, line.rstrip('\n').split('|')))
+
+def format_fields(spec, known):
+  """Split --format=JobID,user%-24,... into (field, width) pairs matched case insensitively against known."""
+  lookup = {k.lower(): k for k in known}
+  fields = []
+  for f in spec.split(','):
+    name, sep, width = f.partition('%')
+    name, sep2, width2 = name.partition(':')
+    fields.append((lookup.get(name.strip().lower(), name), width or width2))
+  return fields
+
+def scontrol(args):
+  if '--json' in args or '--yaml' in args:
+    fail('scontrol: the fake only replays text output')
+  words = [a for a in args if not a.startswith('-')]
+  if len(words) < 2 or words[0] != 'show':
+    fail(f"scontrol: unsupported command {' '.join(args)}")
+  entity = words[1]
+  name = words[2] if len(words) > 2 else None
+  files = {'node': 'scontrol_node.txt', 'nodes': 'scontrol_node.txt', 'partition': 'scontrol_partition.txt',
+    'partitions': 'scontrol_partition.txt', 'job': 'scontrol_job.txt', 'jobs': 'scontrol_job.txt'}
+  if entity not in files:
+    fail(f"scontrol: unsupported entity {entity}")
+  detail = flag(args, '-d', '--details') or any(re.match(r'-\w*d', a) for a in args if not a.startswith('--'))
+  key = {'node': 'NodeName=', 'nodes': 'NodeName=', 'partition': 'PartitionName=', 'partitions': 'PartitionName=',
+    'job': 'JobId=', 'jobs': 'JobId='}[entity]
+  out = sys.stdout
+  with data(files[entity]) as f:
+    for line in f:
+      if name and not line.startswith(f"{key}{name} "):
+        continue
+      if entity.startswith('job') and not detail:
+        line = re.sub(r'  Nodes=\S+ CPU_IDs=\S+ Mem=\S+ GRES=\S* ', '', line)
+      out.write(line)
+
+SINFO_STATES = {'ALLOCATED': 'allocated', 'MIXED': 'mixed', 'IDLE': 'idle', 'DOWN': 'down'}
+SINFO_SHORT = {'allocated': 'alloc', 'mixed': 'mix', 'idle': 'idle', 'down': 'down', 'drained': 'drain', 'draining': 'drng', 'reserved': 'resv'}
+
+def sinfo_state(state):
+  """Turn a node State such as MIXED+DRAIN into what sinfo %T prints."""
+  flags = state.split('+')
+  base = SINFO_STATES.get(flags[0], flags[0].lower())
+  if 'DRAIN' in flags:
+    base = 'drained' if base == 'idle' else 'draining'
+  elif 'RESERVED' in flags:
+    base = 'reserved'
+  if 'NOT_RESPONDING' in flags:
+    base = base + '*'
+  return base
+
+def sinfo(args):
+  partitions = option(args, '-p', '--partition')
+  partitions = set(partitions.split(',')) if partitions else None
+  nodes = option(args, '-n', '--nodes')
+  nodes = set(expand(nodes)) if nodes else None
+  node_oriented = flag(args, '-N', '--Node') or any(re.match(r'-\w*N', a) for a in args if not a.startswith('--'))
+  header = not (flag(args, '-h', '--noheader') or any(re.match(r'-\w*h', a) for a in args if not a.startswith('--')))
+  fmt = option(args, '-o', '--format')
+  if fmt is None:
+    fmt = '%N %.6D %P %t' if node_oriented else '%P %.5a %.10l %.6D %.6t %N'
+  fmt = fmt.strip('"')
+
+  rows = []
+  for line in data('sinfo.txt'):
+    name, partition, state, cpus, mem, gres, features = line.rstrip('\n').split('|')
+    if partitions and partition not in partitions:
+      continue
+    if nodes and name not in nodes:
+      continue
+    rows.append({'N': name, 'R': partition, 'P': partition, 'T': sinfo_state(state), 'c': cpus, 'm': mem, 'G': gres,
+      'f': features, 'D': '1', 'a': 'up', 'l': '3-00:00:00'})
+
+  if not node_oriented:
+    #Nodes are summarized by partition and state
+    groups = defaultdict(list)
+    for row in rows:
+      groups[(row['R'], row['T'])].append(row)
+    rows = []
+    for (partition, state), members in groups.items():
+      row = dict(members[0])
+      row['N'] = compress(r['N'] for r in members)
+      row['D'] = str(len(members))
+      rows.append(row)
+  for row in rows:
+    row['t'] = SINFO_SHORT.get(row['T'].rstrip('*'), row['T'][:5]) + ('*' if row['T'].endswith('*') else '')
+
+  spec = re.compile(r'%(-?)\.?(\d*)([A-Za-z])')
+  names = {'N': 'NODELIST', 'R': 'PARTITION', 'P': 'PARTITION', 'T': 'STATE', 't': 'STATE', 'c': 'CPUS', 'm': 'MEMORY',
+    'G': 'GRES', 'f': 'AVAIL_FEATURES', 'D': 'NODES', 'a': 'AVAIL', 'l': 'TIMELIMIT'}
+  def field(m, values):
+    value = values.get(m.group(3), '')
+    width = int(m.group(2) or 0)
+    return value.ljust(width) if m.group(1) else value.rjust(width)
+  def render(values):
+    return spec.sub(lambda m: field(m, values), fmt)
+  out = sys.stdout
+  if header:
+    out.write(render(names) + '\n')
+  for row in rows:
+    out.write(render(row) + '\n')
+
+def squeue(args):
+  accounts = option(args, '-A', '--account')
+  accounts = set(accounts.split(',')) if accounts else None
+  partitions = option(args, '-p', '--partition')
+  partitions = set(partitions.split(',')) if partitions else None
+  states = option(args, '-t', '--states')
+  states = set(s.upper() for s in states.split(',')) if states else None
+  users = option(args, '-u', '--user')
+  users = set(users.split(',')) if users else None
+  header = not flag(args, '-h', '--noheader')
+  spec = option(args, '-O', '--Format', default='JobID,Partition,UserName,State,NumNodes,Reason')
+
+  fields = []
+  for f in spec.split(','):
+    name, sep, width = f.partition(':')
+    fields.append((name, int(width) if width else 20))
+  lookup = {k.lower(): k for k in SQUEUE_FIELDS}
+
+  out = sys.stdout
+  if header:
+    out.write(''.join(name.upper().ljust(width) for name, width in fields) + '\n')
+  for row in table('squeue.txt'):
+    if accounts and row['Account'] not in accounts:
+      continue
+    if partitions and not partitions.intersection(row['Partition'].split(',')):
+      continue
+    if states and row['State'] not in states:
+      continue
+    if users and row['UserName'] not in users:
+      continue
+    #squeue pads every column and always leaves a space after it
+    out.write(''.join(row.get(lookup.get(name.lower(), name), '')[:width - 1].ljust(width) for name, width in fields) + '\n')
+
+def sacct_time(value, default):
+  if not value:
+    return default
+  if value == 'now':
+    return time.strftime('%Y-%m-%dT%H:%M:%S')
+  if 'T' not in value:
+    value = value + 'T00:00:00'
+  return value
+
+def sacct(args):
+  if '--json' in args:
+    fail('sacct: the fake only replays text output')
+  partitions = option(args, '-r', '--partition')
+  partitions = set(partitions.split(',')) if partitions else None
+  accounts = option(args, '-A', '--accounts')
+  accounts = set(accounts.split(',')) if accounts else None
+  nodes = option(args, '-N', '--nodelist')
+  nodes = set(expand(nodes)) if nodes else None
+  states = option(args, '-s', '--state')
+  states = set(s.upper() for s in states.split(',')) if states else None
+  short = {'BF': 'BOOT_FAIL', 'CA': 'CANCELLED', 'CD': 'COMPLETED', 'DL': 'DEADLINE', 'F': 'FAILED', 'NF': 'NODE_FAIL',
+    'OOM': 'OUT_OF_MEMORY', 'PR': 'PREEMPTED', 'TO': 'TIMEOUT', 'R': 'RUNNING', 'PD': 'PENDING'}
+  if states:
+    states = {short.get(s, s) for s in states}
+  #sacct reports jobs since midnight unless told otherwise
+  start = sacct_time(option(args, '-S', '--starttime'), time.strftime('%Y-%m-%dT00:00:00'))
+  end = sacct_time(option(args, '-E', '--endtime'), '9999-12-31T23:59:59')
+
+  parsable = flag(args, '-P', '--parsable2', '-p', '--parsable')
+  #-p ends every line with a | where --parsable2 does not
+  trailing = flag(args, '-p', '--parsable')
+  header = not flag(args, '-n', '--noheader')
+  fields = format_fields(option(args, '-o', '--format', default='JobID,JobName,Partition,Account,AllocCPUS,State,ExitCode'), SACCT_FIELDS)
+
+  def render(values):
+    if parsable:
+      return '|'.join(values) + ('|' if trailing else '')
+    return ' '.join(v.ljust(int(w.lstrip('-') or 10))[:int(w.lstrip('-') or 10)] for v, (f, w) in zip(values, fields))
+
+  out = sys.stdout
+  if header:
+    out.write(render([f for f, w in fields]) + '\n')
+  for row in table('sacct.txt'):
+    if partitions and not partitions.intersection(row['Partition'].split(',')):
+      continue
+    if accounts and row['Account'] not in accounts:
+      continue
+    if states:
+      #With --state only jobs that were in one of the states during the window are reported
+      if row['State'] not in states or not (start <= row['End'] <= end):
+        continue
+    elif not (row['Submit'] <= end and (row['End'] == 'Unknown' or row['End'] >= start)):
+      continue
+    if nodes and not nodes.intersection(expand(row['NodeList'])):
+      continue
+    out.write(render([row.get(f, '') for f, w in fields]) + '\n')
+
+def sdiag(args):
+  with data('sdiag.txt') as f:
+    sys.stdout.write(f.read())
+
+def sshare(args):
+  fields = format_fields(option(args, '-o', '--format', default=','.join(SSHARE_FIELDS)), SSHARE_FIELDS)
+  parsable = flag(args, '-P', '--parsable2') or any(re.match(r'-\w*P', a) for a in args if not a.startswith('--'))
+  header = not (flag(args, '-h', '--noheader') or any(re.match(r'-\w*h', a) for a in args if not a.startswith('--')))
+  out = sys.stdout
+  rows = list(table('sshare.txt'))
+  if header:
+    rows.insert(0, {f: f for f, w in fields})
+  for row in rows:
+    values = [row.get(f, '') for f, w in fields]
+    out.write(('|'.join(values) if parsable else ' '.join(v.rjust(10) for v in values)) + '\n')
+
+def showq(args):
+  partition = option(args, '-p')
+  name = os.path.join(directory, 'showq', (partition or 'ALL') + '.txt')
+  if not os.path.exists(name):
+    fail(f"showq: unknown partition {partition}")
+  with open(name) as f:
+    sys.stdout.write(f.read())
+
+COMMANDS = {
+  'scontrol': scontrol,
+  'sinfo': sinfo,
+  'squeue': squeue,
+  'sacct': sacct,
+  'sdiag': sdiag,
+  'sshare': sshare,
+  'showq': showq,
+}
+
+def main():
+  if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+    fail(f"usage: fake_slurm.py {{{','.join(COMMANDS)}}} [args...]")
+  command = sys.argv[1]
+  with data('cluster.json') as f:
+    config = json.load(f)
+  delay(command, config)
+  try:
+    COMMANDS[command](sys.argv[2:])
+    sys.stdout.flush()
+  except BrokenPipeError:
+    #The reader (e.g. head, or a collector that gave up) went away
+    sys.stderr.close()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3.11
+
+"""
+slurmrestd_stub.py
+A stand in for slurmrestd that replays recorded responses.
+
+GET /slurm/<version>/<endpoint> answers with fixtures/slurmrestd/<endpoint>.json
+over keep-alive HTTP/1.1, on TCP or a unix socket, so the REST backend can be
+exercised and timed without a slurm cluster.  Point the exporter at it with
+--slurmrestd http://localhost:6820 (or unix:/path/to/socket).
+"""
+
+import sys,os
+import argparse
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+
+fixtures = os.path.join(prefix, 'benchmarks', 'fixtures', 'slurmrestd')
+
+class StubHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    super().setup()
+    self.server.connections = self.server.connections + 1
+
+  def do_GET(self):
+    self.server.requests = self.server.requests + 1
+    parts = self.path.strip('/').split('/')
+    name = os.path.join(self.server.fixtures, parts[-1] + '.json')
+    if len(parts) != 3 or parts[0] != 'slurm' or not os.path.isfile(name):
+      body = b'{"errors": [{"error": "Unknown endpoint"}]}'
+      self.send_response(404)
+    else:
+      with open(name, 'rb') as f:
+        body = f.read()
+      self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def address_string(self):
+    #Unix socket clients have no address
+    return str(self.client_address or 'unix')
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      super().log_message(format, *args)
+
+class UnixStubServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+def serve(url, directory=fixtures, verbose=False):
+  """Build a stub server for http://host:port or unix:/path."""
+  if url.startswith('unix:'):
+    path = url[len('unix:'):]
+    if os.path.exists(path):
+      os.unlink(path)
+    server = UnixStubServer(path, StubHandler)
+  else:
+    host, port = url.split('//')[-1].rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), StubHandler)
+  server.fixtures = directory
+  server.verbose = verbose
+  server.connections = 0
+  server.requests = 0
+  return server
+
+def main():
+  parser = argparse.ArgumentParser(description='Replay recorded slurmrestd responses.')
+  parser.add_argument('--listen', default='http://localhost:6820', help='http://host:port or unix:/path to listen on')
+  parser.add_argument('--fixtures', default=fixtures, help='directory of <endpoint>.json responses')
+  parser.add_argument('--verbose', action='store_true', help='log every request')
+  args = parser.parse_args()
+
+  server = serve(args.listen, args.fixtures, args.verbose)
+  print(f"Replaying {args.fixtures} on {args.listen}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,594 @@
+#!/usr/bin/python3.11
+
+"""
+synthetic_cluster.py
+Generate a consistent synthetic slurm cluster for load testing.
+
+The cluster has icelake, genoa, a100 and h100 nodes spread over overlapping
+partitions with different PriorityTiers, running and pending jobs (array
+tasks, multi node jobs with their per node CPU_IDs detail, requeued jobs)
+and a history of finished jobs for sacct.  Node allocations are the sums of
+the jobs running on them so every command tells the same story.
+
+The output directory holds the rendered output of every command plus a bin
+directory of fake scontrol, sinfo, squeue, sacct, sdiag, sshare and showq
+commands (see fake_slurm.py) that replay it with a configurable latency.
+Point the exporter at them with --slurm-bin-dir DIR/bin or
+SLURM_EXPORTER_BIN_DIR=DIR/bin.
+"""
+
+import sys,os
+import argparse
+import json
+import random
+import re
+import time
+from collections import defaultdict
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+sys.path = [prefix] + sys.path
+
+from slurm_json import elapsed, memory
+
+FAKE_COMMANDS = ('scontrol', 'sinfo', 'squeue', 'sacct', 'sdiag', 'sshare', 'showq')
+
+#Node groups: name prefix, share of the nodes, cpus, memory in MB, features, gpu type, gpus and partitions
+NODE_GROUPS = [
+  ('holy7c', 0.35, 64, 256000, 'intel,holyhdr,icelake,avx,avx2,avx512', None, 0, ('shared', 'serial_requeue')),
+  ('holy8a', 0.30, 192, 1500000, 'amd,holyndr,genoa,avx,avx2,avx512', None, 0, ('shared', 'seas_compute', 'serial_requeue')),
+  ('holygpu7c', 0.10, 64, 515000, 'amd,holyhdr,milan,avx,avx2,gpu,a100,cc8.0', 'nvidia_a100-sxm4-80gb', 4, ('gpu', 'seas_gpu', 'gpu_requeue')),
+  ('holygpu8a', 0.15, 96, 1031000, 'amd,holyndr,genoa,avx,avx2,avx512,gpu,h100,cc9.0', 'nvidia_h100_80gb_hbm3', 4, ('kempner_h100', 'kempner_requeue', 'gpu_requeue')),
+  ('holygpu8b', 0.07, 64, 1031000, 'amd,holyndr,milan,avx,avx2,gpu,a100,cc8.0', 'nvidia_a100-sxm4-80gb', 4, ('kempner', 'kempner_requeue', 'gpu_requeue')),
+  ('holygpu8d', 0.03, 96, 1031000, 'amd,holyndr,genoa,avx,avx2,avx512,gpu,h100,cc9.0', 'nvidia_h100_80gb_hbm3', 4, ('kempner_dev', 'kempner_h100', 'kempner_requeue', 'gpu_requeue')),
+]
+
+#Partition PriorityTier, TRESBillingWeights and the accounts that may use it (None for anyone)
+PARTITIONS = {
+  'shared': (4, 'CPU=1.0,Mem=0.25G', 'general'),
+  'seas_compute': (4, 'CPU=0.6,Mem=0.1G', 'seas'),
+  'serial_requeue': (1, 'CPU=1.0,Mem=0.25G', None),
+  'gpu': (4, 'CPU=0.5,Mem=0.1G,Gres/gpu=209.1', 'general'),
+  'seas_gpu': (4, 'CPU=0.5,Mem=0.1G,Gres/gpu=209.1', 'seas'),
+  'gpu_requeue': (1, 'CPU=0.5,Mem=0.1G,Gres/gpu=209.1', None),
+  'kempner': (4, 'CPU=0.5,Mem=0.1G,Gres/gpu=209.1', 'kempner'),
+  'kempner_h100': (4, 'CPU=0.6,Mem=0.1G,Gres/gpu=546.9', 'kempner'),
+  'kempner_dev': (4, 'CPU=0.6,Mem=0.1G,Gres/gpu=546.9', 'kempner'),
+  'kempner_requeue': (1, 'CPU=0.6,Mem=0.1G,Gres/gpu=546.9', 'kempner'),
+}
+
+ACCOUNTS = {
+  'kempner': ['kempner_lab', 'kempner_grads', 'kempner_fellows'],
+  'seas': ['aizenberg_lab', 'barak_lab', 'kozinsky_lab', 'pehlevan_lab', 'seas_computing', 'zickler_lab'],
+  'general': [f"lab{i:02d}_lab" for i in range(40)],
+}
+
+END_STATES = [('COMPLETED', 0.80), ('FAILED', 0.08), ('CANCELLED', 0.06), ('TIMEOUT', 0.04), ('OUT_OF_MEMORY', 0.02)]
+PENDING_REASONS = ['Priority', 'Resources', 'Dependency', 'QOSMaxCPUPerUserLimit', 'BeginTime']
+
+#Every field the fake sacct can be asked for, in the order sacct.txt stores them
+SACCT_FIELDS = ['JobID', 'JobIDRaw', 'User', 'Group', 'Partition', 'Account', 'State', 'AllocCPUS', 'ReqMem', 'ReqTRES',
+  'Start', 'End', 'Elapsed', 'AllocTRES', 'NodeList', 'NCPUs', 'ReqCPUS', 'Submit', 'Eligible', 'Reason',
+  'ExitCode', 'MaxRSS', 'TotalCPU', 'CPUTime', 'Restarts']
+
+SQUEUE_FIELDS = ['JobID', 'UserName', 'Account', 'Partition', 'State', 'RestartCnt', 'PendingTime', 'NumCPUs', 'NumNodes', 'Reason', 'NodeList']
+
+SSHARE_FIELDS = ['User', 'Account', 'RawShares', 'NormShares', 'RawUsage', 'NormUsage', 'Fairshare']
+
+def compress(names):
+  """Turn node names into a hostlist such as holy7c[0001-0003,0005]."""
+  groups = defaultdict(list)
+  plain = []
+  for name in names:
+    m = re.match(r'(.*?)(\d+)$', name)
+    if m:
+      groups[(m.group(1), len(m.group(2)))].append(int(m.group(2)))
+    else:
+      plain.append(name)
+  out = []
+  for (head, width), numbers in sorted(groups.items()):
+    numbers = sorted(set(numbers))
+    if len(numbers) == 1:
+      out.append(head + str(numbers[0]).zfill(width))
+      continue
+    ranges = []
+    lo = hi = numbers[0]
+    for n in numbers[1:] + [None]:
+      if n is not None and n == hi + 1:
+        hi = n
+        continue
+      ranges.append(str(lo).zfill(width) if lo == hi else f"{str(lo).zfill(width)}-{str(hi).zfill(width)}")
+      if n is not None:
+        lo = hi = n
+    out.append(f"{head}[{','.join(ranges)}]")
+  return ','.join(out + plain)
+
+def id_ranges(ids):
+  """Format cpu or gpu indexes as 0-3,8 the way scontrol does."""
+  ranges = []
+  for i in ids:
+    if ranges and ranges[-1][1] == i - 1:
+      ranges[-1][1] = i
+    else:
+      ranges.append([i, i])
+  return ','.join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in ranges)
+
+def iso(t):
+  return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t))
+
+class Node:
+  def __init__(self, name, group):
+    prefix, share, cpus, mem, features, gputype, gpus, partitions = group
+    self.name = name
+    self.cpus = cpus
+    self.mem = mem
+    self.features = features
+    self.gputype = gputype
+    self.gpus = gpus
+    self.partitions = partitions
+    self.flags = []
+    #Next free cpu and gpu index, allocations are handed out from the bottom up
+    self.cpualloc = 0
+    self.memalloc = 0
+    self.gpualloc = 0
+
+  def usable(self):
+    return not self.flags
+
+  def fits(self, cpus, mem, gpus):
+    return self.usable() and self.cpualloc + cpus <= self.cpus and self.memalloc + mem <= self.mem and self.gpualloc + gpus <= self.gpus
+
+  def allocate(self, cpus, mem, gpus):
+    """Take cpus, mem and gpus and return the cpu and gpu indexes used."""
+    cpu_ids = list(range(self.cpualloc, self.cpualloc + cpus))
+    gpu_ids = list(range(self.gpualloc, self.gpualloc + gpus))
+    self.cpualloc = self.cpualloc + cpus
+    self.memalloc = self.memalloc + mem
+    self.gpualloc = self.gpualloc + gpus
+    return cpu_ids, gpu_ids
+
+  def state(self):
+    if 'DOWN' in self.flags:
+      return 'DOWN+NOT_RESPONDING'
+    if self.cpualloc == 0:
+      base = 'IDLE'
+    elif self.cpualloc == self.cpus:
+      base = 'ALLOCATED'
+    else:
+      base = 'MIXED'
+    return '+'.join([base] + self.flags)
+
+class Cluster:
+  def __init__(self, nodes=1000, jobs=10000, finished=None, days=7, seed=0, now=None):
+    self.random = random.Random(seed)
+    self.now = int(now or time.time())
+    self.days = days
+    self.nodes = []
+    self.jobs = []
+    self.finished = []
+    self.users = {}
+    self.make_nodes(nodes)
+    self.make_users()
+    self.make_jobs(jobs)
+    self.make_finished(jobs if finished is None else finished)
+
+  def make_nodes(self, count):
+    for group in NODE_GROUPS:
+      for i in range(max(int(round(count * group[1])), 1)):
+        self.nodes.append(Node(f"{group[0]}{i + 1:04d}", group))
+    for node in self.nodes:
+      roll = self.random.random()
+      if roll < 0.01:
+        node.flags = ['DOWN']
+      elif roll < 0.03:
+        node.flags = ['DRAIN']
+      elif roll < 0.04:
+        node.flags = ['RESERVED']
+    self.partition_nodes = defaultdict(list)
+    for node in self.nodes:
+      for p in node.partitions:
+        self.partition_nodes[p].append(node)
+
+  def make_users(self):
+    uid = 20000
+    for kind, accounts in ACCOUNTS.items():
+      for account in accounts:
+        self.users[account] = []
+        for i in range(self.random.randint(3, 15)):
+          uid = uid + 1
+          self.users[account].append((f"u{uid}", uid))
+
+  def pick_account(self, partition):
+    kind = PARTITIONS[partition][2] or self.random.choice(['general', 'general', 'seas'])
+    account = self.random.choice(ACCOUNTS[kind])
+    return account, self.random.choice(self.users[account])
+
+  def make_jobs(self, count):
+    #Partitions are picked in proportion to how many nodes they have
+    partitions = sorted(self.partition_nodes)
+    weights = [len(self.partition_nodes[p]) for p in partitions]
+    jobid = 1000000
+    while len(self.jobs) < count:
+      jobid = jobid + 1
+      partition = self.random.choices(partitions, weights)[0]
+      account, (user, uid) = self.pick_account(partition)
+      job = {
+        'id': jobid, 'user': user, 'uid': uid, 'account': account, 'partition': partition,
+        'submit': self.now - self.random.randint(60, 3 * 86400), 'restarts': 0, 'allocations': [],
+      }
+      if partition.endswith('_requeue') and self.random.random() < 0.2:
+        job['restarts'] = self.random.randint(1, 4)
+
+      gpu = self.partition_nodes[partition][0].gpus > 0
+      nnodes = self.random.randint(2, 8) if not partition.endswith('_requeue') and self.random.random() < 0.1 else 1
+      cpus = self.random.choice([1, 2, 4, 8, 16, 32, 48, 64])
+      gpus = self.random.randint(1, 4) if gpu else 0
+      mem = cpus * self.random.choice([1000, 4000, 8000])
+
+      if self.random.random() < 0.6 and self.place(job, nnodes, cpus, mem, gpus):
+        job['state'] = 'RUNNING'
+        job['reason'] = 'None'
+        job['start'] = max(job['submit'], self.now - self.random.randint(60, 2 * 86400))
+        #Some running jobs are tasks of an array
+        if self.random.random() < 0.15:
+          job['array'] = (jobid, self.random.randint(0, 99))
+      else:
+        job['state'] = 'PENDING'
+        job['reason'] = self.random.choice(PENDING_REASONS)
+        job['start'] = None
+        job['request'] = (nnodes, cpus, mem, gpus)
+        if self.random.random() < 0.2:
+          lo = self.random.randint(0, 50)
+          job['array'] = (jobid, f"{lo}-{lo + self.random.randint(1, 500)}%{self.random.choice([5, 10, 50])}")
+        if partition in ('shared', 'gpu') and self.random.random() < 0.2:
+          job['partition'] = partition + ',' + ('serial_requeue' if partition == 'shared' else 'gpu_requeue')
+        if self.random.random() < 0.01:
+          job['cron'] = True
+      self.jobs.append(job)
+
+  def place(self, job, nnodes, cpus, mem, gpus):
+    """Find nnodes nodes of the job's partition with room for it and allocate them."""
+    candidates = self.partition_nodes[job['partition']]
+    chosen = []
+    for attempt in range(nnodes * 8):
+      node = self.random.choice(candidates)
+      if node not in chosen and node.fits(cpus, mem, gpus):
+        chosen.append(node)
+        if len(chosen) == nnodes:
+          break
+    if len(chosen) < nnodes:
+      return False
+    for node in chosen:
+      cpu_ids, gpu_ids = node.allocate(cpus, mem, gpus)
+      job['allocations'].append((node, cpu_ids, mem, gpu_ids))
+    return True
+
+  def make_finished(self, count):
+    partitions = sorted(self.partition_nodes)
+    weights = [len(self.partition_nodes[p]) for p in partitions]
+    states = [s for s, w in END_STATES]
+    state_weights = [w for s, w in END_STATES]
+    jobid = 100000
+    for i in range(count):
+      jobid = jobid + 1
+      partition = self.random.choices(partitions, weights)[0]
+      account, (user, uid) = self.pick_account(partition)
+      nodes = self.partition_nodes[partition]
+      node = self.random.choice(nodes)
+      cpus = self.random.choice([1, 2, 4, 8, 16, 32])
+      gpus = self.random.randint(1, node.gpus) if node.gpus else 0
+      end = self.now - self.random.randint(0, self.days * 86400)
+      run = self.random.randint(30, 2 * 86400)
+      self.finished.append({
+        'id': jobid, 'user': user, 'uid': uid, 'account': account, 'partition': partition,
+        'state': self.random.choices(states, state_weights)[0], 'reason': 'None', 'restarts': 0,
+        'submit': end - run - self.random.randint(0, 3600), 'start': end - run, 'end': end,
+        'node': node, 'cpus': cpus, 'mem': cpus * 4000, 'gpus': gpus,
+      })
+
+  #Rendering
+
+  def node_lines(self):
+    for node in self.nodes:
+      cfgtres = f"cpu={node.cpus},mem={node.mem}M,billing={node.cpus}"
+      alloctres = ''
+      if node.cpualloc:
+        alloctres = f"cpu={node.cpualloc},mem={node.memalloc}M"
+      if node.gpus:
+        cfgtres = cfgtres + f",gres/gpu={node.gpus},gres/gpu:{node.gputype}={node.gpus}"
+        if node.gpualloc:
+          alloctres = alloctres + f",gres/gpu={node.gpualloc},gres/gpu:{node.gputype}={node.gpualloc}"
+      down = 'DOWN' in node.flags
+      load = 'N/A' if down else f"{node.cpualloc * self.random.uniform(0.5, 1.0):.2f}"
+      free = 'N/A' if down else str(node.mem - int(node.memalloc * self.random.uniform(0.3, 1.0)))
+      gres = f"gpu:{node.gputype}:{node.gpus}(S:0-1)" if node.gpus else '(null)'
+      line = (f"NodeName={node.name} Arch=x86_64 CoresPerSocket={node.cpus // 2} CPUAlloc={node.cpualloc} CPUEfctv={node.cpus} "
+        f"CPUTot={node.cpus} CPULoad={load} AvailableFeatures={node.features} ActiveFeatures={node.features} Gres={gres} "
+        f"NodeAddr={node.name} NodeHostName={node.name} Version=24.05.4 OS=Linux 4.18.0-513.el8.x86_64 #1 SMP "
+        f"RealMemory={node.mem} AllocMem={node.memalloc} FreeMem={free} Sockets=2 Boards=1 State={node.state()} "
+        f"ThreadsPerCore=1 TmpDisk=0 Weight=1 Owner=N/A MCS_label=N/A Partitions={','.join(node.partitions)} "
+        f"BootTime={iso(self.now - 30 * 86400)} SlurmdStartTime={iso(self.now - 30 * 86400)} "
+        f"CfgTRES={cfgtres} AllocTRES={alloctres} CapWatts=n/a CurrentWatts=0 AveWatts=0")
+      if node.flags and node.flags[0] in ('DOWN', 'DRAIN'):
+        line = line + f" Reason=synthetic {node.flags[0].lower()} [root@{iso(self.now - 86400)}]"
+      yield line
+
+  def partition_lines(self):
+    for name, (tier, weights, accounts) in PARTITIONS.items():
+      nodes = self.partition_nodes[name]
+      cpus = sum(n.cpus for n in nodes)
+      tres = f"cpu={cpus},mem={sum(n.mem for n in nodes)}M,node={len(nodes)},billing={cpus}"
+      gpus = sum(n.gpus for n in nodes)
+      if gpus:
+        tres = tres + f",gres/gpu={gpus}"
+      allow = 'ALL' if accounts is None else ','.join(ACCOUNTS[accounts])
+      yield (f"PartitionName={name} AllowGroups=ALL AllowAccounts={allow} AllowQos=ALL AllocNodes=ALL Default=NO QoS=N/A "
+        f"DefaultTime=00:10:00 DisableRootJobs=NO ExclusiveUser=NO GraceTime=0 Hidden=NO MaxNodes=UNLIMITED "
+        f"MaxTime=3-00:00:00 MinNodes=0 LLN=NO MaxCPUsPerNode=UNLIMITED MaxCPUsPerSocket=UNLIMITED "
+        f"Nodes={compress(n.name for n in nodes)} PriorityJobFactor=1 PriorityTier={tier} RootOnly=NO ReqResv=NO "
+        f"OverSubscribe=NO OverTimeLimit=NONE PreemptMode={'REQUEUE' if tier == 1 else 'OFF'} State=UP "
+        f"TotalCPUs={cpus} TotalNodes={len(nodes)} SelectTypeParameters=NONE JobDefaults=(null) DefMemPerCPU=1024 "
+        f"MaxMemPerNode=UNLIMITED TRES={tres} TRESBillingWeights={weights}")
+
+  def job_tres(self, job):
+    allocations = job['allocations']
+    if allocations:
+      cpus = sum(len(a[1]) for a in allocations)
+      mem = sum(a[2] for a in allocations)
+      gpus = sum(len(a[3]) for a in allocations)
+      nnodes = len(allocations)
+      gputype = allocations[0][0].gputype
+    else:
+      nnodes, cpus, mem, gpus = job['request']
+      cpus, mem, gpus = cpus * nnodes, mem * nnodes, gpus * nnodes
+      gputype = self.partition_nodes[job['partition'].split(',')[0]][0].gputype
+    tres = f"cpu={cpus},mem={memory(mem)},node={nnodes},billing={cpus}"
+    if gpus:
+      tres = tres + f",gres/gpu={gpus},gres/gpu:{gputype}={gpus}"
+    return nnodes, cpus, mem, gpus, tres
+
+  def job_lines(self):
+    for job in self.jobs:
+      nnodes, cpus, mem, gpus, tres = self.job_tres(job)
+      running = job['state'] == 'RUNNING'
+      nodelist = compress(a[0].name for a in job['allocations']) if running else '(null)'
+      array = ''
+      if 'array' in job:
+        array = f"ArrayJobId={job['array'][0]} ArrayTaskId={job['array'][1]} "
+      line = (f"JobId={job['id']} {array}JobName=job{job['id'] % 97} UserId={job['user']}({job['uid']}) "
+        f"GroupId={job['account']}({job['uid'] // 10}) MCS_label=N/A Priority={self.random.randint(1, 100000)} Nice=0 "
+        f"Account={job['account']} QOS=normal JobState={job['state']} Reason={job['reason']} Dependency=(null) "
+        f"Requeue=1 Restarts={job['restarts']} BatchFlag=1 Reboot=0 ExitCode=0:0 "
+        f"RunTime={elapsed(self.now - job['start']) if running else '00:00:00'} TimeLimit=3-00:00:00 TimeMin=N/A "
+        f"SubmitTime={iso(job['submit'])} EligibleTime={iso(job['submit'])} "
+        f"StartTime={iso(job['start']) if running else 'Unknown'} EndTime={iso(job['start'] + 3 * 86400) if running else 'Unknown'} "
+        f"Deadline=N/A Partition={job['partition']} AllocNode:Sid=holylogin01:{job['id'] % 65536} ReqNodeList=(null) "
+        f"ExcNodeList=(null) NodeList={nodelist} BatchHost={job['allocations'][0][0].name if running else '(null)'} "
+        f"NumNodes={nnodes} NumCPUs={cpus} NumTasks={nnodes} CPUs/Task={cpus // nnodes} ReqB:S:C:T=0:0:*:* "
+        f"ReqTRES={tres} AllocTRES={tres if running else '(null)'} Socks/Node=* NtasksPerN:B:S:C=0:0:*:* CoreSpec=* ")
+      if running:
+        line = line + f"JOB_GRES={'gpu:' + job['allocations'][0][0].gputype + ':' + str(gpus) if gpus else '(null)'} "
+        for node, cpu_ids, amem, gpu_ids in job['allocations']:
+          gres = f"gpu:{node.gputype}:{len(gpu_ids)}(IDX:{id_ranges(gpu_ids)})" if gpu_ids else ''
+          line = line + f"  Nodes={node.name} CPU_IDs={id_ranges(cpu_ids)} Mem={amem} GRES={gres} "
+      line = line + (f"MinCPUsNode={cpus // nnodes} MinMemoryNode={memory(mem // nnodes)} MinTmpDiskNode=0 Features=(null) "
+        f"DelayBoot=00:00:00 OverSubscribe=OK Contiguous=0 Licenses=(null) Network=(null) "
+        f"Command=/n/home/{job['user']}/run.sh WorkDir=/n/home/{job['user']} StdErr=/n/home/{job['user']}/slurm-{job['id']}.out "
+        f"StdIn=/dev/null StdOut=/n/home/{job['user']}/slurm-{job['id']}.out")
+      if job.get('cron'):
+        line = line + ' CronJob=Yes'
+      yield line
+
+  def sacct_lines(self):
+    """Current and finished jobs with every field in SACCT_FIELDS."""
+    yield '|'.join(SACCT_FIELDS)
+    for job in self.jobs:
+      nnodes, cpus, mem, gpus, tres = self.job_tres(job)
+      running = job['state'] == 'RUNNING'
+      jobid = str(job['id'])
+      if 'array' in job:
+        jobid = f"{job['array'][0]}_{job['array'][1] if running else '[' + job['array'][1] + ']'}"
+      run = self.now - job['start'] if running else 0
+      yield '|'.join([
+        jobid, str(job['id']), job['user'], job['account'], job['partition'], job['account'], job['state'],
+        str(cpus if running else 0), memory(mem // nnodes), tres,
+        iso(job['start']) if running else 'Unknown', 'Unknown', elapsed(run), tres if running else '',
+        compress(a[0].name for a in job['allocations']) if running else 'None assigned',
+        str(cpus if running else 0), str(cpus), iso(job['submit']), iso(job['submit']), job['reason'],
+        '0:0', '', '00:00:00', elapsed(run * cpus), str(job['restarts']),
+      ])
+    for job in self.finished:
+      node = job['node']
+      tres = f"billing={job['cpus']},cpu={job['cpus']},mem={memory(job['mem'])},node=1"
+      if job['gpus']:
+        tres = tres + f",gres/gpu={job['gpus']},gres/gpu:{node.gputype}={job['gpus']}"
+      run = job['end'] - job['start']
+      yield '|'.join([
+        str(job['id']), str(job['id']), job['user'], job['account'], job['partition'], job['account'], job['state'],
+        str(job['cpus']), memory(job['mem']), tres, iso(job['start']), iso(job['end']), elapsed(run), tres,
+        node.name, str(job['cpus']), str(job['cpus']), iso(job['submit']), iso(job['submit']), job['reason'],
+        '0:0' if job['state'] == 'COMPLETED' else '1:0', f"{job['mem'] // 2}M", elapsed(run * job['cpus'] // 2),
+        elapsed(run * job['cpus']), '0',
+      ])
+
+  def squeue_lines(self):
+    yield '|'.join(SQUEUE_FIELDS)
+    for job in self.jobs:
+      nnodes, cpus, mem, gpus, tres = self.job_tres(job)
+      running = job['state'] == 'RUNNING'
+      pending = (job['start'] if running else self.now) - job['submit']
+      yield '|'.join([
+        str(job['id']), job['user'], job['account'], job['partition'], job['state'], str(job['restarts']), str(pending),
+        str(cpus), str(nnodes), job['reason'], compress(a[0].name for a in job['allocations']) if running else '',
+      ])
+
+  def sinfo_lines(self):
+    """name|partition|state|cpus|mem|gres|features for each node in each of its partitions."""
+    for node in self.nodes:
+      for p in node.partitions:
+        gres = f"gpu:{node.gputype}:{node.gpus}" if node.gpus else '(null)'
+        yield '|'.join([node.name, p, node.state(), str(node.cpus), str(node.mem), gres, node.features])
+
+  def sshare_lines(self):
+    """Every account and user association below root, with usage taken from the jobs that have run."""
+    usage = defaultdict(float)
+    for job in self.finished:
+      usage[(job['account'], job['user'])] += job['cpus'] * (job['end'] - job['start'])
+    total = sum(usage.values()) or 1.0
+    accounts = [a for kind in ACCOUNTS.values() for a in kind]
+    yield '|'.join(SSHARE_FIELDS)
+    yield f"|root|||{int(total)}|1.000000|0.000000"
+    for account in accounts:
+      account_usage = sum(usage[(account, user)] for user, uid in self.users[account])
+      yield f" |{account}|1|{1 / len(accounts):.6f}|{int(account_usage)}|{account_usage / total:.6f}|"
+      for user, uid in self.users[account]:
+        share = 1 / len(accounts) / len(self.users[account])
+        used = usage[(account, user)] / total
+        fairshare = 2 ** (-used / share) if share else 0
+        yield f"  {user}|{account}|parent|{share:.6f}|{int(usage[(account, user)])}|{used:.6f}|{fairshare:.6f}"
+
+  def sdiag_lines(self):
+    running = sum(1 for j in self.jobs if j['state'] == 'RUNNING')
+    pending = len(self.jobs) - running
+    finished = len(self.finished)
+    r = self.random
+    yield '*******************************************************'
+    yield f"sdiag output at {time.ctime(self.now)} ({self.now})"
+    yield f"Data since      {time.ctime(self.now - self.now % 86400)} ({self.now - self.now % 86400})"
+    yield '*******************************************************'
+    yield f"Server thread count:  {r.randint(1, 20)}"
+    yield 'RPC queue enabled:    0'
+    yield f"Agent queue size:     {r.randint(0, 5)}"
+    yield 'Agent count:          0'
+    yield 'Agent thread count:   0'
+    yield 'DBD Agent queue size: 0'
+    yield ''
+    yield f"Jobs submitted: {len(self.jobs) + finished}"
+    yield f"Jobs started:   {running + finished}"
+    yield f"Jobs completed: {sum(1 for j in self.finished if j['state'] == 'COMPLETED')}"
+    yield f"Jobs canceled:  {sum(1 for j in self.finished if j['state'] == 'CANCELLED')}"
+    yield f"Jobs failed:    {sum(1 for j in self.finished if j['state'] == 'FAILED')}"
+    yield ''
+    yield f"Job states ts:  {time.ctime(self.now)} ({self.now})"
+    yield f"Jobs pending:   {pending}"
+    yield f"Jobs running:   {running}"
+    yield ''
+    yield 'Main schedule statistics (microseconds):'
+    yield f"\tLast cycle:   {r.randint(10000, 100000)}"
+    yield f"\tMax cycle:    {r.randint(500000, 2000000)}"
+    yield f"\tTotal cycles: {r.randint(1000, 5000)}"
+    yield f"\tMean cycle:   {r.randint(20000, 60000)}"
+    yield f"\tMean depth cycle:  {r.randint(100, 500)}"
+    yield f"\tCycles per minute: {r.randint(1, 4)}"
+    yield f"\tLast queue length: {pending}"
+    yield ''
+    yield 'Backfilling stats'
+    yield f"\tTotal backfilled jobs (since last slurm start): {r.randint(100000, 1000000)}"
+    yield f"\tTotal backfilled jobs (since last stats cycle start): {r.randint(1000, 20000)}"
+    yield '\tTotal backfilled heterogeneous job components: 0'
+    yield f"\tTotal cycles: {r.randint(1000, 2000)}"
+    yield f"\tLast cycle when: {time.ctime(self.now - 10)} ({self.now - 10})"
+    yield f"\tLast cycle: {r.randint(1000000, 3000000)}"
+    yield f"\tMax cycle:  {r.randint(5000000, 10000000)}"
+    yield f"\tMean cycle: {r.randint(1000000, 2000000)}"
+    yield f"\tLast depth cycle: {pending}"
+    yield f"\tLast depth cycle (try sched): {pending // 10}"
+    yield f"\tDepth Mean: {pending}"
+    yield f"\tDepth Mean (try depth): {pending // 10}"
+    yield f"\tLast queue length: {pending}"
+    yield f"\tQueue length mean: {pending}"
+    yield f"\tLast table size: {r.randint(100, 1000)}"
+    yield f"\tMean table size: {r.randint(100, 1000)}"
+    yield ''
+    yield 'Latency for 1000 calls to gettimeofday(): 24 microseconds'
+
+  def showq_lines(self, partition):
+    """showq -s summary for one partition, or the whole cluster if partition is None."""
+    nodes = self.partition_nodes[partition] if partition else self.nodes
+    cores = sum(n.cpus for n in nodes)
+    used = sum(n.cpualloc for n in nodes)
+    gpus = sum(n.gpus for n in nodes)
+    gused = sum(n.gpualloc for n in nodes)
+    active = sum(1 for n in nodes if n.cpualloc)
+    jobs = [j for j in self.jobs if partition is None or partition in j['partition'].split(',')]
+    running = sum(1 for j in jobs if j['state'] == 'RUNNING')
+    blocked = sum(1 for j in jobs if j['state'] == 'PENDING' and j['reason'] in ('Dependency', 'BeginTime'))
+    idle = len(jobs) - running - blocked
+    pct = lambda a, b: 100.0 * a / b if b else 0.0
+    yield f"SUMMARY OF JOBS FOR QUEUE: <{partition or 'ALL'}>"
+    yield ''
+    yield (f"Summary: of Active cores: {used} of {cores} ({pct(used, cores):.2f} %) active gpus {gused} of {gpus} "
+      f"({pct(gused, gpus):.2f} %) active nodes {active} of {len(nodes)} ({pct(active, len(nodes)):.2f} %) cores gpus")
+    yield ''
+    yield f"Total Jobs: {len(jobs)}     Active Jobs: {running}     Idle Jobs: {idle}     Blocked Jobs: {blocked}"
+
+  def write(self, directory, latency=None, tail=None):
+    """Render every command's output into directory along with a bin directory of fake commands."""
+    os.makedirs(os.path.join(directory, 'showq'), exist_ok=True)
+    os.makedirs(os.path.join(directory, 'bin'), exist_ok=True)
+    outputs = {
+      'scontrol_node.txt': self.node_lines(),
+      'scontrol_partition.txt': self.partition_lines(),
+      'scontrol_job.txt': self.job_lines(),
+      'sacct.txt': self.sacct_lines(),
+      'squeue.txt': self.squeue_lines(),
+      'sinfo.txt': self.sinfo_lines(),
+      'sshare.txt': self.sshare_lines(),
+      'sdiag.txt': self.sdiag_lines(),
+      os.path.join('showq', 'ALL.txt'): self.showq_lines(None),
+    }
+    for p in PARTITIONS:
+      outputs[os.path.join('showq', p + '.txt')] = self.showq_lines(p)
+    for name, lines in outputs.items():
+      with open(os.path.join(directory, name), 'w') as f:
+        for line in lines:
+          f.write(line + '\n')
+
+    config = {
+      'nodes': len(self.nodes), 'jobs': len(self.jobs), 'finished': len(self.finished), 'now': self.now,
+      'partitions': list(PARTITIONS), 'latency': latency or {'default': 0.0}, 'tail': tail,
+    }
+    with open(os.path.join(directory, 'cluster.json'), 'w') as f:
+      json.dump(config, f, indent=2)
+
+    shim = os.path.join(prefix, 'benchmarks', 'fake_slurm.py')
+    for name in FAKE_COMMANDS:
+      path = os.path.join(directory, 'bin', name)
+      with open(path, 'w') as f:
+        f.write(f"#!/bin/sh\nFAKE_SLURM_DIR=\"${{FAKE_SLURM_DIR:-{os.path.abspath(directory)}}}\" exec {sys.executable} {shim} {name} \"$@\"\n")
+      os.chmod(path, 0o755)
+
+def parse_latency(spec):
+  """Parse 0.05 or sacct=0.5,showq=2,default=0.05 into a dict of seconds per command."""
+  latency = {}
+  for part in spec.split(','):
+    if '=' in part:
+      name, seconds = part.split('=', 1)
+      latency[name] = float(seconds)
+    elif part:
+      latency['default'] = float(part)
+  return latency
+
+def main():
+  parser = argparse.ArgumentParser(description='Generate a synthetic slurm cluster and fake commands that replay it.')
+  parser.add_argument('directory', help='directory to write the cluster to')
+  parser.add_argument('--nodes', type=int, default=1000, help='number of nodes')
+  parser.add_argument('--jobs', type=int, default=10000, help='number of running and pending jobs')
+  parser.add_argument('--finished', type=int, default=None, help='number of finished jobs in sacct (defaults to --jobs)')
+  parser.add_argument('--days', type=int, default=7, help='days of finished jobs')
+  parser.add_argument('--seed', type=int, default=0, help='random seed')
+  parser.add_argument('--latency', default='0', help='seconds each command takes, e.g. 0.05 or 0.05,sacct=0.5,showq=2')
+  parser.add_argument('--tail', default=None, metavar='FRACTION:SECONDS', help='make a fraction of the calls take this long, e.g. 0.01:5')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  cluster = Cluster(args.nodes, args.jobs, args.finished, args.days, args.seed)
+  tail = [float(x) for x in args.tail.split(':')] if args.tail else None
+  cluster.write(args.directory, parse_latency(args.latency), tail)
+  print(f"Wrote {len(cluster.nodes)} nodes, {len(cluster.jobs)} jobs and {len(cluster.finished)} finished jobs "
+    f"to {args.directory} in {time.perf_counter() - start:.1f}s")
+  print(f"Run the exporter with --slurm-bin-dir {os.path.join(os.path.abspath(args.directory), 'bin')}")
+
+if __name__ == "__main__":
+  main()
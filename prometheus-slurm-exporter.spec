@@ -24,6 +24,7 @@ rm -rf $RPM_BUILD_ROOT
 mkdir -p %{buildroot}/opt/prometheus-slurm-exporter
 rsync -av %{_topdir}/BUILD/prometheus-slurm-exporter/ %{buildroot}/opt/prometheus-slurm-exporter/
 
+install -D -m644 %{_topdir}/BUILD/prometheus-slurm-exporter/systemd/prometheus-slurm-exporter.service %{buildroot}/%{_unitdir}/prometheus-slurm-exporter.service
 install -D -m644 %{_topdir}/BUILD/prometheus-slurm-exporter/systemd/prometheus-slurm-exporter-lsload.service %{buildroot}/%{_unitdir}/prometheus-slurm-exporter-lsload.service
 install -D -m644 %{_topdir}/BUILD/prometheus-slurm-exporter/systemd/prometheus-slurm-exporter-sdiag.service %{buildroot}/%{_unitdir}/prometheus-slurm-exporter-sdiag.service
 install -D -m644 %{_topdir}/BUILD/prometheus-slurm-exporter/systemd/prometheus-slurm-exporter-sshare.service %{buildroot}/%{_unitdir}/prometheus-slurm-exporter-sshare.service
@@ -37,6 +38,7 @@ install -D -m644 %{_topdir}/BUILD/prometheus-slurm-exporter/systemd/prometheus-s
 %files
 %defattr(-,root,root,-)
 /opt/prometheus-slurm-exporter/*
+%{_unitdir}/prometheus-slurm-exporter.service
 %{_unitdir}/prometheus-slurm-exporter-lsload.service
 %{_unitdir}/prometheus-slurm-exporter-sdiag.service
 %{_unitdir}/prometheus-slurm-exporter-sshare.service
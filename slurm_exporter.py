@@ -0,0 +1,156 @@
+#!/usr/bin/python3.11
+
+"""
+slurm_exporter.py
+A single exporter process that runs any number of the collectors.
+
+All the selected collectors share one interpreter, one HTTP server and one
+copy of the slurm command output per cycle.  The legacy per collector ports
+can optionally still be served so existing Prometheus jobs keep working.
+"""
+
+import sys,os
+import argparse
+import importlib
+import threading
+import time
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)))
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+from prometheus_client.core import REGISTRY
+from prometheus_client.registry import CollectorRegistry
+
+import slurm_http
+import slurm_nodes
+import slurm_rest
+import slurm_source
+import slurm_topology
+import slurm_weights
+from slurm_snapshot import register
+
+#Name: (module, factory, legacy port, period between collection)
+COLLECTORS = {
+  'sdiag': ('slurm_sched_stats_collector', 'SlurmSchedStatsCollector', 9001, 30),
+  'lsload': ('slurm_cluster_status_collector', 'SlurmClusterStatusCollector', 9002, 30),
+  'sshare': ('slurm_sshare_collector', 'SlurmSshareCollector', 9003, 55),
+  'seas': ('slurm_seas_stats_collector', 'SlurmSeasStatsCollector', 9004, 30),
+  'klsload': ('slurm_kempner_node_status_collector', 'SlurmClusterStatusCollector', 9005, 30),
+  'kempner': ('slurm_kempner_stats_collector', 'SlurmKempnerStatsCollector', 9006, 30),
+  'ksacct': ('slurm_kempner_sacct_collector', 'load_collector', 9007, 86400),
+  'spart': ('slurm_partition_status_collector', 'SlurmPartStatusCollector', 9008, 55),
+  'kjm': ('slurm_kempner_job_metrics_collector', 'SlurmJobNodeCollector', 9009, 30),
+}
+
+#Seconds between attempts to load a collector that had nothing to serve yet
+LOAD_RETRY = 3600
+
+def load(name, **kwargs):
+  """Build a collector from a name in COLLECTORS or a module:factory plugin spec."""
+  if name in COLLECTORS:
+    module, factory, port, period = COLLECTORS[name]
+  else:
+    module, factory = name.split(':', 1)
+    port, period = None, 30
+  collector = getattr(importlib.import_module(module), factory)(**kwargs)
+  return collector, port, period
+
+def load_later(name, kwargs, serve):
+  """Keep trying to load a collector that had nothing to serve yet, and serve it once it has."""
+  while True:
+    time.sleep(LOAD_RETRY)
+    try:
+      collector, port, period = load(name, **kwargs)
+    except Exception as e:
+      print(f"Error loading {name}, trying again in {LOAD_RETRY} seconds: {e!r}")
+      continue
+    if collector is not None:
+      serve(name, collector, port, period)
+      print(f"Slurm exporter started {name}")
+      return
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Prometheus exporter for Slurm.')
+  parser.add_argument('--collectors', default=','.join(COLLECTORS),
+    help='comma separated collectors to run, either names from the built in list or module:factory plugins')
+  parser.add_argument('--port', type=int, default=9000, help='port to serve all the collectors on')
+  parser.add_argument('--legacy-ports', action='store_true', help='also serve each collector on its old port')
+  parser.add_argument('--mode', choices=['inline', 'snapshot'], default='snapshot',
+    help='run slurm commands on scrape or in a background refresher')
+  parser.add_argument('--scrape-ttl', type=float, default=float(os.environ.get('SLURM_EXPORTER_SCRAPE_TTL', 0)),
+    help='seconds an inline collector reuses its last collect for; concurrent scrapes always share one collect')
+  parser.add_argument('--backend', action='append', default=[], metavar='COLLECTOR=BACKEND',
+    help='parse slurm output for a collector as text or json, e.g. spart=json (spart and kjm only)')
+  parser.add_argument('--cache-ttl', type=float, default=None,
+    help='seconds to share slurm command output between collectors (defaults to the shortest period)')
+  parser.add_argument('--topology-ttl', type=float, default=float(os.environ.get(slurm_topology.TTL_ENV, 3600)),
+    help='seconds to reuse the partitions and their nodes for, they are fetched again sooner when slurm.conf changes')
+  parser.add_argument('--slurm-bin-dir', default=os.environ.get('SLURM_EXPORTER_BIN_DIR'), metavar='DIR',
+    help='run scontrol, sinfo, squeue, sacct, sdiag, sshare and showq from DIR, e.g. fake commands for load testing')
+  parser.add_argument('--weights', default=None, metavar='FILE',
+    help='TRES weights of the CPU and GPU types (defaults to SLURM_EXPORTER_WEIGHTS or tres_weights.json), reloaded on SIGHUP')
+  parser.add_argument('--slurmrestd', default=os.environ.get('SLURMRESTD_URL'), metavar='URL',
+    help='read nodes, partitions, jobs, diag and shares from slurmrestd, e.g. unix:/run/slurmrestd.sock or http://host:6820 (token from SLURM_JWT)')
+  parser.add_argument('--slurmrestd-user', default=os.environ.get('SLURMRESTD_USER'), help='user name to send to slurmrestd')
+  parser.add_argument('--slurmrestd-version', default=os.environ.get('SLURMRESTD_VERSION', 'v0.0.40'), help='slurmrestd API version')
+  parser.add_argument('--slurmrestd-connections', type=int, default=4, help='keep-alive connections to keep open to slurmrestd')
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_args(argv)
+
+  backends = dict(b.split('=', 1) for b in args.backend)
+  #Set before loading since some collectors (e.g. ksacct) run slurm commands as they load
+  slurm_source.bin_dir = args.slurm_bin_dir
+  slurm_topology.topology.ttl = args.topology_ttl
+  if args.weights:
+    slurm_weights.path = args.weights
+    slurm_weights.weights = slurm_weights.load()
+  slurm_weights.install_reload()
+
+  loaded = []
+  pending = []
+  for name in args.collectors.split(','):
+    kwargs = {'backend': backends[name.strip()]} if name.strip() in backends else {}
+    collector, port, period = load(name.strip(), **kwargs)
+    #Some collectors (e.g. ksacct) have nothing to serve until their data exists, so are tried again later.
+    if collector is not None:
+      loaded.append((name.strip(), collector, port, period))
+    else:
+      pending.append((name.strip(), kwargs, period))
+
+  if args.cache_ttl is None:
+    args.cache_ttl = min([period for name, collector, port, period in loaded] +
+      [period for name, kwargs, period in pending] or [0])
+  slurm_source.source.ttl = args.cache_ttl
+  if args.slurmrestd:
+    slurm_rest.configure(args.slurmrestd, os.environ.get('SLURM_JWT'), args.slurmrestd_user, args.slurmrestd_version,
+      size=args.slurmrestd_connections)
+
+  slurm_http.start_http_server(args.port)
+  REGISTRY.register(slurm_nodes.inventory)
+  REGISTRY.register(slurm_topology.topology)
+
+  def serve(name, collector, port, period):
+    collector = register(collector, period, mode=args.mode, name=name, ttl=args.scrape_ttl)
+    if args.legacy_ports and port:
+      registry = CollectorRegistry()
+      slurm_http.exposition(registry).add(collector)
+      slurm_http.start_http_server(port, registry=registry)
+
+  for name, collector, port, period in loaded:
+    serve(name, collector, port, period)
+  for name, kwargs, period in pending:
+    threading.Thread(target=load_later, args=(name, kwargs, serve), name=f'load-{name}', daemon=True).start()
+
+  print(f"Slurm exporter started with {', '.join(name for name, collector, port, period in loaded)} on port {args.port}")
+  if pending:
+    print(f"Waiting for {', '.join(name for name, kwargs, period in pending)} to have something to serve")
+  while True:
+    time.sleep(86400)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,56 @@
+"""
+slurm_hostlist.py
+In process expansion of slurm hostlists.
+
+This does the same job as scontrol show hostnames without forking a process
+for every job.  Expansions are cached since the same nodelists show up over
+and over again in the job list.
+"""
+
+from functools import lru_cache
+
+def split(hostlist):
+  """Split a hostlist on the commas that are not inside brackets."""
+  names = []
+  depth = 0
+  start = 0
+  for i, c in enumerate(hostlist):
+    if c == '[':
+      depth = depth + 1
+    elif c == ']':
+      depth = depth - 1
+    elif c == ',' and depth == 0:
+      names.append(hostlist[start:i])
+      start = i + 1
+  names.append(hostlist[start:])
+  return [n for n in names if n]
+
+def expand_name(name):
+  """Expand a single hostlist entry, which may have several bracket groups."""
+  lb = name.find('[')
+  if lb < 0:
+    return [name]
+  rb = name.index(']', lb)
+  prefix = name[:lb]
+  tails = expand_name(name[rb+1:])
+
+  hosts = []
+  for r in name[lb+1:rb].split(','):
+    if '-' in r:
+      lo, hi = r.split('-', 1)
+      #Keep the zero padding of the lower bound, e.g. 01-12
+      width = len(lo)
+      for i in range(int(lo), int(hi)+1):
+        head = prefix + str(i).zfill(width)
+        hosts.extend(head + t for t in tails)
+    else:
+      hosts.extend(prefix + r + t for t in tails)
+  return hosts
+
+@lru_cache(maxsize=65536)
+def expand(hostlist):
+  """Expand a hostlist such as holy7c[01-03,05],holygpu8a[1-2] into a tuple of node names."""
+  hosts = []
+  for name in split(hostlist.strip()):
+    hosts.extend(expand_name(name))
+  return tuple(hosts)
@@ -0,0 +1,149 @@
+"""
+slurm_http.py
+Serve the exposition from bytes rendered once per collect.
+
+prometheus_client's own server renders every family again for each scrape,
+and gzips the result again too, which for the spart and kjm collectors is
+megabytes of text per scrape.  Here the collectors registered through
+slurm_snapshot.register render their text (and compress it) once when they
+collect and every scrape is answered by writing those buffers out as they are.
+Only the small collectors left in the registry (the exporter's own metrics,
+process stats) are rendered per scrape.
+
+For gzip each collector's text is deflated once, ending on a sync flush so the
+pieces can be sent one after another as a single deflate stream, and only the
+per scrape part is compressed on scrape.
+"""
+
+import struct
+import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import generate_latest
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import gzip_accepted
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+#Level 6 is within 10% of the size of 9 on exposition text in well under half the time
+GZIP_LEVEL = 6
+#Deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+def deflate(data, last=False):
+  """Raw deflate data, ending on a sync flush unless it is the last piece of the stream."""
+  z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+  return z.compress(data) + z.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class Families:
+  """A list of families in the form generate_latest renders."""
+  def __init__(self, families):
+    self.families = families
+
+  def collect(self):
+    return self.families
+
+def render(families):
+  """Render families as exposition text, returning the text and the text deflated."""
+  text = generate_latest(Families(families))
+  return text, deflate(text)
+
+class Exposition:
+  """The collectors served on a port.
+
+  Collectors added here must have a rendered() method returning an object
+  with text and deflated bytes, while those in the registry are rendered per scrape.
+  """
+  def __init__(self, registry=REGISTRY):
+    self.registry = registry
+    self.collectors = []
+    #The rendered texts last served gzipped, their CRC-32 and length
+    self.checksum = ((), 0, 0)
+
+  def add(self, collector):
+    self.collectors.append(collector)
+
+  def chunks(self, gzipped=False):
+    """Buffers that make up the body of a scrape, in order."""
+    rendered = tuple(c.rendered() for c in self.collectors)
+    live = generate_latest(self.registry)
+    if not gzipped:
+      return [r.text for r in rendered] + [live]
+    crc, size = self.crc(rendered)
+    trailer = struct.pack('<II', zlib.crc32(live, crc), (size + len(live)) & 0xffffffff)
+    return [GZIP_HEADER] + [r.deflated for r in rendered] + [deflate(live, last=True), trailer]
+
+  def crc(self, rendered):
+    """CRC-32 and length of the rendered texts, worked out again only when one of them has changed."""
+    last, crc, size = self.checksum
+    if len(last) != len(rendered) or any(a is not b for a, b in zip(last, rendered)):
+      crc = 0
+      size = 0
+      for r in rendered:
+        crc = zlib.crc32(r.text, crc)
+        size = size + len(r.text)
+      self.checksum = (rendered, crc, size)
+    return crc, size
+
+  def collect(self):
+    for c in self.collectors:
+      yield from c.collect()
+    yield from self.registry.collect()
+
+_expositions = {}
+
+def exposition(registry=REGISTRY):
+  """The Exposition that serves registry."""
+  if registry not in _expositions:
+    _expositions[registry] = Exposition(registry)
+  return _expositions[registry]
+
+class Handler(BaseHTTPRequestHandler):
+  #Every response has a Content-Length so scrapers can keep the connection open
+  protocol_version = 'HTTP/1.1'
+  #Set on the subclass made for each server
+  exposition = None
+
+  def do_GET(self):
+    if self.path == '/favicon.ico':
+      self.send_error(404)
+      return
+    gzipped = gzip_accepted(self.headers.get('Accept-Encoding'))
+    try:
+      chunks = self.exposition.chunks(gzipped)
+    except Exception as e:
+      print(f"Error rendering metrics: {e!r}")
+      self.send_error(500, explain=repr(e))
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    if gzipped:
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(sum(map(len, chunks))))
+    self.end_headers()
+    #Written straight to the socket, one buffer at a time
+    for chunk in chunks:
+      self.wfile.write(chunk)
+
+  def log_message(self, format, *args):
+    pass
+
+class Server(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def handle_error(self, request, client_address):
+    #Scrapers that hang up are not worth a traceback
+    if not isinstance(sys.exc_info()[1], ConnectionError):
+      super().handle_error(request, client_address)
+
+def start_http_server(port, addr='0.0.0.0', registry=REGISTRY):
+  """Serve the exposition of registry on port from a background thread.
+
+  A drop in for prometheus_client.start_http_server.
+  """
+  handler = type('Handler', (Handler,), {'exposition': exposition(registry)})
+  server = Server((addr, port), handler)
+  thread = threading.Thread(target=server.serve_forever, name=f"http-{port}", daemon=True)
+  thread.start()
+  return server, thread
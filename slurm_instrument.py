@@ -0,0 +1,179 @@
+"""
+slurm_instrument.py
+Metrics about the exporter itself.
+
+Every slurm command (or slurmrestd request) the collectors make is timed and
+its output measured, and every collect is split into the time spent fetching
+and parsing records, the time spent aggregating them into metrics and the time
+the exposition took to serialize the result.  With these a slow scrape can be pinned on slurmctld,
+the parsers or the metric building, and failures show up as counters rather
+than only in the log.
+
+Parse time covers everything the collector spends waiting on its record
+iterators, which includes reading the command's output as it streams in.
+"""
+
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.registry import Collector
+
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11)) + (float('inf'),)
+RECORDS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, float('inf'))
+
+class Instruments(Collector):
+  def __init__(self):
+    self.lock = threading.Lock()
+    #Name each collector is registered under, keyed by id()
+    self.names = {}
+    #Parse seconds and records of the collect in progress, keyed by id() of the collector
+    self.pending = {}
+
+    self.command_seconds = Histogram('slurm_exporter_command_seconds', 'Wall time of the slurm commands run',
+      ['command'], buckets=SECONDS_BUCKETS, registry=None)
+    self.command_bytes = Histogram('slurm_exporter_command_stdout_bytes', 'Bytes read from the output of the slurm commands run',
+      ['command'], buckets=BYTES_BUCKETS, registry=None)
+    self.command_timeouts = Counter('slurm_exporter_command_timeouts', 'Slurm commands killed for running past their deadline',
+      ['command'], registry=None)
+    self.command_failures = Counter('slurm_exporter_command_failures', 'Slurm commands that exited nonzero',
+      ['command'], registry=None)
+    self.parse_seconds = Histogram('slurm_exporter_parse_seconds', 'Time a collect spent fetching and parsing records',
+      ['collector'], buckets=SECONDS_BUCKETS, registry=None)
+    self.aggregate_seconds = Histogram('slurm_exporter_aggregate_seconds', 'Time a collect spent aggregating records into metrics',
+      ['collector'], buckets=SECONDS_BUCKETS, registry=None)
+    self.serialize_seconds = Histogram('slurm_exporter_serialize_seconds', 'Time spent serializing a collector\'s metrics for a scrape',
+      ['collector'], buckets=SECONDS_BUCKETS, registry=None)
+    self.records_parsed = Histogram('slurm_exporter_records_parsed', 'Records parsed by a collect',
+      ['collector'], buckets=RECORDS_BUCKETS, registry=None)
+    self.errors = Counter('slurm_exporter_collector_errors', 'Errors raised while collecting',
+      ['collector', 'stage'], registry=None)
+    self.series = Gauge('slurm_exporter_series', 'Series in each metric family of the last collect',
+      ['collector', 'family'], registry=None)
+    self.scrapes = Counter('slurm_exporter_scrape_collects', 'Scrapes of an inline collector by whether they ran a collect (miss), reused a cached one (hit) or waited on one in flight (coalesced)',
+      ['collector', 'result'], registry=None)
+
+  def name(self, collector):
+    return self.names.get(id(collector), type(collector).__name__)
+
+  def set_name(self, collector, name):
+    self.names[id(collector)] = name
+
+  def command(self, label, seconds, nbytes, returncode=None, timed_out=False):
+    """Record a finished (or killed) command."""
+    self.command_seconds.labels(label).observe(seconds)
+    self.command_bytes.labels(label).observe(nbytes)
+    if timed_out:
+      self.command_timeouts.labels(label).inc()
+    elif returncode:
+      self.command_failures.labels(label).inc()
+
+  def add_parse(self, collector, seconds, count=0):
+    with self.lock:
+      pending = self.pending.setdefault(id(collector), [0.0, 0])
+      pending[0] = pending[0] + seconds
+      pending[1] = pending[1] + count
+
+  def parsed(self, collector, fetch, *args):
+    """Call fetch(*args) and count the time it took as parse time."""
+    start = time.perf_counter()
+    try:
+      return fetch(*args)
+    finally:
+      self.add_parse(collector, time.perf_counter() - start)
+
+  def records(self, collector, fetch, *args):
+    """Call fetch(*args) and iterate what it returns, counting the time and records as parsed.
+
+    Errors raised by fetch itself surface here, just as if it had been called directly.
+    """
+    start = time.perf_counter()
+    try:
+      iterable = iter(fetch(*args))
+    finally:
+      self.add_parse(collector, time.perf_counter() - start)
+    return self.timed(collector, iterable)
+
+  def timed(self, collector, iterable):
+    seconds = 0.0
+    count = 0
+    try:
+      while True:
+        start = time.perf_counter()
+        try:
+          item = next(iterable)
+        except StopIteration:
+          break
+        finally:
+          seconds = seconds + time.perf_counter() - start
+        count = count + 1
+        yield item
+    finally:
+      self.add_parse(collector, seconds, count)
+
+  def collecting(self, collector, families, collect=True, serialize=True):
+    """Pass families through, timing the collect (time spent producing them) and serialization (time spent on each by the consumer)."""
+    name = self.name(collector)
+    if collect:
+      with self.lock:
+        self.pending.pop(id(collector), None)
+    busy = 0.0
+    waiting = 0.0
+    series = {}
+    families = iter(families)
+    try:
+      while True:
+        start = time.perf_counter()
+        try:
+          family = next(families)
+        except StopIteration:
+          break
+        finally:
+          busy = busy + time.perf_counter() - start
+        series[family.name] = series.get(family.name, 0) + len(family.samples)
+        start = time.perf_counter()
+        yield family
+        waiting = waiting + time.perf_counter() - start
+    finally:
+      if collect:
+        with self.lock:
+          parse, count = self.pending.pop(id(collector), (0.0, 0))
+        self.parse_seconds.labels(name).observe(parse)
+        self.aggregate_seconds.labels(name).observe(max(busy - parse, 0.0))
+        self.records_parsed.labels(name).observe(count)
+        for family, n in series.items():
+          self.series.labels(name, family).set(n)
+      if serialize:
+        self.serialize_seconds.labels(name).observe(waiting)
+
+  def error(self, collector, stage, e):
+    """Count and log an error that a collector recovered from."""
+    name = self.name(collector)
+    self.errors.labels(name, stage).inc()
+    print(f"Error in {name} getting {stage}: {e!r}")
+
+  def scrape(self, collector, result):
+    """Count a scrape of a collector as a hit, miss or coalesced."""
+    self.scrapes.labels(self.name(collector), result).inc()
+
+  def collect(self):
+    for metric in (self.command_seconds, self.command_bytes, self.command_timeouts, self.command_failures,
+        self.parse_seconds, self.aggregate_seconds, self.serialize_seconds, self.records_parsed, self.errors, self.series, self.scrapes):
+      yield from metric.collect()
+
+#Process wide instruments shared by all the collectors.
+instruments = Instruments()
+
+def parsed(collector, fetch, *args):
+  return instruments.parsed(collector, fetch, *args)
+
+def records(collector, fetch, *args):
+  return instruments.records(collector, fetch, *args)
+
+def error(collector, stage, e):
+  instruments.error(collector, stage, e)
+
+def count(collector, n):
+  """Count n records parsed by a collector outside records()."""
+  instruments.add_parse(collector, 0.0, n)
@@ -0,0 +1,328 @@
+"""
+slurm_json.py
+Ingest the --json output of scontrol and sacct.
+
+The job dumps can be hundreds of megabytes so rather than json.load the whole
+document we decode the top level array of records one element at a time and
+throw each away once the collector is done with it.  Records are then turned
+into the same shape the text parsers produce so the collectors aggregate them
+in exactly the same way.
+
+The field names follow the slurm data_parser plugins v0.0.39 through v0.0.41.
+"""
+
+import json
+import re
+import time
+
+from slurm_parse import gpu_count
+
+decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+#Least text read before an incomplete element is decoded again
+READ_SIZE = 65536
+
+def iter_array(chunks, key):
+  """Yield the elements of the top level array stored under key.
+
+  chunks is any iterable of text such as a pipe's stdout or a list of lines.
+  Only the element being decoded (plus up to READ_SIZE more) is held in memory.
+  """
+  chunks = iter(chunks)
+  buf = ''
+  start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+  #Find the start of the array
+  while True:
+    m = start.search(buf)
+    if m:
+      buf = buf[m.end():]
+      break
+    chunk = next(chunks, None)
+    if chunk is None:
+      return
+    #Hang on to enough of the tail in case the key straddles two chunks
+    buf = buf[-(len(key) + 16):] + chunk
+
+  pos = 0
+  while True:
+    #Skip separators
+    while pos < len(buf) and (buf[pos] in WHITESPACE or buf[pos] == ','):
+      pos = pos + 1
+    if pos < len(buf) and buf[pos] == ']':
+      return
+    try:
+      if pos >= len(buf):
+        raise ValueError
+      item, end = decoder.raw_decode(buf, pos)
+    except ValueError:
+      #Incomplete element.  Read at least as much again as is buffered before
+      #decoding it again, so that an element fed in line by line (as pretty
+      #printed --json is) is decoded a handful of times rather than once a line.
+      more = [buf[pos:]]
+      want = max(len(buf) - pos, READ_SIZE)
+      got = 0
+      for chunk in chunks:
+        more.append(chunk)
+        got = got + len(chunk)
+        if got >= want:
+          break
+      if not got:
+        raise ValueError(f"Truncated JSON array {key}")
+      buf = ''.join(more)
+      pos = 0
+      continue
+    yield item
+    pos = end
+    if pos > READ_SIZE:
+      buf = buf[pos:]
+      pos = 0
+
+def number(value, default=0):
+  """Unwrap the {"set": true, "number": N} form newer slurm uses for numbers."""
+  if isinstance(value, dict):
+    if not value.get('set', True) or value.get('infinite', False):
+      return default
+    return value.get('number', default)
+  if value is None:
+    return default
+  return value
+
+def state(value):
+  """Job states are lists in newer slurm and strings in older releases."""
+  if isinstance(value, dict):
+    value = value.get('current', '')
+  if isinstance(value, list):
+    return ','.join(value)
+  return value or ''
+
+def memory(mb):
+  """Format megabytes the way slurm does, in the largest unit that divides evenly."""
+  mb = int(mb)
+  if mb and mb % 1048576 == 0:
+    return f"{mb // 1048576}T"
+  if mb and mb % 1024 == 0:
+    return f"{mb // 1024}G"
+  return f"{mb}M"
+
+def tres_string(tres):
+  """Turn a list of TRES records back into cpu=4,mem=16000M,gres/gpu=1 form."""
+  out = []
+  for t in tres or []:
+    name = t['type']
+    if t.get('name'):
+      name = name + '/' + t['name']
+    count = t.get('count', 0)
+    if t['type'] == 'mem':
+      out.append(f"{name}={memory(count)}")
+    else:
+      out.append(f"{name}={count}")
+  return ','.join(out)
+
+def timestamp(value):
+  value = number(value)
+  if not value:
+    return 'Unknown'
+  return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(value))
+
+def elapsed(seconds):
+  seconds = int(number(seconds))
+  days, seconds = divmod(seconds, 86400)
+  hours, seconds = divmod(seconds, 3600)
+  minutes, seconds = divmod(seconds, 60)
+  if days:
+    return f"{days}-{hours:02d}:{minutes:02d}:{seconds:02d}"
+  return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def scontrol_job(j):
+  """Convert a scontrol --json job into a (job, allocations) pair.
+
+  The job dict uses the scontrol -o key names and allocations is a list of
+  (nodelist, cpus, mem in MB, gpus) tuples, just like the text parser.
+  """
+  job = {
+    'JobId': str(j['job_id']),
+    'UserId': f"{j.get('user_name', '')}({j.get('user_id', '')})",
+    'Account': j.get('account', ''),
+    'Partition': j.get('partition', ''),
+    'JobState': state(j.get('job_state')),
+    'Restarts': str(j.get('restart_cnt', 0)),
+    'AllocTRES': j.get('tres_alloc_str', ''),
+  }
+  if j.get('array_task_string'):
+    job['ArrayTaskId'] = j['array_task_string']
+  if j.get('cron') or 'CRON_JOB' in j.get('flags', []):
+    job['CronJob'] = 'Yes'
+
+  allocations = []
+  resources = j.get('job_resources') or {}
+  gres = j.get('gres_detail') or []
+  nodes = resources.get('nodes')
+  if isinstance(nodes, dict):
+    #v0.0.40 and later
+    for i, a in enumerate(nodes.get('allocation', [])):
+      allocations.append((a['name'], a['cpus']['count'], float(a['memory']['allocated']), gpu_count(gres[i]) if i < len(gres) else 0))
+  else:
+    #v0.0.39
+    for i, a in enumerate(resources.get('allocated_nodes', [])):
+      allocations.append((a['nodename'], a['cpus_used'], float(a['memory_allocated']), gpu_count(gres[i]) if i < len(gres) else 0))
+  return job, allocations
+
+def scontrol_jobs(chunks):
+  for j in iter_array(chunks, 'jobs'):
+    yield scontrol_job(j)
+
+def sacct_row(j):
+  """Convert a sacct --json job into the fields the kjm collector asks sacct for.
+
+  JobID,JobIDRaw,User,Partition,Account,State,AllocCPUS,ReqMem,ReqTRES,Start,End,
+  Elapsed,AllocTRES,NodeList,NCPUs,ReqCPUS,Submit,Eligible,Reason
+  """
+  array = j.get('array') or {}
+  array_id = number(array.get('job_id'))
+  task = number((array.get('task_id') or {}), None)
+  if array_id and task is not None:
+    job_id = f"{array_id}_{task}"
+  else:
+    job_id = str(j['job_id'])
+
+  times = j.get('time') or {}
+  tres = j.get('tres') or {}
+  alloc = {t['type']: t.get('count', 0) for t in tres.get('allocated') or []}
+  required = j.get('required') or {}
+  reqmem = number(required.get('memory_per_node'))
+  jstate = j.get('state')
+  if isinstance(jstate, dict):
+    reason = jstate.get('reason', '')
+  else:
+    reason = j.get('state_reason', '')
+
+  return [
+    job_id,
+    str(j['job_id']),
+    j.get('user', ''),
+    j.get('partition', ''),
+    j.get('account', ''),
+    state(jstate),
+    str(alloc.get('cpu', 0)),
+    memory(reqmem) if reqmem else '',
+    tres_string(tres.get('requested')),
+    timestamp(times.get('start')),
+    timestamp(times.get('end')),
+    elapsed(times.get('elapsed', 0)),
+    tres_string(tres.get('allocated')),
+    j.get('nodes', ''),
+    str(alloc.get('cpu', 0)),
+    str(number(required.get('CPUs'))),
+    timestamp(times.get('submission')),
+    timestamp(times.get('eligible')),
+    reason,
+  ]
+
+def sacct_rows(chunks):
+  for j in iter_array(chunks, 'jobs'):
+    yield sacct_row(j)
+
+def flags(value):
+  """Lists such as node states are joined with + the way scontrol prints them."""
+  if isinstance(value, list):
+    return '+'.join(value)
+  return value or ''
+
+def scontrol_node(j):
+  """Convert a --json node into the scontrol -o show node key names."""
+  features = j.get('features', '')
+  if isinstance(features, list):
+    features = ','.join(features)
+  partitions = j.get('partitions', '')
+  if isinstance(partitions, list):
+    partitions = ','.join(partitions)
+  #cpu_load is reported in hundredths
+  cpuload = number(j.get('cpu_load'), None)
+  freemem = number(j.get('free_mem'), None)
+  return {
+    'NodeName': j['name'],
+    'State': flags(j.get('state')),
+    'Partitions': partitions,
+    'AvailableFeatures': features,
+    'CPUTot': str(j.get('cpus', 0)),
+    'CPUAlloc': str(j.get('alloc_cpus', 0)),
+    'CPULoad': f"{cpuload / 100:.2f}" if cpuload is not None else 'N/A',
+    'RealMemory': str(j.get('real_memory', 0)),
+    'AllocMem': str(j.get('alloc_memory', 0)),
+    'FreeMem': str(freemem) if freemem is not None else 'N/A',
+    'CfgTRES': j.get('tres', ''),
+    'AllocTRES': j.get('tres_used') or '',
+    'Gres': j.get('gres') or '',
+  }
+
+def scontrol_partition(j):
+  """Convert a --json partition into the scontrol -o show partition key names."""
+  priority = j.get('priority') or {}
+  tres = j.get('tres') or {}
+  nodes = j.get('nodes') or {}
+  return {
+    'PartitionName': j['name'],
+    'Nodes': nodes.get('configured') or '',
+    'PriorityTier': str(number(priority.get('tier'))),
+    'TRES': tres.get('configured', ''),
+    'TRESBillingWeights': tres.get('billing_weights', ''),
+  }
+
+#sdiag --json (and slurmrestd /diag) statistics keyed by the names the sdiag text parser builds
+DIAG_KEYS = {
+  'server_thread_count': 'Serverthreadcount',
+  'agent_queue_size': 'Agentqueuesize',
+  'jobs_submitted': 'Jobssubmitted',
+  'jobs_started': 'Jobsstarted',
+  'jobs_completed': 'Jobscompleted',
+  'jobs_canceled': 'Jobscanceled',
+  'jobs_failed': 'Jobsfailed',
+  'schedule_cycle_last': 'mLastcycle',
+  'schedule_cycle_max': 'mMaxcycle',
+  'schedule_cycle_total': 'mTotalcycles',
+  'schedule_cycle_mean': 'mMeancycle',
+  'schedule_cycle_mean_depth': 'mMeandepthcycle',
+  'schedule_cycle_per_minute': 'mCyclesperminute',
+  'schedule_queue_length': 'mLastqueuelength',
+  'bf_backfilled_jobs': 'bTotalbackfilledjobssincelastslurmstart',
+  'bf_last_backfilled_jobs': 'bTotalbackfilledjobssincelaststatscyclestart',
+  'bf_cycle_counter': 'bTotalcycles',
+  'bf_cycle_last': 'bLastcycle',
+  'bf_cycle_max': 'bMaxcycle',
+  'bf_queue_len': 'bLastqueuelength',
+  'bf_cycle_mean': 'bMeancycle',
+  'bf_depth_mean': 'bDepthMean',
+  'bf_depth_mean_try': 'bDepthMeantrydepth',
+  'bf_queue_len_mean': 'bQueuelengthmean',
+  'bf_last_depth': 'bLastdepthcycle',
+  'bf_last_depth_try': 'bLastdepthcycletrysched',
+}
+
+def sdiag_stats(doc):
+  """Turn a --json diag document into the dict the sdiag collector exports from."""
+  stats = doc.get('statistics', {})
+  return {name: str(number(stats[key])) for key, name in DIAG_KEYS.items() if key in stats}
+
+def sshare_row(j):
+  """Convert a --json share into the User|Account|RawShares|NormShares|RawUsage|NormUsage|Fairshare fields of sshare -P."""
+  shares = j.get('shares')
+  #Users set to use their parent's shares show up as infinite
+  if isinstance(shares, dict) and shares.get('infinite'):
+    rawshares = 'parent'
+  else:
+    rawshares = str(number(shares))
+  fairshare = j.get('fairshare') or {}
+  if 'USER' in (j.get('type') or []):
+    user, account = j['name'], j.get('parent', '')
+  else:
+    user, account = '', j['name']
+  return (
+    user,
+    account,
+    rawshares,
+    str(number(j.get('shares_normalized'))),
+    str(number(j.get('usage'))),
+    str(number(j.get('usage_normalized'))),
+    str(number(fairshare.get('factor'))),
+  )
@@ -6,18 +6,33 @@ Prometheus exporter for detailed SLURM job metrics.
 
 This script:
 - Periodically collects granular SLURM data using:
-        - 'sinfo' twice (get kempner partitions, get node status) 
-        - 'sacct' once (get job data)
+        - 'sinfo' once (get node status), the kempner partitions coming from
+          the shared slurm_topology registry, which asks sinfo only when
+          slurm.conf changes or its ttl runs out
+        - 'sacct' once (get the jobs that changed since the last poll)
 - Exposes these metrics in Prometheus format at http://localhost:9009/metrics.
 - Filters for Kempner partition jobs and nodes only (configurable)
 
+slurm_job_details only carries the labels that stay put over a job's life.
+Its times are exported as numbers (slurm_job_elapsed_seconds and the
+slurm_job_*_time_seconds timestamps) and its pending reason as
+slurm_job_reason, so a running job is one series rather than a new one every
+scrape as it ages.  At most SLURM_EXPORTER_JOB_LIMIT jobs (1000 by default, 0
+for no limit) per partition get per job series, running jobs first and then
+the jobs with the most CPUs, and the rest are counted in
+slurm_job_details_omitted.  SLURM_EXPORTER_JOB_DETAILS=legacy brings back the
+old slurm_job_details with every sacct field as a label, and no limit.
+
+Jobs are kept in a JobTracker between polls so sacct only has to report the
+jobs that were pending, running or ended since the last poll rather than
+every job since midnight.  Finished jobs are exported for
+SLURM_EXPORTER_JOB_RETENTION seconds (a day by default) after they end.
 """
 
 import sys, os
-import subprocess
+import heapq
 import time
 from os import path
-from datetime import datetime, timedelta
 
 prefix = os.path.normpath(
     os.path.join(os.path.abspath(os.path.dirname(__file__)))
@@ -27,25 +42,96 @@ sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client.registry import Collector
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_json
+import slurm_source
+import slurm_topology
+from slurm_http import start_http_server
+from slurm_parse import parse_duration, parse_timestamp
+from slurm_snapshot import register
+
+# Labels of slurm_job_details in the legacy layout, one per sacct field
+LEGACY_LABELS = ['job_id', 'job_id_raw', 'user', 'partition', 'account', 'state', 'tres_cpu', 'tres_mem', 'tres_gres', 'start_time', 'end_time', 'elapsed', 'alloc_tres', 'node_list', 'ncpus', 'req_cpus', 'submit', 'eligible', 'reason']
+# Labels of slurm_job_details that do not change as a job runs
+DETAIL_LABELS = ['job_id', 'job_id_raw', 'user', 'partition', 'account', 'state', 'tres_cpu', 'tres_mem', 'tres_gres', 'alloc_tres', 'node_list', 'ncpus', 'req_cpus']
+
+class JobTracker:
+    """Jobs sacct has reported, by JobIDRaw, brought up to date by the jobs that changed since the last poll.
+
+    A full query for the last retention seconds seeds the index and is run
+    again every resync seconds, or when the partitions change, to drop
+    anything the deltas missed.  In between each poll asks sacct for the jobs
+    active since the last one (less overlap seconds, for slurmdbd lagging
+    behind), which are the pending and running jobs and the jobs that ended
+    since.  Their rows replace the ones in the index and jobs that ended more
+    than retention seconds ago are evicted.
+    """
+    def __init__(self, retention=86400, resync=3600, overlap=60):
+        self.retention = retention
+        self.resync = resync
+        self.overlap = overlap
+        # sacct fields by JobIDRaw, and the end time of the jobs that have ended
+        self.jobs = {}
+        self.ended = {}
+        self.partitions = None
+        self.polled = None
+        self.synced = None
+
+    def window(self, partitions, now):
+        """The --starttime of the next poll and whether it is a full query."""
+        if self.polled is None or partitions != self.partitions or now - self.synced >= self.resync:
+            return now - self.retention, True
+        return self.polled - self.overlap, False
+
+    def update(self, partitions, rows, now, full):
+        """Apply the rows of a poll started at now, replacing the whole index if it was a full query.
+
+        The rows are all read before anything changes, so a sacct that fails
+        part way (which raises from rows) leaves the index and the poll times
+        as they were and the next poll covers the same window again.
+        """
+        rows = [parts for parts in rows if len(parts) >= 19 and parts[1]]
+        jobs, ended = ({}, {}) if full else (self.jobs, self.ended)
+        for parts in rows:
+            job_id_raw = parts[1]
+            jobs[job_id_raw] = parts
+            end = parse_timestamp(parts[10])
+            if end is not None:
+                ended[job_id_raw] = end
+            else:
+                ended.pop(job_id_raw, None)
+        self.jobs, self.ended = jobs, ended
+        self.partitions = partitions
+        self.polled = now
+        if full:
+            self.synced = now
+        self.evict(now)
+
+    def evict(self, now):
+        cutoff = now - self.retention
+        for job_id_raw in [j for j, end in self.ended.items() if end < cutoff]:
+            del self.jobs[job_id_raw]
+            del self.ended[job_id_raw]
 
 class SlurmJobNodeCollector(Collector):
-    def __init__(self):
+    def __init__(self, backend=None, details=None, limit=None):
         # Fallback hardcoded list in case dynamic discovery fails
         self.fallback_kempner_partitions = ['kempner', 'kempner_dev', 'kempner_h100', 'kempner_requeue']
+        # Parse sacct's parsable text output (text) or its --json output (json)
+        self.backend = backend or os.environ.get('SLURM_EXPORTER_BACKEND', 'text')
+        # slurm_job_details with only the labels that stay put (compact) or every sacct field (legacy)
+        self.details = details or os.environ.get('SLURM_EXPORTER_JOB_DETAILS', 'compact')
+        # Most jobs per partition with per job series in compact mode, 0 for no limit
+        self.limit = int(limit if limit is not None else os.environ.get('SLURM_EXPORTER_JOB_LIMIT', 1000))
+        # Jobs seen so far, updated from the jobs that changed since the last poll
+        self.tracker = JobTracker(retention=float(os.environ.get('SLURM_EXPORTER_JOB_RETENTION', 86400)),
+                                  resync=float(os.environ.get('SLURM_EXPORTER_JOB_RESYNC', 3600)))
 
-    # Get all partitions with 'kempner'
+    # Get all partitions with 'kempner' from the shared topology, fetched again only when slurm.conf changes
     def get_kempner_partitions(self):
         try:
-            output = self.run_cmd(['timeout', '-s', '9', '30s', '/usr/bin/sinfo', '-h', '-o', '%R'])
-            partitions = []
-            seen = set()
-            
-            for line in output.splitlines():
-                partition = line.strip()
-                if partition and 'kempner' in partition.lower() and partition not in seen:
-                    partitions.append(partition)
-                    seen.add(partition)
+            partitions = slurm_topology.topology.current().names(lambda p: 'kempner' in p.lower())
             
             if partitions:
                 return ','.join(partitions)
@@ -53,77 +139,120 @@ class SlurmJobNodeCollector(Collector):
                 return ','.join(self.fallback_kempner_partitions)
                 
         except Exception as e:
-            print(f"Error discovering partitions, using fallback: {e}")
+            slurm_instrument.error(self, 'partitions', e)
             return ','.join(self.fallback_kempner_partitions)
 
+    def select_jobs(self, job_rows):
+        """Pick the jobs to export from the sacct rows, returning them in sacct order with the job counts per partition.
+
+        In compact mode with a limit only the first self.limit jobs of each
+        partition by (running, cpus) are kept, in a heap per partition so
+        memory is bounded by the limit rather than the number of jobs.
+        """
+        limit = self.limit if self.details != 'legacy' else 0
+        partition_counts = {}
+        selected = {}
+        for seq, parts in enumerate(job_rows):
+            if len(parts) < 19:
+                continue
+            job_id, partition, state, ncpus = parts[0], parts[3], parts[5], parts[14]
+            # Skip empty or invalid entries
+            if not job_id or not state or not partition:
+                continue
+            partition_counts[partition] = partition_counts.get(partition, 0) + 1
+
+            # Ties go to the jobs sacct listed first
+            entry = ((state == "RUNNING", int(ncpus) if ncpus.isdigit() else 0, -seq), parts)
+            heap = selected.setdefault(partition, [])
+            if not limit:
+                heap.append(entry)
+            elif len(heap) < limit:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+        kept = sorted((entry for heap in selected.values() for entry in heap), key=lambda entry: -entry[0][2])
+        return [parts for key, parts in kept], partition_counts
+
     def collect(self):
         job_state = GaugeMetricFamily('slurm_job_state', 'SLURM job state (1=RUNNING, 0=other)', labels=['job_id', 'state'])
-        job_details = GaugeMetricFamily('slurm_job_details', 'Comprehensive SLURM job information from sacct', 
-                                      labels=['job_id', 'job_id_raw', 'user', 'partition', 'account', 'state', 'tres_cpu', 'tres_mem', 'tres_gres', 'start_time', 'end_time', 'elapsed', 'alloc_tres', 'node_list', 'ncpus', 'req_cpus', 'submit', 'eligible', 'reason'])
         jobs_per_partition = GaugeMetricFamily('slurm_jobs_per_partition', 'Number of jobs per SLURM partition', labels=['partition'])
         node_status = GaugeMetricFamily('slurm_node_status', 'SLURM node status (1=up, 0=down)', labels=['node', 'state'])
+        if self.details == 'legacy':
+            job_details = GaugeMetricFamily('slurm_job_details', 'Comprehensive SLURM job information from sacct', labels=LEGACY_LABELS)
+            job_times = []
+        else:
+            job_details = GaugeMetricFamily('slurm_job_details', 'SLURM job information from sacct', labels=DETAIL_LABELS)
+            job_elapsed = GaugeMetricFamily('slurm_job_elapsed_seconds', 'Time the SLURM job has run', labels=['job_id'])
+            job_submit = GaugeMetricFamily('slurm_job_submit_time_seconds', 'Time the SLURM job was submitted', labels=['job_id'])
+            job_eligible = GaugeMetricFamily('slurm_job_eligible_time_seconds', 'Time the SLURM job became eligible to run', labels=['job_id'])
+            job_start = GaugeMetricFamily('slurm_job_start_time_seconds', 'Time the SLURM job started', labels=['job_id'])
+            job_end = GaugeMetricFamily('slurm_job_end_time_seconds', 'Time the SLURM job ended', labels=['job_id'])
+            job_reason = GaugeMetricFamily('slurm_job_reason', 'Reason the SLURM job is waiting or ended', labels=['job_id', 'reason'])
+            job_omitted = GaugeMetricFamily('slurm_job_details_omitted', 'Jobs per SLURM partition over the limit left out of the per job metrics', labels=['partition'])
+            job_times = [job_elapsed, job_submit, job_eligible, job_start, job_end, job_reason, job_omitted]
 
-        kempner_partitions = self.get_kempner_partitions()
+        kempner_partitions = slurm_instrument.parsed(self, self.get_kempner_partitions)
 
         # Get job data from sacct 
         try:
-            sacct_format = 'JobID,JobIDRaw,User,Partition,Account,State,AllocCPUS,ReqMem,ReqTRES,Start,End,Elapsed,AllocTRES,NodeList,NCPUs,ReqCPUS,Submit,Eligible,Reason'
-            main_output = self.run_cmd(['timeout', '-s', '9', '60s', '/usr/bin/sacct', 
-                                     '--parsable2', '--noheader', '--allusers', '-X',
-                                     '--partition=' + kempner_partitions,
-                                     '--format=' + sacct_format])
-
-            # Supplemental sacct call for the first 2 minutes after midnight.
-            now = datetime.now()
-            if now.hour == 0 and now.minute < 2:
-                yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%dT23:58:00')
-                supplemental = self.run_cmd(['timeout', '-s', '9', '60s', '/usr/bin/sacct',
-                                           '--parsable2', '--noheader', '--allusers', '-X',
-                                           '--partition=' + kempner_partitions,
-                                           '--starttime=' + yesterday,
-                                           '--format=' + sacct_format])
-                if supplemental:
-                    main_output = main_output + '\n' + supplemental
-
-            job_output = main_output
-            partition_counts = {}
-            
-            for line in job_output.splitlines():
-                if line.strip():
-                    parts = line.strip().split('|')  
-                    if len(parts) >= 19:
-                        job_id, job_id_raw, user, partition, account, state, cpu, memory, tres, start_time, end_time, elapsed, alloc_tres, node_list, ncpus, req_cpus, submit, eligible, reason = parts[0:19]
-                        
-                        # Skip empty or invalid entries
-                        if not job_id or not state or not partition:
-                            continue
-
-                        # Add job state
-                        value = 1 if state == "RUNNING" else 0
-                        job_state.add_metric([job_id, state], value)
-                        
-                        # Add job details 
-                        job_details.add_metric([
-                            job_id, job_id_raw, user, partition, account, state, 
-                            cpu or "0", memory or "0", tres or "none", 
-                            start_time or "unknown", end_time or "unknown",
-                            elapsed or "0", alloc_tres or "none", node_list or "unknown", ncpus or "0", req_cpus or "0",
-                            submit or "unknown", eligible or "unknown",
-                            reason or "unknown"
-                        ], 1)
-                        
-                        partition_counts[partition] = partition_counts.get(partition, 0) + 1
+            now = time.time()
+            start, full = self.tracker.window(kempner_partitions, now)
+            starttime = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start))
+            job_rows = slurm_instrument.records(self, self.run_sacct, kempner_partitions, ['--starttime=' + starttime])
+            self.tracker.update(kempner_partitions, job_rows, now, full)
+
+            jobs, partition_counts = self.select_jobs(self.tracker.jobs.values())
+            # Partitions without jobs, including ones with no nodes, are reported as 0
+            for partition in kempner_partitions.split(','):
+                partition_counts.setdefault(partition, 0)
+
+            for parts in jobs:
+                job_id, job_id_raw, user, partition, account, state, cpu, memory, tres, start_time, end_time, elapsed, alloc_tres, node_list, ncpus, req_cpus, submit, eligible, reason = parts[0:19]
+
+                # Add job state
+                value = 1 if state == "RUNNING" else 0
+                job_state.add_metric([job_id, state], value)
+
+                # Add job details 
+                if self.details == 'legacy':
+                    job_details.add_metric([
+                        job_id, job_id_raw, user, partition, account, state, 
+                        cpu or "0", memory or "0", tres or "none", 
+                        start_time or "unknown", end_time or "unknown",
+                        elapsed or "0", alloc_tres or "none", node_list or "unknown", ncpus or "0", req_cpus or "0",
+                        submit or "unknown", eligible or "unknown",
+                        reason or "unknown"
+                    ], 1)
+                    continue
+
+                job_details.add_metric([
+                    job_id, job_id_raw, user, partition, account, state,
+                    cpu or "0", memory or "0", tres or "none",
+                    alloc_tres or "none", node_list or "unknown", ncpus or "0", req_cpus or "0"
+                ], 1)
+                seconds = parse_duration(elapsed)
+                if seconds is not None:
+                    job_elapsed.add_metric([job_id], seconds)
+                for family, timestamp in ((job_submit, submit), (job_eligible, eligible), (job_start, start_time), (job_end, end_time)):
+                    timestamp = parse_timestamp(timestamp)
+                    if timestamp is not None:
+                        family.add_metric([job_id], timestamp)
+                if reason and reason != "None":
+                    job_reason.add_metric([job_id, reason], 1)
 
             # Add partition counts
             for partition, count in partition_counts.items():
                 jobs_per_partition.add_metric([partition], count)
+                if self.details != 'legacy':
+                    job_omitted.add_metric([partition], max(count - self.limit, 0) if self.limit else 0)
                 
         except Exception as e:
-            print(f"Error collecting job data: {e}")
+            slurm_instrument.error(self, 'jobs', e)
 
         # Set node status
         try:
-            sinfo_output = self.run_cmd(['timeout', '-s', '9', '60s', '/usr/bin/sinfo', 
+            sinfo_output = slurm_instrument.parsed(self, self.run_cmd, ['timeout', '-s', '9', '60s', '/usr/bin/sinfo', 
                                        '-Nh', '-o', '%N %T %R', 
                                        '-p', kempner_partitions])
             for line in sinfo_output.splitlines():
@@ -134,21 +263,37 @@ class SlurmJobNodeCollector(Collector):
                     value = 1 if state.upper() == "UP" else 0
                     node_status.add_metric([node, state], value)
         except Exception as e:
-            print(f"Error collecting node data: {e}")
+            slurm_instrument.error(self, 'nodes', e)
 
         # Always yield metrics (even if empty)
         yield job_state
         yield job_details  
+        yield from job_times
         yield jobs_per_partition
         yield node_status
 
+    def run_sacct(self, partitions, extra_args=[]):
+        """Run sacct for the given partitions and return an iterator of job field lists."""
+        if self.backend == 'json':
+            # Decoded incrementally as sacct writes it out
+            return slurm_json.sacct_rows(slurm_source.stream(['timeout', '-s', '9', '60s', '/usr/bin/sacct',
+                                                             '--json', '--allusers', '-X',
+                                                             '--partition=' + partitions] + extra_args))
+
+        sacct_format = 'JobID,JobIDRaw,User,Partition,Account,State,AllocCPUS,ReqMem,ReqTRES,Start,End,Elapsed,AllocTRES,NodeList,NCPUs,ReqCPUS,Submit,Eligible,Reason'
+        # Read line by line rather than buffering the whole of sacct's output
+        lines = slurm_source.stream(['timeout', '-s', '9', '60s', '/usr/bin/sacct',
+                                     '--parsable2', '--noheader', '--allusers', '-X',
+                                     '--partition=' + partitions] + extra_args +
+                                    ['--format=' + sacct_format])
+        return (line.strip().split('|') for line in lines if line.strip())
+
     def run_cmd(self, cmd):
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
+        return slurm_source.output(cmd).strip()
 
 if __name__ == "__main__":
     start_http_server(9009)
-    REGISTRY.register(SlurmJobNodeCollector())
+    register(SlurmJobNodeCollector(), 30)
     
     print("Kempner job metrics collector started. Metrics available at http://localhost:9009/metrics")
     
@@ -5,8 +5,6 @@ A script to get general Slurm cluster statistics.
 """
 
 import sys,os
-import subprocess
-import shlex
 import time
 from os import path
 
@@ -17,121 +15,138 @@ external = os.path.join(prefix, 'external')
 sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_nodes
+import slurm_weights
+from slurm_http import start_http_server
+from slurm_snapshot import register
+
+# Node states counted and the slurm_nodes category each one is
+STATUSES = {"IDLE": slurm_nodes.NODE_IDLE, "MIXED": slurm_nodes.NODE_MIXED, "ALLOC": slurm_nodes.NODE_ALLOC,
+            "PLANNED": slurm_nodes.NODE_PLANNED, "RES": slurm_nodes.NODE_RES, "COMP": slurm_nodes.NODE_COMP,
+            "DRAIN": slurm_nodes.NODE_DRAIN, "DOWN": slurm_nodes.NODE_DOWN, "PWD": slurm_nodes.NODE_PWD}
+
+# CPU and GPU types always exported, others are added when kempner nodes have them
+KEMPNER_TYPES = ["genoa", "icelake", "a100", "a100-mig", "h100"]
+
+def kempner_node(node):
+    """Nodes whose partition list starts with a kempner partition."""
+    return bool(node.partitions) and node.partitions[0].startswith("kempner")
 
 class SlurmClusterStatusCollector:
     def __init__(self):
         self.metrics = self.initialize_metrics()
-        self.t2g = 93.25  # Translation from TRES to GFLOPs
-        #Current TRES weights
-        self.wcpu = {'genoa': 0.6, 'icelake': 1.15}
-        self.wgpu = {'a100': 209.1, 'a100-mig': 29.9, 'h100': 546.9}
+        # TRES weights and translation to GFLOPs, from tres_weights.json
+        self.weights = slurm_weights.weights
 
     def initialize_metrics(self):
         """Initialize all the metrics and counters."""
         metrics = {
-"CPUTot":0, "CPULoad":0, "CPUAlloc":0, "RealMem":0, "MemAlloc":0, "MemLoad":0, "GPUTot":0, "GPUAlloc":0, "NodeTot":0, "IDLETot":0, "DOWNTot":0, "DRAINTot":0, "MIXEDTot":0, "ALLOCTot":0, "RESTot":0, "COMPTot":0, "PLANNEDTot":0, "IDLECPU":0, "MIXEDCPU":0, "ALLOCCPU":0, "COMPCPU":0, "RESCPU":0, "PLANNEDCPU":0, "DRAINCPU":0, "DOWNCPU":0, "IDLEMem":0, "MIXEDMem":0, "ALLOCMem":0, "COMPMem":0, "PLANNEDMem":0, "DRAINMem":0, "DOWNMem":0, "RESMem":0, "IDLEGPU":0, "MIXEDGPU":0, "ALLOCGPU":0, "COMPGPU":0, "DRAINGPU":0, "DOWNGPU":0, "RESGPU":0, "PLANNEDGPU":0, "PerAlloc":0 
+"CPUTot":0, "CPULoad":0, "CPUAlloc":0, "RealMem":0, "MemAlloc":0, "MemLoad":0, "GPUTot":0, "GPUAlloc":0, "NodeTot":0, "IDLETot":0, "DOWNTot":0, "DRAINTot":0, "PWDTot":0, "MIXEDTot":0, "ALLOCTot":0, "RESTot":0, "COMPTot":0, "PLANNEDTot":0, "IDLECPU":0, "MIXEDCPU":0, "ALLOCCPU":0, "COMPCPU":0, "RESCPU":0, "PLANNEDCPU":0, "DRAINCPU":0, "DOWNCPU":0, "PWDCPU":0, "IDLEMem":0, "MIXEDMem":0, "ALLOCMem":0, "COMPMem":0, "PLANNEDMem":0, "DRAINMem":0, "DOWNMem":0, "PWDMem":0, "RESMem":0, "IDLEGPU":0, "MIXEDGPU":0, "ALLOCGPU":0, "COMPGPU":0, "DRAINGPU":0, "DOWNGPU":0, "PWDGPU":0, "RESGPU":0, "PLANNEDGPU":0, "PerAlloc":0 
         }
-        cpu_gpu_types = ["genoa", "icelake", "a100", "a100-mig", "h100"]
-        for ctype in cpu_gpu_types:
-            metrics[f"tcpu_{ctype}"] = 0
-            metrics[f"ucpu_{ctype}"] = 0
-            metrics[f"tgpu_{ctype}"] = 0
-            metrics[f"ugpu_{ctype}"] = 0
-            metrics[f"umem_{ctype}"] = 0
+        for ctype in KEMPNER_TYPES:
+            self.add_type(metrics, ctype)
         return metrics
 
-    def run_command(self, command):
-        """Run a command and return its output."""
+    def add_type(self, metrics, ctype):
+        """Add the counters of a CPU or GPU type if they are not there yet."""
+        if f"tcpu_{ctype}" not in metrics:
+            for prefix in ("tcpu", "ucpu", "tgpu", "ugpu", "umem"):
+                metrics[f"{prefix}_{ctype}"] = 0
+
+    def get_nodes(self):
+        """Get the node table from the shared inventory as columns, or None if it could not be fetched."""
         try:
             self.metrics = self.initialize_metrics()
-            proc = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
-            #for line in proc.stdout:
-            #    print(line)
-            return proc.stdout
-        except subprocess.SubprocessError as e:
-            print(f"Error running command {command}: {e}")
-            return []
-
-    def process_node_info(self, node, cfgtres, alloctres):
-        """Update the metrics based on node, cfgTRES, and allocTRES."""
-        numgpu = int(cfgtres.get('gres/gpu', 0))
-        agpu = int(alloctres.get('gres/gpu', 0))
-        self.metrics['NodeTot'] += 1
-        self.metrics['CPUTot'] += int(node['CPUTot'])
-        self.metrics['CPUAlloc'] += int(node['CPUAlloc'])
-        self.metrics['RealMem'] += int(node['RealMemory'])
-        self.metrics['MemAlloc'] += min(int(node['AllocMem']), int(node['RealMemory']))
-        self.metrics['MemLoad'] += int(node['RealMemory']) - int(node['FreeMem']) if node['FreeMem'] != 'N/A' else 0
-        self.metrics['CPULoad'] += float(node['CPULoad']) if node['CPULoad'] != 'N/A' else 0
-        self.metrics['GPUTot'] += numgpu
-        self.metrics['GPUAlloc'] += agpu
-        for f in node['AvailableFeatures'].split(","):
-            if f in self.wcpu:
-                self.metrics[f"tcpu_{f}"] += int(node['CPUTot'])
-                self.metrics[f"ucpu_{f}"] += int(node['CPUAlloc'])
-                self.metrics[f"umem_{f}"] += int(node['CPUTot']) * int(node['AllocMem']) / int(node['RealMemory'])
-            if f in self.wgpu:
-                self.metrics[f"tgpu_{f}"] += numgpu
-                self.metrics[f"ugpu_{f}"] += agpu
-
-    def update_state_counters(self, node, cfgtres, alloctres):
-        """Update the counters based on the node's state."""
-        state = node['State']
-        for status in ["IDLE", "MIXED", "ALLOC", "RES", "COMP", "DRAIN", "DOWN"]:
-            if status in state:
-                self.metrics[f"{status}Tot"] += 1
-                self.metrics[f"{status}CPU"] += int(node['CPUTot'])
-                self.metrics[f"{status}Mem"] += int(node['RealMemory'])
-                if status in ["IDLE", "RES", "DRAIN", "DOWN"]:
-                    gpu_count = int(cfgtres.get('gres/gpu', 0))
-                if status in ["MIXED", "ALLOC",  "COMP"]:
-                    gpu_count = int(alloctres.get('gres/gpu', 0))
-                self.metrics[f"{status}GPU"] += gpu_count
+            table = slurm_instrument.parsed(self, slurm_nodes.inventory.columns)
+            slurm_instrument.count(self, len(table))
+            return table
+        except Exception as e:
+            slurm_instrument.error(self, 'nodes', e)
+            return None
+
+    def process_node_info(self, table):
+        """Update the metrics from the columns of the node table."""
+        self.metrics['NodeTot'] += len(table)
+        self.metrics['CPUTot'] += table.total(table.cputot)
+        self.metrics['CPUAlloc'] += table.total(table.cpualloc)
+        self.metrics['RealMem'] += table.total(table.realmem)
+        self.metrics['MemAlloc'] += table.total(table.memalloc)
+        self.metrics['MemLoad'] += table.total(table.memload)
+        self.metrics['CPULoad'] += table.total(table.cpuload)
+        self.metrics['GPUTot'] += table.total(table.gpus)
+        self.metrics['GPUAlloc'] += table.total(table.gpualloc)
+        # Percent occupancy, counting a node whose memory or GPUs are all allocated as full
+        self.metrics['PerAlloc'] += table.total(table.occupancy)
+        for f, nodes in self.weights.cpu_nodes(table).items():
+            if f not in KEMPNER_TYPES and not table.count(nodes):
+                continue
+            self.add_type(self.metrics, f)
+            self.metrics[f"tcpu_{f}"] += table.total(table.cputot, nodes)
+            self.metrics[f"ucpu_{f}"] += table.total(table.cpualloc, nodes)
+            self.metrics[f"umem_{f}"] += table.total(table.memshare, nodes)
+        for f, nodes in self.weights.gpu_nodes(table).items():
+            if f not in KEMPNER_TYPES and not table.count(nodes):
+                continue
+            self.add_type(self.metrics, f)
+            self.metrics[f"tgpu_{f}"] += table.total(table.gpus, nodes)
+            self.metrics[f"ugpu_{f}"] += table.total(table.gpualloc, nodes)
+
+    def update_state_counters(self, table):
+        """Update the counters from the states of the nodes in the table."""
+        for status, bit in STATUSES.items():
+            nodes = table.states(slurm_nodes.node_class, bit)
+            self.metrics[f"{status}Tot"] += table.count(nodes)
+            self.metrics[f"{status}CPU"] += table.total(table.cputot, nodes)
+            self.metrics[f"{status}Mem"] += table.total(table.realmem, nodes)
+            if status in ["IDLE", "PLANNED", "RES", "DRAIN", "DOWN", "PWD"]:
+                self.metrics[f"{status}GPU"] += table.total(table.gpus, nodes)
+            if status in ["MIXED", "ALLOC",  "COMP"]:
+                self.metrics[f"{status}GPU"] += table.total(table.gpualloc, nodes)
 
     def calculate_totals(self):
         """Calculate totals and FLOPs for CPU, GPU, and memory."""
-        tcputres = sum(float(self.wcpu[ctype]) * float(self.metrics[f"tcpu_{ctype}"]) for ctype in self.wcpu)
-        tgputres = sum(float(self.wgpu[gtype]) * float(self.metrics[f"tgpu_{gtype}"]) for gtype in self.wgpu)
-        ucputres = sum(float(self.wcpu[ctype]) * float(self.metrics[f"ucpu_{ctype}"]) for ctype in self.wcpu)
-        ugputres = sum(float(self.wgpu[gtype]) * float(self.metrics[f"ugpu_{gtype}"]) for gtype in self.wgpu)
+        def totals(prefix, types):
+            return {ctype: self.metrics.get(f"{prefix}_{ctype}", 0) for ctype in types}
+
+        tcputres = self.weights.cpu_tres(totals("tcpu", self.weights.cpu))
+        tgputres = self.weights.gpu_tres(totals("tgpu", self.weights.gpu))
+        ucputres = self.weights.cpu_tres(totals("ucpu", self.weights.cpu))
+        ugputres = self.weights.gpu_tres(totals("ugpu", self.weights.gpu))
 
         self.metrics['tcputres'] = tcputres
         self.metrics['tgputres'] = tgputres
         self.metrics['ucputres'] = ucputres
         self.metrics['ugputres'] = ugputres
-        self.metrics['tgflops'] = self.t2g * (tcputres + tgputres)
-        self.metrics['ugflops'] = self.t2g * (ucputres + ugputres)
+        self.metrics['tgflops'] = self.weights.t2g * (tcputres + tgputres)
+        self.metrics['ugflops'] = self.weights.t2g * (ucputres + ugputres)
 
     def collect_metrics(self):
-        """Collect all Slurm metrics."""
-        for line in self.run_command(['timeout','-s','9','60s','scontrol', '-o', 'show', 'node']):
-            if "Partitions=kempner" in line:
-                node, cfgtres, alloctres = self.parse_node(line)
-                self.process_node_info(node, cfgtres, alloctres)
-                self.update_state_counters(node, cfgtres, alloctres)
+        """Collect all Slurm metrics, returning False if the nodes could not be fetched."""
+        self.weights = slurm_weights.weights
+        table = self.get_nodes()
+        if table is None:
+            return False
+        table = table.select(kempner_node)
+        self.process_node_info(table)
+        self.update_state_counters(table)
         self.calculate_totals()
-
-    def parse_node(self, line):
-        """Parse a node line from scontrol output."""
-        #Sanitize input
-        line = line.replace("'", "\\'")
-
-        node = dict(s.split("=", 1) for s in shlex.split(line) if '=' in s)
-        cfgtres = dict(s.split("=", 1) for s in shlex.split(node['CfgTRES'].replace(",", " ")) if '=' in s)
-        alloctres = dict(s.split("=", 1) for s in shlex.split(node['AllocTRES'].replace(",", " ")) if '=' in s)
-        return node, cfgtres, alloctres
+        return True
 
     def collect(self):
         """Prometheus collector interface."""
-        self.collect_metrics()
+        # Export nothing rather than zeros when the nodes could not be fetched
+        if not self.collect_metrics():
+            return
         k_lsload = GaugeMetricFamily('k_lsload', 'Aggregate Cluster Node Stats', labels=['field'])
         for key, value in self.metrics.items():
             k_lsload.add_metric([key.lower()], value)
         yield k_lsload
 
 if __name__ == "__main__":
+    slurm_weights.install_reload()
     start_http_server(9005)
-    REGISTRY.register(SlurmClusterStatusCollector())
+    register(SlurmClusterStatusCollector(), 30)
     while True:
         time.sleep(30)
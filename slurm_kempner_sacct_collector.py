@@ -3,11 +3,13 @@
 import os
 import sys
 import re
-import csv
 import time
 import subprocess
-from typing import List, Tuple, Dict
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Set
 from datetime import datetime, timedelta
+from operator import mul
 from os import path
 
 
@@ -16,26 +18,35 @@ PREFIX = os.path.normpath(os.path.join(os.path.abspath(os.path.dirname(__file__)
 EXTERNAL = os.path.join(PREFIX, 'external')
 sys.path = [PREFIX, EXTERNAL] + sys.path
 
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
-from prometheus_client import start_http_server
+from prometheus_client.core import GaugeMetricFamily
 
-WGPU = {'a100': 209.1, 'h100': 546.9}
+import slurm_instrument
+import slurm_source
+import slurm_topology
+import slurm_weights
+from slurm_hostlist import expand
+from slurm_http import start_http_server
+from slurm_snapshot import register
+from slurm_usage_store import KINDS, UsageStore, window_start
+
+# Windows exported on top of the latest day and the cumulative totals
+WINDOWS = ['7d', '30d', 'quarter']
 
 # Utility Functions
 def extract_gres_gpu(string: str) -> int:
     match = re.search(r'gres/gpu=(\d+)', string)
     return int(match.group(1)) if match else 0
 
-def extract_gpu_factor(input_string: str) -> float:
+def extract_gpu_type(input_string: str, weights: slurm_weights.Weights) -> str:
+    """The weighted GPU type of the gres/gpu:<model> TRES in input_string, or None."""
     attributes = input_string.split(',')
     for attribute in attributes:
         if attribute.startswith('gres/gpu:'):
             gpu_info = attribute.split('=')[0].replace('gres/gpu:', '')
-            if 'h100' in gpu_info.lower():
-                return WGPU['h100']
-            elif 'a100' in gpu_info.lower():
-                return WGPU['a100']
-    return 0.0
+            gpu_type = weights.gpu_type(gpu_info)
+            if gpu_type:
+                return gpu_type
+    return None
 
 
 def convert_to_hours(time_str):
@@ -57,98 +68,129 @@ def convert_to_hours(time_str):
 
 
 
-def update_dictionary(data_dict: dict, name: str, t_time: float, g_time: float, g_tr_time: float, c_time: float):
-    if name in data_dict:
-        data_dict[name]['total_hours'] += t_time
-        data_dict[name]['gpu_hours'] += g_time
-        data_dict[name]['gpu_tres_hours'] += g_tr_time
-        data_dict[name]['cpu_hours'] += c_time
-    else:
-        data_dict[name] = {'total_hours': t_time, 'gpu_hours': g_time, 'gpu_tres_hours': g_tr_time, 'cpu_hours': c_time}
-
 def get_node_list() -> str:
+    """Nodes of the kempner_dev partition as comma separated hostlists, from the shared topology."""
     try:
-        command = 'sinfo -p kempner_dev -h -o "%N" | paste -sd ","'
-        result = subprocess.check_output(command, shell=True, universal_newlines=True)
-        return result.strip()
-    except subprocess.CalledProcessError:
+        return slurm_topology.topology.current().hostlist('kempner_dev')
+    except (subprocess.SubprocessError, OSError):
         return ""
 
-def get_node_names():
+
+def get_kempner_nodes() -> frozenset:
+    """Names of the nodes in the kempner_dev partition, from the shared topology."""
     try:
-        command = "sinfo -p kempner_requeue -N 1 | grep kempner | awk '{print $1}'"
-        result = subprocess.check_output(command, shell=True, universal_newlines=True)
-        node_names = result.strip().split('\n')
-        return node_names
-    except subprocess.CalledProcessError as e:
-        return []
+        return slurm_topology.topology.current().nodeset('kempner_dev')
+    except (subprocess.SubprocessError, OSError):
+        return frozenset()
 
+def check_kempner_node(n_name, kempner_nodes, p_key, gpu_type):
+    """
+    The partition a job's usage counts under, given its NodeList and the set of kempner node names.
 
-def check_kempner_node(n_name, n_list, p_key, w_factor):
+    The NodeList is expanded so each node is looked up by its full name, and
+    holygpu8a1 is never taken for holygpu8a11.
     """
-    Check if any node name matches a line and if the line does not contain 'kempner'.
+    return counted_partition(p_key, gpu_type, not kempner_nodes.isdisjoint(expand(n_name)))
+
+def counted_partition(p_key, gpu_type, on_kempner):
     """
-    for n in n_list:
-        if n_name in n_list and "kempner" not in p_key:
-            if w_factor == wgpu['h100']:
-                return "fasrc_h100"
-            if w_factor == wgpu['a100']:
-                return "fasrc_a100"
-            if w_factor == 0 :
-                return "fasrc_cpu"
-        else:
-            return p_key
-
-
-def process_cpu_gpu_usage(input_file_name):
-    partition_dict = {}
-    user_dict = {}
-    group_dict = {}
-    node_list = get_node_list()
-    global wgpu
-    wgpu = {'a100': 209.1, 'h100': 546.9}
-    with open(input_file_name, 'r') as file:
-        for line in file:
+    The partition usage counts under.
+
+    Jobs from other partitions that ran on any kempner node are counted as fasrc_<gpu type>, or fasrc_cpu.
+    """
+    if on_kempner and "kempner" not in p_key:
+        return f"fasrc_{gpu_type}" if gpu_type else "fasrc_cpu"
+    return p_key
+
+
+# Columns of hours summed per user, group and partition, as stored
+USAGE_COLUMNS = ('total_hours', 'gpu_hours', 'gpu_tres_hours', 'cpu_hours')
+
+class UsageColumns:
+    """
+    The finished GPU jobs in sacct lines, folded into columns.
+
+    Jobs are first summed into the elapsed hours of each distinct combination
+    of user, account, partition, AllocTRES, CPUs and whether they ran on a
+    kempner node, with a single dictionary update per job.  Everything derived
+    from those fields (the GPU count, type and TRES weight, and the partition
+    and group the hours count under) is then worked out once per combination
+    and kept as a code per name and arrays of hours, which totals() reduces
+    per partition, group or user.
+    The jobs of a user mostly come in a few shapes, so a month of jobs folds
+    into a few thousand combinations.
+    """
+    def __init__(self, lines, kempner_nodes, weights):
+        # Summed elapsed hours of each (user, account, partition, AllocTRES, CPUs, ran on kempner nodes)
+        combos = {}
+        elapsed = {}
+        # Whether each NodeList has a kempner node in it
+        on_kempner = {}
+        for line in lines:
             # Filter lines containing the finished jobs
-            #if "gpu" in line and "RUNNING" not in line and "PENDING" not in line:
-            if ("gpu" in line and "RUNNING" not in line) or ("gpu" in line and "PENDING" not in line):
-                # Split the line using the '|' separator
-                fields = line.strip().split('|')
-                gpu_count = 0
-                gpu_tres_hours = 0
-                # Ensure there are enough fields to avoid index errors
-                if len(fields) >= 8:
-                    user_key = fields[2]
-                    group_key = fields[3].split(',')[0]
-                    partition_key = fields[4].split(',')[0]
-                    gpu_tfield = fields[5]
-                    gpu_thours = convert_to_hours(gpu_tfield)
-                    gpu_count = extract_gres_gpu(fields[6])
-
-                    #cpu_count = extract_cpu_count(fields[6])
-                    node_name = fields[7]
-                    cpu_count = int(fields[11])
-                    cpu_hours = gpu_thours*cpu_count
-                    gpu_hours = gpu_count*gpu_thours
-                    tres_factor = extract_gpu_factor(fields[6])
-                    if tres_factor > 0:
-                        gpu_tres_hours = gpu_hours*tres_factor
-                    update_dictionary(user_dict, user_key, gpu_thours, cpu_hours, gpu_hours, gpu_tres_hours)
-
-                    partition_name = check_kempner_node(node_name, node_list, partition_key, tres_factor)
-                    update_dictionary(partition_dict, partition_name, gpu_thours, cpu_hours, gpu_hours, gpu_tres_hours)
-                    update_dictionary(user_dict, user_key, gpu_thours, cpu_hours, gpu_hours, gpu_tres_hours)
-                    if "kempner" in group_key:
-                        update_dictionary(group_dict, group_key, gpu_thours, cpu_hours, gpu_hours, gpu_tres_hours)
-
-
-
-
-def write_dict_to_file(data_dict: dict, file_name: str):
-    with open(file_name, 'w') as file:
-        sorted_data_dict = dict(sorted(data_dict.items(), key=lambda x: x[1]['gpu_hours'], reverse=True))
-        for k, v in sorted_data_dict.items():
-            file.write(f"name= {k} , cpu_hours= {v['cpu_hours']:.1f}, gpu_hours= {v['gpu_hours']:.1f}, gpu_tres_hours= {v['gpu_tres_hours']:.1f} \n")
+            if "gpu" not in line or ("RUNNING" in line and "PENDING" in line):
+                continue
+            # Only the first 12 fields are used, so the rest are left in one piece
+            fields = line.split('|', 12)
+            # Ensure there are enough fields to avoid index errors
+            if len(fields) < 12:
+                continue
+            hours = elapsed.get(fields[5])
+            if hours is None:
+                hours = elapsed[fields[5]] = convert_to_hours(fields[5])
+            kempner = on_kempner.get(fields[7])
+            if kempner is None:
+                kempner = on_kempner[fields[7]] = not kempner_nodes.isdisjoint(expand(fields[7]))
+            key = (fields[2], fields[3], fields[4], fields[6], fields[11], kempner)
+            combos[key] = combos.get(key, 0.0) + hours
+
+        # Code of each name by kind.  Jobs of groups that are not kempner's have the code of None.
+        self.names = {kind: {} for kind in KINDS}
+        self.codes = {kind: array('L') for kind in KINDS}
+        self.hours = array('d', combos.values())
+        self.cpus = array('d')
+        self.gpus = array('d')
+        self.factors = array('d')
+        tres = {}
+        for user, account, partition, alloc_tres, cpus, kempner in combos:
+            if alloc_tres not in tres:
+                gpu_type = extract_gpu_type(alloc_tres, weights)
+                tres[alloc_tres] = (extract_gres_gpu(alloc_tres), gpu_type, weights.gpu[gpu_type] if gpu_type else 0.0)
+            gpu_count, gpu_type, tres_factor = tres[alloc_tres]
+            group_key = account.split(',')[0]
+            partition_name = counted_partition(partition.split(',')[0], gpu_type, kempner)
+            for kind, name in (('partition', partition_name), ('group', group_key if "kempner" in group_key else None),
+                               ('user', user)):
+                codes = self.names[kind]
+                if name not in codes:
+                    codes[name] = len(codes)
+                self.codes[kind].append(codes[name])
+            self.cpus.append(int(cpus))
+            self.gpus.append(gpu_count)
+            self.factors.append(tres_factor)
+
+    def columns(self):
+        """The arrays of hours per combination in USAGE_COLUMNS order."""
+        gpu_hours = array('d', map(mul, self.gpus, self.hours))
+        return (self.hours, gpu_hours, array('d', map(mul, gpu_hours, self.factors)),
+                array('d', map(mul, self.hours, self.cpus)))
+
+    def totals(self, kind, columns=None):
+        """Hours per name of a kind, keyed like the usage store, in the order the names were first seen."""
+        columns = columns or self.columns()
+        names = self.names[kind]
+        sums = [[0.0] * len(names) for column in columns]
+        for column, total in zip(columns, sums):
+            for code, hours in zip(self.codes[kind], column):
+                total[code] += hours
+        return {name: {c: total[code] for c, total in zip(USAGE_COLUMNS, sums)}
+                for name, code in names.items() if name is not None}
+
+def process_cpu_gpu_usage(lines: List[str]) -> Tuple[dict, dict, dict]:
+    usage = UsageColumns(lines, get_kempner_nodes(), slurm_weights.weights)
+    columns = usage.columns()
+    return usage.totals('partition', columns), usage.totals('group', columns), usage.totals('user', columns)
+
 
 def parse_line(line: str) -> dict:
     pattern = r"name=\s*(\S+)\s*,\s*cpu_hours=\s*([\d.]+)\s*,\s*gpu_hours=\s*([\d.]+)\s*,\s*gpu_tres_hours=\s*([\d.]+)"
@@ -175,65 +217,82 @@ def read_custom_csv(file_name: str) -> dict:
             }
     return data
 
-def merge_dictionaries(dict1: dict, dict2: dict) -> dict:
-    merged_data = dict1.copy()
-    for name_id, values in dict2.items():
-        if name_id in merged_data:
-            merged_data[name_id]['cpu_hours'] += values['cpu_hours']
-            merged_data[name_id]['gpu_hours'] += values['gpu_hours']
-            merged_data[name_id]['gpu_tres_hours'] += values['gpu_tres_hours']
-        else:
-            merged_data[name_id] = values
-    return merged_data
-
-def process_each_pair(file1: str, file2: str) -> dict:
-    data1 = read_custom_csv(file1)
-    data2 = read_custom_csv(file2)
-    return merge_dictionaries(data1, data2)
-
-def merge_files(file_pairs: List[Tuple[str, str]]):
-    for file1, file2 in file_pairs:
-        result_dict = process_each_pair(file1, file2)
-        write_dict_to_file(result_dict, file1)
-
-def run_command(s_date: str, e_date: str, output_file_path: str):
+def read_old_sums(file_name: str, kind: str) -> dict:
+    """
+    Read a *_sum.csv file written by an older version, with its hours put back in the right columns.
+
+    Older versions passed their hours to update_dictionary in the wrong order, so
+    the file's gpu_hours are CPU hours, its gpu_tres_hours GPU hours and its
+    cpu_hours GPU TRES hours.  They also counted every job twice for its user.
+    """
+    scale = 0.5 if kind == 'user' else 1.0
+    return {name: {'cpu_hours': v['gpu_hours'] * scale, 'gpu_hours': v['gpu_tres_hours'] * scale,
+                   'gpu_tres_hours': v['cpu_hours'] * scale}
+            for name, v in read_custom_csv(file_name).items()}
+
+# Seconds before days that failed to fetch are tried again, and between attempts to load the collector
+RETRY_INTERVAL = 3600
+
+# Days queried from sacct at once when catching up on missing days
+BACKFILL_WORKERS = int(os.environ.get('SLURM_EXPORTER_BACKFILL_WORKERS', 4))
+
+# States a job can end in, so sacct --state returns the jobs that finished in the window
+END_STATES = "BF,CA,CD,DL,F,NF,OOM,PR,TO"
+
+def run_command(s_time: str, e_time: str) -> Dict[str, List[str]]:
+    """
+    Fetch the jobs that ended between s_time and e_time with a single sacct query.
+
+    Jobs are deduplicated by JobIDRaw and returned grouped by the date they ended
+    on.  Jobs ending at e_time or later are left for the next window.  Raises
+    CalledProcessError if sacct fails, so a failed query is never taken for a
+    day without jobs.
+    """
     node_list = get_node_list()
     command = [
         "sacct",
         "-N", node_list,
-        "-S", s_date,
-        "-E", e_date,
+        "-S", s_time,
+        "-E", e_time,
+        "--state", END_STATES,
         "--allusers",
         "-X",
         "-p",
-        "--format=JobID,State,user%-24,Account%-24,partition%-24,Elapsed,AllocTRES%-160,NodeList%-160,ReqMem,MaxRSS,ExitCode,NCPUs,TotalCPU,CPUTime,ReqTRES,start,end%-120"
+        "--format=JobIDRaw,State,user%-24,Account%-24,partition%-24,Elapsed,AllocTRES%-160,NodeList%-160,ReqMem,MaxRSS,ExitCode,NCPUs,TotalCPU,CPUTime,ReqTRES,start,end%-120"
     ]
-    result = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
-    
-    seen_lines = set()
-    filtered_lines = []
-
-    for line in result.stdout.splitlines():
-        if line not in seen_lines:
-            seen_lines.add(line)
-            fields = line.split('|')
-            if len(fields) > 1:
-                last_field = fields[-2]
-                if last_field.split('T')[0] == e_date:
-                    filtered_lines.append(line)
-
-    with open(output_file_path, "w") as output_file:
-        for line in filtered_lines:
-            output_file.write(line + '\n')
-
-def find_missing_dates(file_path: str) -> List[Tuple[datetime, datetime]]:
+    output = slurm_source.output(command)
+
+    seen_jobs = set()
+    lines_by_date = {}
+
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) > 1:
+            job_id = fields[0]
+            end_time = fields[-2]
+            # ISO timestamps compare correctly as strings, Unknown sorts after digits
+            if job_id in seen_jobs or not end_time < e_time:
+                continue
+            seen_jobs.add(job_id)
+            lines_by_date.setdefault(end_time.split('T')[0], []).append(line)
+
+    return lines_by_date
+
+def read_watermark(file_path: str) -> str:
+    """Return the end time everything before which has been ingested, or None."""
+    try:
+        with open(file_path, 'r') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def find_missing_dates(entry_dates: Set[str]) -> List[Tuple[datetime, datetime]]:
     date_format = "%Y-%m-%d"
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    entry_dates = {datetime.strptime(line.strip().split(',')[0], date_format).date() for line in lines}
-    oldest_date = min(entry_dates)
+    entry_dates = {datetime.strptime(day, date_format).date() for day in entry_dates}
     today = datetime.now().date()
     end_date = today - timedelta(days=1)
+    # A fresh store starts with yesterday
+    oldest_date = min(entry_dates) if entry_dates else end_date
     missing_dates = []
     current_date = oldest_date
     while current_date <= end_date:
@@ -243,93 +302,97 @@ def find_missing_dates(file_path: str) -> List[Tuple[datetime, datetime]]:
         current_date += timedelta(days=1)
     return missing_dates
 
-def getdata_current_or_missing_dates(time_stamp_entry_file):
-    missing_dates = find_missing_dates(time_stamp_entry_file)
-    if (len(missing_dates)>0):
-        with open(time_stamp_file, 'a') as file:
-            for p_end_date, end_date in missing_dates:
-                e_date = str(end_date)
-                s_date = str((datetime.strptime(e_date, '%Y-%m-%d') - timedelta(days=10)).date())
-                today_sacct_data_file_path = "/slurm/kempner_sacct_collect_tmp_files/today_sacct.data"
-                run_command(s_date, e_date, today_sacct_data_file_path)
-                process_cpu_gpu_usage(today_sacct_data_file_path)
-                merge_files(file_pairs)
-                file.write(f"{e_date}\n")
-        return "non-empty"
-                
-    else: 
-        return "empty"
-
-def read_file_to_dict(file_path: str, include_index=False, start_index=1) -> Tuple[Dict[str, Dict[str, float]], int]:
-    data = {}
-    current_index = start_index
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if len(row) >= 4:
-                name_id = row[0].split('=')[1].strip()
-                cpu_hours = float(row[1].split('=')[1].strip())
-                gpu_hours = float(row[2].split('=')[1].strip())
-                gpu_tres_hours = float(row[3].split('=')[1].strip())
-                if include_index:
-                    index_label = f"A{current_index}"
-                    data[name_id] = {'index': index_label, 'cpu_hours': cpu_hours, 'gpu_hours': gpu_hours, 'gpu_tres_hours': gpu_tres_hours}
-                    current_index += 1
-                else:
-                    data[name_id] = {'cpu_hours': cpu_hours, 'gpu_hours': gpu_hours, 'gpu_tres_hours': gpu_tres_hours}
-    return data, current_index
-
-def read_file_pairs(file_pairs: List[Tuple[str, str]]):
+def fetch_day(s_time: str, end_date) -> Tuple[dict, int]:
+    """Query sacct for the jobs that ended on end_date, from s_time on, and sum their usage by kind."""
+    lines = run_command(s_time, f"{end_date + timedelta(days=1)}T00:00:00").get(str(end_date), [])
+    partition_dict, group_dict, user_dict = process_cpu_gpu_usage(lines)
+    return {'partition': partition_dict, 'group': group_dict, 'user': user_dict}, len(lines)
+
+def getdata_current_or_missing_dates(store: UsageStore, workers: int = None, collector=None):
     """
-    Reads file pairs one at a time and stores data in six dictionaries.
+    Fetch and commit the days missing from the store, reporting the days that fail against collector.
 
-    :param file_pairs: List of tuples containing file paths for each category (partition, group, user).
-    :return: Six dictionaries for each data type and sum data.
+    Returns the number of days that failed.
     """
-    # Initialize separate dictionaries for each type and sum type
-    partition_dict = {}
-    partition_dict_sum = {}
-    group_dict = {}
-    group_dict_sum = {}
-    user_dict = {}
-    user_dict_sum = {}
-
-    # Initialize starting index for 'A' labels for each dictionary
-    partition_index = 1
-    partition_sum_index = 1
-    group_index = 1
-    group_sum_index = 1
-    user_index = 1
-    user_sum_index = 1
-
-    for file_sum, file_regular in file_pairs:
-        # Determine which dictionary to update based on the file path
-        if 'partition' in file_sum:
-            # Update partition sum and regular dictionaries with unique indices
-            partition_dict_sum_data, partition_sum_index = read_file_to_dict(file_sum, include_index=True, start_index=partition_sum_index)
-            partition_dict_data, partition_index = read_file_to_dict(file_regular, include_index=True, start_index=partition_index)
-            partition_dict_sum.update(partition_dict_sum_data)
-            partition_dict.update(partition_dict_data)
-        elif 'group' in file_sum:
-            # Update group sum and regular dictionaries with unique indices
-            group_dict_sum_data, group_sum_index = read_file_to_dict(file_sum, include_index=True, start_index=group_sum_index)
-            group_dict_data, group_index = read_file_to_dict(file_regular, include_index=True, start_index=group_index)
-            group_dict_sum.update(group_dict_sum_data)
-            group_dict.update(group_dict_data)
-        elif 'user' in file_sum:
-            # Update user sum and regular dictionaries with unique indices
-            user_dict_sum_data, user_sum_index = read_file_to_dict(file_sum, include_index=True, start_index=user_sum_index)
-            user_dict_data, user_index = read_file_to_dict(file_regular, include_index=True, start_index=user_index)
-            user_dict_sum.update(user_dict_sum_data)
-            user_dict.update(user_dict_data)
-
-    return partition_dict, partition_dict_sum, group_dict, group_dict_sum, user_dict, user_dict_sum
+    missing_dates = find_missing_dates(store.days())
+    # Days before the watermark have already been ingested
+    watermark = store.watermark()
+    if watermark:
+        missing_dates = [(p, d) for p, d in missing_dates if str(d) >= watermark.split('T')[0]]
+    if (len(missing_dates)>0):
+        # Each day is queried and summed on its own, at most workers days at a time to spare slurmdbd
+        workers = max(min(workers or BACKFILL_WORKERS, len(missing_dates)), 1)
+        # ISO timestamps compare correctly as strings, so a day the watermark falls in starts from it
+        starts = [max(watermark or "", f"{end_date}T00:00:00") for p_end_date, end_date in missing_dates]
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ksacct-backfill')
+        try:
+            days = [pool.submit(fetch_day, start, end_date) for start, (p_end_date, end_date) in zip(starts, missing_dates)]
+            # Committed in date order as they come in.  A day that fails, whether sacct failed or
+            # one of its rows did not parse, is skipped without being marked ingested and holds the
+            # watermark back, so the next run tries it again while the days after it still go in.
+            failed = 0
+            for (p_end_date, end_date), day in zip(missing_dates, days):
+                try:
+                    usage, jobs = day.result()
+                except Exception as e:
+                    slurm_instrument.error(collector, 'sacct', e)
+                    failed = failed + 1
+                    continue
+                # The day's rows, the day and the watermark are committed together
+                watermark = None if failed else f"{end_date + timedelta(days=1)}T00:00:00"
+                store.commit_day(str(end_date), usage, jobs=jobs, watermark=watermark)
+        finally:
+            pool.shutdown(cancel_futures=True)
+        return failed
+    else:
+        return 0
 
+def migrate_text_files(store: UsageStore):
+    """
+    Carry the state kept by older versions in text files over to a new store.
 
+    The cumulative sums become baseline rows, since they were never broken down by
+    day, and the processed dates and watermark are kept so nothing is ingested twice.
+    """
+    if store.days() or not os.path.exists(time_stamp_file):
+        return
+    usage = {}
+    for (file_sum, file_regular), kind in zip(file_pairs, KINDS):
+        if os.path.exists(file_sum):
+            usage[kind] = read_old_sums(file_sum, kind)
+    store.import_baseline(usage)
+    with open(time_stamp_file, 'r') as file:
+        store.mark_ingested([line.strip().split(',')[0] for line in file if line.strip()])
+    watermark = read_watermark(watermark_file)
+    if watermark:
+        store.set_meta('watermark', watermark)
 
 class SlurmKempnerSacctsCollector:
+    def __init__(self, store: UsageStore, windows: List[str] = WINDOWS):
+        self.store = store
+        self.windows = windows
+        # Time before which days that failed are not asked of sacct again
+        self.retry_at = 0
+
+    def add_rows(self, cpu_metric, gpu_metric, gpu_tres_metric, rows, label=None):
+        """Add (name, cpu, gpu, gpu tres) rows, labelled with an A1, A2... index or the given label."""
+        for i, (name_id, cpu_hours, gpu_hours, gpu_tres_hours) in enumerate(rows, 1):
+            labels = [name_id, label or f"A{i}"]
+            cpu_metric.add_metric(labels, cpu_hours)
+            gpu_metric.add_metric(labels, gpu_hours)
+            gpu_tres_metric.add_metric(labels, gpu_tres_hours)
 
     def collect(self):
+        # Pick up any days that ended since the last collection.  Days that failed are tried again
+        # after RETRY_INTERVAL rather than on every scrape, to spare slurmdbd.
+        if time.time() >= self.retry_at:
+            try:
+                failed = slurm_instrument.parsed(self, getdata_current_or_missing_dates, self.store, None, self)
+            except Exception as e:
+                slurm_instrument.error(self, 'sacct', e)
+                failed = 1
+            self.retry_at = time.time() + RETRY_INTERVAL if failed else 0
+
         # Create GaugeMetricFamily for cpu_hours, gpu_hours, and gpu_tres_hours with name_id and index labels
         day_cpu_hours_part_metric = GaugeMetricFamily(
             'day_cpu_part_hours',
@@ -427,39 +490,72 @@ class SlurmKempnerSacctsCollector:
             labels=['name_id', 'index']
         )
 
-        # Add metrics from partition_dict, group_dict, user_dict
-        for name_id, metrics in partition_dict.items():
-            index = metrics['index']
-            day_cpu_hours_part_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            day_gpu_hours_part_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            day_gpu_tres_hours_part_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
-        for name_id, metrics in group_dict.items():
-            index = metrics['index']
-            day_cpu_hours_group_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            day_gpu_hours_group_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            day_gpu_tres_hours_group_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
-        for name_id, metrics in user_dict.items():
-            index = metrics['index']
-            day_cpu_hours_user_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            day_gpu_hours_user_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            day_gpu_tres_hours_user_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
-
-        # Add metrics from partition_dict_sum, group_dict_sum, user_dict_sum
-        for name_id, metrics in partition_dict_sum.items():
-            index = metrics['index']
-            tot_cpu_hours_part_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            tot_gpu_hours_part_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            tot_gpu_tres_hours_part_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
-        for name_id, metrics in group_dict_sum.items():
-            index = metrics['index']
-            tot_cpu_hours_group_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            tot_gpu_hours_group_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            tot_gpu_tres_hours_group_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
-        for name_id, metrics in user_dict_sum.items():
-            index = metrics['index']
-            tot_cpu_hours_user_metric.add_metric([name_id, index], metrics['cpu_hours'])
-            tot_gpu_hours_user_metric.add_metric([name_id, index], metrics['gpu_hours'])
-            tot_gpu_tres_hours_user_metric.add_metric([name_id, index], metrics['gpu_tres_hours'])
+        window_cpu_hours_part_metric = GaugeMetricFamily(
+            'window_cpu_part_hours',
+            'CPU hours for partition over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_hours_part_metric = GaugeMetricFamily(
+            'window_gpu_part_hours',
+            'GPU hours for partition over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_tres_hours_part_metric = GaugeMetricFamily(
+            'window_gpu_tres_part_hours',
+            'GPU hours for partition over a window',
+            labels=['name_id', 'window']
+        )
+
+        window_cpu_hours_group_metric = GaugeMetricFamily(
+            'window_cpu_group_hours',
+            'CPU hours for group over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_hours_group_metric = GaugeMetricFamily(
+            'window_gpu_group_hours',
+            'GPU hours for group over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_tres_hours_group_metric = GaugeMetricFamily(
+            'window_gpu_tres_group_hours',
+            'GPU hours for group over a window',
+            labels=['name_id', 'window']
+        )
+
+        window_cpu_hours_user_metric = GaugeMetricFamily(
+            'window_cpu_user_hours',
+            'CPU hours for user over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_hours_user_metric = GaugeMetricFamily(
+            'window_gpu_user_hours',
+            'GPU hours for user over a window',
+            labels=['name_id', 'window']
+        )
+        window_gpu_tres_hours_user_metric = GaugeMetricFamily(
+            'window_gpu_tres_user_hours',
+            'GPU hours for user over a window',
+            labels=['name_id', 'window']
+        )
+
+        # The latest day ingested
+        day = self.store.latest_day()
+        if day:
+            self.add_rows(day_cpu_hours_part_metric, day_gpu_hours_part_metric, day_gpu_tres_hours_part_metric, self.store.totals('partition', day, day))
+            self.add_rows(day_cpu_hours_group_metric, day_gpu_hours_group_metric, day_gpu_tres_hours_group_metric, self.store.totals('group', day, day))
+            self.add_rows(day_cpu_hours_user_metric, day_gpu_hours_user_metric, day_gpu_tres_hours_user_metric, self.store.totals('user', day, day))
+
+        # Cumulative totals over every day
+        self.add_rows(tot_cpu_hours_part_metric, tot_gpu_hours_part_metric, tot_gpu_tres_hours_part_metric, self.store.totals('partition'))
+        self.add_rows(tot_cpu_hours_group_metric, tot_gpu_hours_group_metric, tot_gpu_tres_hours_group_metric, self.store.totals('group'))
+        self.add_rows(tot_cpu_hours_user_metric, tot_gpu_hours_user_metric, tot_gpu_tres_hours_user_metric, self.store.totals('user'))
+
+        # Totals over the configured windows such as the last 7 or 30 days
+        for window in self.windows:
+            start = window_start(window)
+            self.add_rows(window_cpu_hours_part_metric, window_gpu_hours_part_metric, window_gpu_tres_hours_part_metric, self.store.totals('partition', start), window)
+            self.add_rows(window_cpu_hours_group_metric, window_gpu_hours_group_metric, window_gpu_tres_hours_group_metric, self.store.totals('group', start), window)
+            self.add_rows(window_cpu_hours_user_metric, window_gpu_hours_user_metric, window_gpu_tres_hours_user_metric, self.store.totals('user', start), window)
 
         # Yield metrics to Prometheus
         yield day_cpu_hours_part_metric
@@ -480,21 +576,51 @@ class SlurmKempnerSacctsCollector:
         yield tot_cpu_hours_user_metric
         yield tot_gpu_hours_user_metric
         yield tot_gpu_tres_hours_user_metric
-
+        yield window_cpu_hours_part_metric
+        yield window_gpu_hours_part_metric
+        yield window_gpu_tres_hours_part_metric
+        yield window_cpu_hours_group_metric
+        yield window_gpu_hours_group_metric
+        yield window_gpu_tres_hours_group_metric
+        yield window_cpu_hours_user_metric
+        yield window_gpu_hours_user_metric
+        yield window_gpu_tres_hours_user_metric
+
+# Text files kept by older versions, only read to migrate to usage_db_file
 file_pairs = [
     ('/slurm/kempner_sacct_collect_tmp_files/partition_dictionary_sum.csv', '/slurm/kempner_sacct_collect_tmp_files/partition_dictionary.csv'),
     ('/slurm/kempner_sacct_collect_tmp_files/group_dictionary_sum.csv', '/slurm/kempner_sacct_collect_tmp_files/group_dictionary.csv'),
     ('/slurm/kempner_sacct_collect_tmp_files/user_dictionary_sum.csv', '/slurm/kempner_sacct_collect_tmp_files/user_dictionary.csv')
 ]
 time_stamp_file = "/slurm/kempner_sacct_collect_tmp_files/sacct_collect_timestamp.data"
+watermark_file = "/slurm/kempner_sacct_collect_tmp_files/sacct_watermark.data"
+
+usage_db_file = "/slurm/kempner_sacct_collect_tmp_files/kempner_usage.db"
+
+def load_collector():
+    """Bring the usage store up to date and return a collector for it, or None if it is still empty."""
+    store = UsageStore(usage_db_file)
+    migrate_text_files(store)
+    collector = SlurmKempnerSacctsCollector(store)
+    try:
+        getdata_current_or_missing_dates(store, collector=collector)
+    except Exception as e:
+        slurm_instrument.error(collector, 'sacct', e)
+    if store.days():
+        return collector
+    # Nothing to serve yet, and the next attempt opens the store again
+    store.close()
+    return None
 
 if __name__ == "__main__":
-    update_status = getdata_current_or_missing_dates(time_stamp_file)
-    if ("non-empty" in update_status):
-        partition_dict, partition_dict_sum, group_dict, group_dict_sum, user_dict, user_dict_sum = read_file_pairs(file_pairs)
-        start_http_server(9007)
-        REGISTRY.register(SlurmKempnerSacctsCollector())
+    slurm_weights.install_reload()
+    # Serve from the start, the usage metrics appear once the first day is in the store
+    start_http_server(9007)
+    collector = load_collector()
+    while collector is None:
+        print(f"No usage ingested yet, trying again in {RETRY_INTERVAL} seconds")
+        time.sleep(RETRY_INTERVAL)
+        collector = load_collector()
+    register(collector, 86400)
     while True:
         time.sleep(86400)
-
-
@@ -5,7 +5,6 @@
 A script to collect  statistics from Slurm.
 """
 
-import subprocess
 import time
 import sys,os
 from os import path
@@ -17,44 +16,43 @@ external = os.path.join(prefix, 'external')
 sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_source
+from slurm_http import start_http_server
+from slurm_snapshot import register
 
 class SlurmKempnerStatsCollector:
-    def __init__(self):
+    def __init__(self, deadline=None):
         self.part_kemp = [ 'kempner',  'kempner_dev', 'kempner_h100', 'kempner_requeue' ]
         self.metric = {}
-
-    def run_command(self, command):
-        """Run a shell command and return its output."""
-        try:
-            proc = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
-            output, _ = proc.communicate()
-            return output.strip().splitlines()
-        except subprocess.SubprocessError as e:
-            print(f"Error executing command {command}: {e}")
-            return []
-
+        # Seconds a scrape waits for showq before exporting what it has
+        self.deadline = deadline or float(os.environ.get('SLURM_EXPORTER_DEADLINE', 25))
 
     def collect(self):
         """Collect metrics and yield them to Prometheus."""
         k_partition = GaugeMetricFamily('k_partition', 'Stats for Kempner Partitions', labels=['field'])
-       
-        for part in self.part_kemp:
-            showq_data = self.get_showq_data(part)
-            self.process_showq_data(showq_data, part)
+
+        # Run showq for every partition at once, a partition whose showq
+        # failed or timed out is left out rather than holding up the rest.
+        self.metric = {}
+        commands = [self.showq_command(part) for part in self.part_kemp]
+        for part, showq_data in zip(self.part_kemp, slurm_instrument.parsed(self, slurm_source.run_all, commands, self.deadline)):
+            if showq_data is not None:
+                slurm_instrument.count(self, len(showq_data))
+                self.process_showq_data(showq_data, part)
         for key, value in self.metric.items():
             k_partition.add_metric([key.lower()], value)
         jobt = 0
         for part in self.part_kemp:
-            jobt  +=  int(self.metric[f"{part}-jt"])
+            jobt  +=  int(self.metric.get(f"{part}-jt", 0))
    
         k_partition.add_metric(["job_total"], jobt)
         yield k_partition
 
-    def get_showq_data(self, partition):
-        """Collect data from showq for a specific partition."""
-        command = ['timeout','-s','9','60s','/usr/local/bin/showq', '-s', '-p', partition]
-        return self.run_command(command)
+    def showq_command(self, partition):
+        """The showq command for a specific partition."""
+        return ['timeout','-s','9','60s','/usr/local/bin/showq', '-s', '-p', partition]
     
     def process_showq_data(self, lines, partition):
         """Process the collected showq data and add metrics."""
@@ -91,7 +89,7 @@ class SlurmKempnerStatsCollector:
 
 if __name__ == "__main__":
     start_http_server(9006)
-    REGISTRY.register(SlurmKempnerStatsCollector())
+    register(SlurmKempnerStatsCollector(), 30)
     while True:
         time.sleep(30)
 
@@ -0,0 +1,316 @@
+"""
+slurm_nodes.py
+Shared node inventory built from scontrol -o show node.
+
+The lsload, klsload and spart collectors all need the full node list.  The
+inventory fetches it through slurm_source (or from slurmrestd if one is
+configured), parses each node once into a typed record and hands the same
+table to every collector until the output is refreshed.
+
+Collectors that sum over the whole cluster can ask for the same nodes as a
+NodeTable instead, which keeps each field in an array so that totals are
+taken with sum() over masked columns rather than node by node in Python.
+"""
+
+import threading
+import time
+from array import array
+from collections import namedtuple
+from functools import cached_property, lru_cache
+from itertools import compress, repeat
+from operator import mul, or_, truediv
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+import slurm_json
+import slurm_rest
+import slurm_source
+from slurm_parse import parse_record, parse_tres
+
+NODE_CMD = ['timeout','-s','9','60s','scontrol','-o','show','node']
+
+#A node's State= is a base state followed by any number of +FLAGS.  Each gets a bit.
+BASE_STATES = ('UNKNOWN', 'DOWN', 'IDLE', 'ALLOCATED', 'ERROR', 'MIXED', 'FUTURE')
+STATE_FLAGS = ('BLOCKED', 'CLOUD', 'COMPLETING', 'DRAIN', 'DYNAMIC_FUTURE', 'DYNAMIC_NORM', 'FAIL',
+  'INVALID_REG', 'MAINTENANCE', 'NOT_RESPONDING', 'PERFCTRS', 'PLANNED', 'POWER', 'POWER_DOWN',
+  'POWER_DRAIN', 'POWERED_DOWN', 'POWERING_DOWN', 'POWERING_UP', 'REBOOT_ISSUED', 'REBOOT_REQUESTED',
+  'RESERVED', 'RESUME')
+STATE = {name: 1 << i for i, name in enumerate(BASE_STATES + STATE_FLAGS)}
+#Set for anything not listed above, so unknown states never pass for known ones
+STATE_OTHER = 1 << len(STATE)
+BASE_MASK = sum(STATE[s] for s in BASE_STATES)
+
+#Flags sinfo marks with a suffix instead, e.g. IDLE# or MIXED*
+STATE_SUFFIXES = {'*': 'NOT_RESPONDING', '~': 'POWERED_DOWN', '#': 'POWERING_UP', '%': 'POWERING_DOWN',
+  '!': 'POWER_DOWN', '$': 'MAINTENANCE', '@': 'REBOOT_REQUESTED', '^': 'REBOOT_ISSUED', '-': 'PLANNED'}
+
+#Flags that come and go without changing what a node is doing
+TRANSIENT = STATE['CLOUD'] | STATE['NOT_RESPONDING'] | STATE['POWERING_UP'] | STATE['POWERING_DOWN']
+
+#What a node counts as in the cluster totals, as bits
+NODE_IDLE, NODE_MIXED, NODE_ALLOC, NODE_PLANNED, NODE_RES, NODE_COMP, NODE_DRAIN, NODE_DOWN, NODE_PWD = (1 << i for i in range(9))
+
+@lru_cache(maxsize=1024)
+def decode_state(state):
+  """Turn a State= string such as MIXED+DRAIN+NOT_RESPONDING into STATE bits.
+
+  A cluster only ever shows a few dozen distinct strings, so each is decoded once.
+  """
+  bits = 0
+  for token in state.upper().split('+'):
+    while token and token[-1] in STATE_SUFFIXES:
+      bits = bits | STATE[STATE_SUFFIXES[token[-1]]]
+      token = token[:-1]
+    if token:
+      bits = bits | STATE.get(token, STATE_OTHER)
+  return bits
+
+@lru_cache(maxsize=1024)
+def node_class(state):
+  """The NODE_ categories a node in this State= is counted in.
+
+  Idle, mixed and allocated nodes must have no flags beyond completing (and
+  the transient ones).  Drained nodes, idle or down, count as down while
+  nodes still draining their jobs count as draining.
+  """
+  bits = decode_state(state)
+  base = bits & BASE_MASK
+  flags = bits & ~BASE_MASK & ~TRANSIENT
+
+  cls = 0
+  if base == STATE['IDLE'] and not flags & ~(STATE['COMPLETING'] | STATE['POWER']):
+    cls = cls | NODE_IDLE
+  if base == STATE['MIXED'] and not flags & ~STATE['COMPLETING']:
+    cls = cls | NODE_MIXED
+  if base == STATE['ALLOCATED'] and not flags & ~STATE['COMPLETING']:
+    cls = cls | NODE_ALLOC
+  if base & (STATE['IDLE'] | STATE['MIXED']) and flags == STATE['PLANNED']:
+    cls = cls | NODE_PLANNED
+  if flags & STATE['RESERVED']:
+    cls = cls | NODE_RES
+  if flags & STATE['COMPLETING']:
+    cls = cls | NODE_COMP
+  if flags & STATE['DRAIN'] and not base & (STATE['IDLE'] | STATE['DOWN']):
+    cls = cls | NODE_DRAIN
+  if base == STATE['DOWN'] or (base == STATE['IDLE'] and flags & STATE['DRAIN']):
+    cls = cls | NODE_DOWN
+  if base == STATE['IDLE'] and flags & STATE['POWERED_DOWN'] and not flags & STATE['DRAIN']:
+    cls = cls | NODE_PWD
+  return cls
+
+Node = namedtuple('Node', ['name', 'state', 'partitions', 'features', 'cputot', 'cpualloc', 'cpuload', 'realmem', 'allocmem', 'freemem', 'cfgtres', 'alloctres', 'gpus', 'gpualloc', 'gpumodel'])
+
+def parse_node(line):
+  """Parse one line of scontrol -o show node into a Node."""
+  return make_node(parse_record(line))
+
+def gpu_model(gres):
+  """The GPU model named in a Gres= string like gpu:nvidia_h100_80gb_hbm3:4(S:0-1), '' if it has none."""
+  for g in gres.split(','):
+    parts = g.split(':')
+    if parts[0] == 'gpu' and len(parts) > 2:
+      return parts[1]
+  return ''
+
+def make_node(node):
+  """Build a Node from a dict keyed like scontrol -o show node."""
+  cfgtres = parse_tres(node.get('CfgTRES', ''))
+  alloctres = parse_tres(node.get('AllocTRES', ''))
+
+  #Slurm reports N/A for load and free memory on nodes that are not responding.
+  cpuload = node.get('CPULoad', 'N/A')
+  freemem = node.get('FreeMem', 'N/A')
+  partitions = node.get('Partitions', '')
+  features = node.get('AvailableFeatures', '')
+
+  return Node(
+    name=node['NodeName'],
+    state=node['State'],
+    partitions=tuple(partitions.split(',')) if partitions else (),
+    features=tuple(features.split(',')) if features else (),
+    cputot=int(node['CPUTot']),
+    cpualloc=int(node['CPUAlloc']),
+    cpuload=float(cpuload) if cpuload != 'N/A' else None,
+    realmem=int(node['RealMemory']),
+    allocmem=int(node['AllocMem']),
+    freemem=int(freemem) if freemem != 'N/A' else None,
+    cfgtres=cfgtres,
+    alloctres=alloctres,
+    gpus=int(cfgtres.get('gres/gpu', 0)),
+    gpualloc=int(alloctres.get('gres/gpu', 0)) if 'gres/gpu' in cfgtres else 0,
+    gpumodel=gpu_model(node.get('Gres', '')),
+  )
+
+class NodeTable:
+  """Columns of a node table, one entry per node in inventory order.
+
+  Numeric fields are arrays and a set of nodes is a mask, bytes with a 1 for
+  every node in it.  Every feature has a mask, and each node's state is kept
+  as an index into the distinct State= strings so a mask of nodes by state
+  is classified once per string and spread over the nodes in one translate.
+  """
+  def __init__(self, nodes):
+    self.nodes = nodes
+    self.cputot = array('q', [n.cputot for n in nodes])
+    self.cpualloc = array('q', [n.cpualloc for n in nodes])
+    #Nodes not responding report no load or free memory and count as zero
+    self.cpuload = array('d', [n.cpuload or 0.0 for n in nodes])
+    self.realmem = array('q', [n.realmem for n in nodes])
+    self.allocmem = array('q', [n.allocmem for n in nodes])
+    self.memalloc = array('q', [min(n.allocmem, n.realmem) for n in nodes])
+    self.memload = array('q', [n.realmem - n.freemem if n.freemem is not None else 0 for n in nodes])
+    self.gpus = array('q', [n.gpus for n in nodes])
+    self.gpualloc = array('q', [n.gpualloc for n in nodes])
+
+    self.statenames = list(dict.fromkeys(n.state for n in nodes))
+    index = {s: i for i, s in enumerate(self.statenames)}
+    if len(index) <= 256:
+      self.stateindex = bytes([index[n.state] for n in nodes])
+    else:
+      self.stateindex = array('L', [index[n.state] for n in nodes])
+
+    self.features = {}
+    for i, n in enumerate(nodes):
+      for f in n.features:
+        if f not in self.features:
+          self.features[f] = bytearray(len(nodes))
+        self.features[f][i] = 1
+
+    #Subsets picked out by select(), by predicate
+    self.selected = {}
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def states(self, classify, bits):
+    """Mask of the nodes whose classify(state) shares a bit with bits."""
+    lookup = bytes([1 if classify(s) & bits else 0 for s in self.statenames])
+    if isinstance(self.stateindex, bytes):
+      return self.stateindex.translate(lookup.ljust(256, b'\0'))
+    return bytes(map(lookup.__getitem__, self.stateindex))
+
+  def feature(self, f):
+    """Mask of the nodes that have feature f."""
+    return self.features.get(f) or bytes(len(self.nodes))
+
+  def total(self, column, mask=None):
+    """Sum of column, over just the nodes in mask if one is given."""
+    if mask is None:
+      return sum(column)
+    return sum(compress(column, mask))
+
+  def count(self, mask):
+    return mask.count(1)
+
+  def typed(self, features):
+    """Mask of the nodes with any of features."""
+    typed = bytes(len(self.nodes))
+    for f in features:
+      if f in self.features:
+        typed = bytes(map(or_, typed, self.features[f]))
+    return typed
+
+  def gpumodels(self, features):
+    """Masks of the GPU nodes with none of features, by the GPU model in their Gres."""
+    typed = self.typed(features)
+    models = {}
+    for i, n in enumerate(self.nodes):
+      if n.gpus and not typed[i]:
+        if n.gpumodel not in models:
+          models[n.gpumodel] = bytearray(len(self.nodes))
+        models[n.gpumodel][i] = 1
+    return models
+
+  def cpumodels(self, features, model):
+    """Masks of the nodes with none of features, by the CPU model model(node features) makes of their features."""
+    typed = self.typed(features)
+    models = {}
+    for i, n in enumerate(self.nodes):
+      if not typed[i]:
+        m = model(n.features)
+        if m not in models:
+          models[m] = bytearray(len(self.nodes))
+        models[m][i] = 1
+    return models
+
+  @cached_property
+  def memshare(self):
+    """Allocated memory of each node as a share of its cpus."""
+    return array('d', map(truediv, map(mul, self.cputot, self.allocmem), self.realmem))
+
+  @cached_property
+  def occupancy(self):
+    """Fraction of each node in use, by whichever of cpus, memory or gpus is most allocated."""
+    return array('d', map(max, map(truediv, self.cpualloc, self.cputot), map(truediv, self.memalloc, self.realmem),
+      map(truediv, self.gpualloc, map(max, self.gpus, repeat(1)))))
+
+  def select(self, predicate):
+    """A NodeTable of just the nodes predicate(node) is true for."""
+    table = self.selected.get(predicate)
+    if table is None:
+      table = self.selected[predicate] = NodeTable(tuple(filter(predicate, self.nodes)))
+    return table
+
+class NodeInventory(Collector):
+  def __init__(self, cmd=NODE_CMD):
+    self.cmd = cmd
+    self.lock = threading.Lock()
+    self.raw = None
+    self.fetched = 0
+    self.table = ()
+    #NodeTable of table, built the first time it is asked for
+    self.columnar = NodeTable(())
+    self.fetches = 0
+    self.saved = 0
+
+  def nodes(self):
+    """Return the current node table, reparsing only when the output changed."""
+    with self.lock:
+      client = slurm_rest.get_client()
+      if client is not None:
+        return self.rest_nodes(client)
+
+      raw = slurm_source.lines(self.cmd)
+      #slurm_source hands back the very same output while it is still fresh.
+      if raw is self.raw:
+        self.saved = self.saved + 1
+        return self.table
+      self.fetches = self.fetches + 1
+      table = tuple(parse_node(line) for line in raw if line.strip())
+      if isinstance(raw, tuple):
+        self.raw = raw
+      self.table = table
+      return table
+
+  def columns(self):
+    """Return the current node table as a NodeTable, reusing it until the nodes change."""
+    nodes = self.nodes()
+    with self.lock:
+      if self.columnar.nodes is not nodes:
+        self.columnar = NodeTable(nodes)
+      return self.columnar
+
+  def rest_nodes(self, client):
+    """Node table from slurmrestd, reused for as long as command output would be."""
+    if self.fetched and time.time() - self.fetched < slurm_source.source.ttl:
+      self.saved = self.saved + 1
+      return self.table
+    self.fetches = self.fetches + 1
+    self.table = tuple(make_node(slurm_json.scontrol_node(n)) for n in client.nodes())
+    self.fetched = time.time()
+    return self.table
+
+  def collect(self):
+    fetches = CounterMetricFamily('slurm_exporter_node_inventory_fetches', 'Number of times the node inventory was fetched from slurmctld')
+    saved = CounterMetricFamily('slurm_exporter_node_inventory_saved_calls', 'Number of node inventory requests served without calling slurmctld')
+    nodes = GaugeMetricFamily('slurm_exporter_node_inventory_nodes', 'Number of nodes in the node inventory')
+    fetches.add_metric([], self.fetches)
+    saved.add_metric([], self.saved)
+    nodes.add_metric([], len(self.table))
+    yield fetches
+    yield saved
+    yield nodes
+
+#Process wide inventory shared by all the collectors.
+inventory = NodeInventory()
@@ -0,0 +1,157 @@
+"""
+slurm_parse.py
+Fast parsers for the one line per record output of scontrol -o.
+
+scontrol prints records as Key=Value pairs separated by spaces, but values
+such as Reason=, Comment=, Command= and OS= can themselves contain spaces.
+Rather than tokenizing with shlex we split only on spaces that are followed
+by something that looks like a key, which keeps those values whole and is
+done by the re module in C.  Free text values can also hold something that
+looks like a key (a Comment= of "lr=0.1 epochs=3" or a Command= with
+arguments), so those run up to the next key scontrol actually prints.
+"""
+
+import re
+from datetime import datetime
+
+#A space (or several) followed by a key such as CPUAlloc=, AllocNode:Sid= or CPUs/Task=
+FIELD_SPLIT = re.compile(r' +(?=[A-Za-z][\w:/]*=)')
+#The same, keeping the spaces for putting free text values back together
+SPACED_SPLIT = re.compile(r'( +)(?=[A-Za-z][\w:/]*=)')
+
+#Keys whose values are free text set by users or admins
+FREE_TEXT = frozenset(['Comment', 'AdminComment', 'SystemComment', 'Command', 'WorkDir', 'StdErr', 'StdIn', 'StdOut',
+  'Reason', 'OS', 'Extra'])
+
+#Keys scontrol -o prints for jobs, nodes and partitions, the only ones that end a free text value
+KEYS = frozenset('''
+  JobId JobName UserId GroupId MCS_label Priority Nice Account QOS JobState Reason Dependency Requeue Restarts
+  BatchFlag Reboot ExitCode DerivedExitCode RunTime TimeLimit TimeMin SubmitTime EligibleTime AccrueTime StartTime
+  EndTime Deadline SuspendTime SecsPreSuspend LastSchedEval ResizeTime Scheduler Partition AllocNode:Sid
+  ReqNodeList ExcNodeList NodeList SchedNodeList BatchHost NumNodes NumCPUs NumTasks CPUs/Task ReqB:S:C:T ReqTRES
+  AllocTRES Socks/Node NtasksPerN:B:S:C CoreSpec ThreadSpec MinCPUsNode MinMemoryNode MinMemoryCPU MinTmpDiskNode
+  Features ClusterFeatures Prefer DelayBoot OverSubscribe Contiguous Licenses LicensesAlloc Network Reservation
+  Command WorkDir Comment AdminComment SystemComment StdErr StdIn StdOut Power TresPerNode TresPerJob TresPerTask
+  TresPerSocket TresBind TresFreq CpusPerTres MemPerTres NtasksPerTRES MailUser MailType CronJob CrontabSpec
+  ArrayJobId ArrayTaskId ArrayTaskThrottle HetJobId HetJobOffset HetJobIdSet BurstBuffer BurstBufferState
+  Clusters SiblingsActive SiblingsViable ResvPorts Selinux Container ContainerID SegmentSize
+  Nodes CPU_IDs Mem GRES JOB_GRES
+  NodeName Arch CoresPerSocket CPUAlloc CPUEfctv CPUTot CPULoad AvailableFeatures ActiveFeatures Gres GresDrain
+  GresUsed NodeAddr NodeHostName Port Version OS RealMemory AllocMem FreeMem Sockets Boards MemSpecLimit State
+  ThreadsPerCore TmpDisk Weight Owner Partitions BootTime SlurmdStartTime LastBusyTime ResumeAfterTime CfgTRES
+  CapWatts CurrentWatts AveWatts ExtSensorsJoules ExtSensorsWatts ExtSensorsTemp Extra InstanceId InstanceType
+  Topology CoreSpecCount CPUSpecList
+  PartitionName AllowGroups AllowAccounts AllowQos AllocNodes Default QoS DefaultTime DisableRootJobs ExclusiveUser
+  ExclusiveTopo GraceTime Hidden MaxNodes MaxTime MinNodes LLN MaxCPUsPerNode MaxCPUsPerSocket PriorityJobFactor
+  PriorityTier RootOnly ReqResv OverTimeLimit PreemptMode TotalCPUs TotalNodes SelectTypeParameters JobDefaults
+  DefMemPerNode MaxMemPerNode DefMemPerCPU MaxMemPerCPU TRES TRESBillingWeights DenyAccounts DenyQos
+  PowerDownOnIdle ResumeTimeout SuspendTimeout Alternate
+'''.split())
+
+#Keys that make up the per node detail blocks of scontrol -od show job
+DETAIL_KEYS = frozenset(['Nodes', 'CPU_IDs', 'Mem', 'GRES'])
+
+def fields(line):
+  """Return the (key, value) pairs of an scontrol record in order."""
+  line = line.strip()
+  pairs = []
+  free = False
+  for token in FIELD_SPLIT.split(line):
+    key, sep, value = token.partition('=')
+    #Only a free text value holding something like a field needs putting back together
+    if free and key not in KEYS:
+      return free_text_fields(line)
+    free = key in FREE_TEXT
+    if sep:
+      pairs.append((key, value))
+  return pairs
+
+def free_text_fields(line):
+  """fields() for a record with a free text value that holds something like a field."""
+  #The fields alternate with the spaces between them
+  tokens = SPACED_SPLIT.split(line)
+  pairs = []
+  key, sep, value = tokens[0].partition('=')
+  for space, token in zip(tokens[1::2], tokens[2::2]):
+    if key in FREE_TEXT and token.partition('=')[0] not in KEYS:
+      value = value + space + token
+      continue
+    if sep:
+      pairs.append((key, value))
+    key, sep, value = token.partition('=')
+  if sep:
+    pairs.append((key, value))
+  return pairs
+
+def parse_record(line):
+  """Turn one line of scontrol -o output into a dict."""
+  return dict(fields(line))
+
+def parse_tres(tres):
+  """Turn a TRES string such as cpu=4,mem=16G,gres/gpu=1 into a dict."""
+  return dict(s.split("=", 1) for s in tres.split(",") if '=' in s)
+
+def parse_job(line):
+  """Parse a line of scontrol -od show job.
+
+  Returns the job as a dict along with a list of its per node detail blocks
+  (Nodes= CPU_IDs= Mem= GRES=), one dict per block.
+  """
+  job = {}
+  details = []
+  detail = None
+  for key, value in fields(line):
+    if key == 'Nodes':
+      detail = {key: value}
+      details.append(detail)
+    elif detail is not None and key in DETAIL_KEYS:
+      detail[key] = value
+    else:
+      job[key] = value
+  return job, details
+
+def cpu_count(cpu_ids):
+  """Count the CPUs in a CPU_IDs list such as 0-3,8,10-11."""
+  cpucnt = 0
+  for c in cpu_ids.split(','):
+    if "-" in c:
+      cs = c.split('-')
+
+      if not cs[1]:
+        cs[1] = 0
+
+      cpucnt = max(int(cs[1]) - int(cs[0]),1) + 1 + cpucnt
+    else:
+      cpucnt = cpucnt + 1
+  return cpucnt
+
+def gpu_count(gres):
+  """Count the GPUs in a GRES detail such as gpu:nvidia_h100_80gb_hbm3:3(IDX:0-2)."""
+  if "gpu" in gres:
+    ggres = gres.split(':')
+    return int(ggres[2].strip('(IDX'))
+  return 0
+
+def job_allocations(details):
+  """Turn the detail blocks of a job into (nodelist, cpus, mem in MB, gpus) tuples."""
+  return [(d["Nodes"], cpu_count(d["CPU_IDs"]), float(d["Mem"]), gpu_count(d["GRES"])) for d in details if "CPU_IDs" in d]
+
+def parse_duration(duration):
+  """Seconds in a slurm duration such as 1-02:03:04, 02:03:04 or 03:04, None if it is not one."""
+  days, sep, clock = duration.partition('-')
+  if not sep:
+    days, clock = 0, days
+  try:
+    seconds = 0
+    for part in clock.split(':'):
+      seconds = seconds * 60 + int(part)
+    return int(days) * 86400 + seconds
+  except ValueError:
+    return None
+
+def parse_timestamp(timestamp):
+  """Unix time of a slurm timestamp such as 2024-01-01T10:00:00 (local time), None for Unknown or None."""
+  try:
+    return datetime.fromisoformat(timestamp).timestamp()
+  except (TypeError, ValueError):
+    return None
@@ -5,7 +5,7 @@ slurm_partition_status_collector.py
 A script that gets slurm partition statistics.
 """
 
-import sys,os,subprocess,shlex
+import sys,os
 import time
 
 prefix = os.path.normpath(
@@ -18,135 +18,169 @@ os.environ["SLURM_BITSTR_LEN"] = "0"
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client.registry import Collector
-from prometheus_client import start_http_server
 
-class SlurmPartStatusCollector(Collector):
+import slurm_hostlist
+import slurm_instrument
+import slurm_json
+import slurm_nodes
+import slurm_rest
+import slurm_source
+import slurm_weights
+from slurm_http import start_http_server
+from slurm_parse import job_allocations, parse_job, parse_record, parse_tres
+from slurm_snapshot import register
+
+class Usage:
+  """Running jobs and the cpu, memory and gpus they hold for one user or account."""
+  __slots__ = ('run', 'cpu', 'mem', 'gpu')
+
   def __init__(self):
-    pass
+    self.run = 0
+    self.cpu = 0
+    self.mem = 0.0
+    self.gpu = 0
+
+  def add(self, cpu, mem, gpu):
+    self.run = self.run + 1
+    self.cpu = self.cpu + cpu
+    self.mem = self.mem + mem
+    self.gpu = self.gpu + gpu
+
+class PartitionStats:
+  """Running totals for one partition.
+
+  Jobs are folded in one at a time as scontrol streams them, so a collect
+  holds one of these per partition plus one count or Usage per pending or
+  running user and account, however many jobs there are.
+  """
+  __slots__ = ('tier', 'cpu', 'mem', 'gpu', 'node', 'wcpu', 'wmem', 'wgpu',
+    'resnode', 'rescpu', 'resmem', 'resgpu', 'downnode', 'downcpu', 'downmem', 'downgpu',
+    'pwdnode', 'pwdcpu', 'pwdmem', 'pwdgpu', 'pendcnt', 'runcpu', 'runmem', 'rungpu', 'runcnt',
+    'restarts', 'occ', 'hcpu', 'hmem', 'hgpu', 'lcpu', 'lmem', 'lgpu',
+    'penduser', 'pendacct', 'runuser', 'runacct')
+
+  def __init__(self, partition):
+    #Get what Partition PriorityTier this partition is.
+    self.tier = int(partition["PriorityTier"])
+
+    #Get the total size of a partition
+    tres = parse_tres(partition['TRES'])
+    self.cpu = int(tres['cpu'])
+
+    if 'G' in tres['mem']:
+      self.mem = float(tres['mem'].strip('G'))
+    else:
+      self.mem = float(tres['mem'].strip('M'))/1024
+
+    self.node = int(tres['node'])
+    if 'gres/gpu' in tres:
+      self.gpu = int(tres['gres/gpu'])
+    else:
+      self.gpu = 0
+
+    #Get the TRESBillingWeights for a partition
+    tresweight = parse_tres(partition['TRESBillingWeights'])
+    self.wcpu = float(tresweight['CPU'])
+    self.wmem = float(tresweight['Mem'].strip('G'))
+    if 'Gres/gpu' in tresweight:
+      self.wgpu = float(tresweight['Gres/gpu'])
+    else:
+      self.wgpu = 0.0
+
+    #Counters
+    self.resnode = self.rescpu = self.resgpu = 0
+    self.downnode = self.downcpu = self.downgpu = 0
+    self.pwdnode = self.pwdcpu = self.pwdgpu = 0
+    self.resmem = self.downmem = self.pwdmem = 0.0
+    self.pendcnt = 0
+    self.runcpu = self.rungpu = self.runcnt = 0
+    self.runmem = 0.0
+    self.restarts = 0
+    self.occ = 0.0
+    self.hcpu = self.hgpu = self.lcpu = self.lgpu = 0
+    self.hmem = self.lmem = 0.0
+
+    #Pending jobs by user and account, Usage of running jobs by user and account
+    self.penduser = {}
+    self.pendacct = {}
+    self.runuser = {}
+    self.runacct = {}
+
+  def add_pending(self, user, acct, jobcnt):
+    self.pendcnt = self.pendcnt+jobcnt
+    self.penduser[user] = self.penduser.get(user, 0)+jobcnt
+    self.pendacct[acct] = self.pendacct.get(acct, 0)+jobcnt
+
+  def add_running(self, user, acct, cpu, mem, gpu):
+    self.runcpu = self.runcpu + cpu
+    self.runmem = self.runmem + mem
+    self.rungpu = self.rungpu + gpu
+    self.runcnt = self.runcnt + 1
+
+    usage = self.runuser.get(user)
+    if usage is None:
+      usage = self.runuser[user] = Usage()
+    usage.add(cpu, mem, gpu)
+
+    usage = self.runacct.get(acct)
+    if usage is None:
+      usage = self.runacct[acct] = Usage()
+    usage.add(cpu, mem, gpu)
+
+class SlurmPartStatusCollector(Collector):
+  def __init__(self, backend=None):
+    #Either parse the text output of scontrol (text) or its --json output (json)
+    self.backend = backend or os.environ.get('SLURM_EXPORTER_BACKEND', 'text')
+
+  def get_partitions(self):
+    """Return an iterator of partition records keyed like scontrol -o show partition."""
+    client = slurm_rest.get_client()
+    if client is not None:
+      return map(slurm_json.scontrol_partition, client.partitions())
+
+    output = slurm_source.lines([
+    'timeout','-s','9','60s',
+    'scontrol',
+    '-o', 'show', 'partition'
+    ])
+    return map(parse_record, output)
+
+  def get_jobs(self):
+    """Return an iterator of (job, allocations) for every job.
+
+    Each allocation is a (nodelist, cpus, mem in MB, gpus) tuple taken from the
+    per node detail of the job.  Jobs are parsed one at a time as scontrol
+    writes them out.
+    """
+    client = slurm_rest.get_client()
+    if client is not None:
+      return map(slurm_json.scontrol_job, client.jobs())
+
+    if self.backend == 'json':
+      return slurm_json.scontrol_jobs(slurm_source.stream([
+      'timeout','-s','9','60s',
+      'scontrol',
+      '-d', 'show', 'job', '--json'
+      ]))
+
+    output = slurm_source.stream([
+    'timeout','-s','9','60s',
+    'scontrol',
+    '-od', 'show', 'job'
+    ])
+    return ((job, job_allocations(details)) for job, details in map(parse_job, output))
+
   def collect(self):
     # Get partition information
-    pprioritytier={}
-    pcpu={}
-    pmem={}
-    pgpu={}
-    pnode={}
-    ptresweightcpu={}
-    ptresweightmem={}
-    ptresweightgpu={}
-    presnode={}
-    prescpu={}
-    presmem={}
-    presgpu={}
-    pdownnode={}
-    pdowncpu={}
-    pdownmem={}
-    pdowngpu={}
-    ppwdnode={}
-    ppwdcpu={}
-    ppwdmem={}
-    ppwdgpu={}
-    pruncpu={}
-    prunmem={}
-    prungpu={}
-    pruncnt={}
-    prunusercnt={}
-    prunacctcnt={}
-    ppenduser={}
-    ppendacct={}
-    ppendcnt={}
-    ppendusercnt={}
-    ppendacctcnt={}
-    prunuser={}
-    prunacct={}
-    pcpuuser={}
-    pmemuser={}
-    pgpuuser={}
-    pcpuacct={}
-    pmemacct={}
-    pgpuacct={}
-    prestarts={}
-    pocc={}
-    phcpu={}
-    phmem={}
-    phgpu={}
-    plcpu={}
-    plmem={}
-    plgpu={}
+    stats={}
 
     try:
-      proc = subprocess.Popen([
-      'timeout','-s','9','60s',
-      'scontrol',
-      '-o', 'show', 'partition'
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      print("Exception")
+      partitions = slurm_instrument.records(self, self.get_partitions)
+    except Exception as e:
+      slurm_instrument.error(self, 'partitions', e)
     else:
-      for line in proc.stdout:
-        #Sanitize input
-        line = line.replace("'", "\\'")
-
-        #Turn partition information into a hash
-        partition = dict(s.split("=", 1) for s in shlex.split(line) if '=' in s)
-
-        #Get what Partition PriorityTier this partition is.
-        pprioritytier[partition["PartitionName"]] = int(partition["PriorityTier"])
-
-        #Get the total size of a partition
-        tres = dict(s.split("=", 1) for s in shlex.split(partition['TRES'].replace(",", " ")) if '=' in s)
-        pcpu[partition["PartitionName"]] = int(tres['cpu'])
-
-        if 'G' in tres['mem']:
-          pmem[partition["PartitionName"]] = float(tres['mem'].strip('G'))
-        else:
-          pmem[partition["PartitionName"]] = float(tres['mem'].strip('M'))/1024
-
-        pnode[partition["PartitionName"]] = int(tres['node'])
-        if 'gres/gpu' in tres:
-          pgpu[partition["PartitionName"]] = int(tres['gres/gpu'])
-        else:
-          pgpu[partition["PartitionName"]] = 0
-
-        #Get the TRESBillingWeights for a partition
-        tresweight = dict(s.split("=", 1) for s in shlex.split(partition['TRESBillingWeights'].replace(",", " ")) if '=' in s)
-        ptresweightcpu[partition["PartitionName"]] = float(tresweight['CPU'])
-        ptresweightmem[partition["PartitionName"]] = float(tresweight['Mem'].strip('G'))
-        if 'Gres/gpu' in tresweight:
-          ptresweightgpu[partition["PartitionName"]] = float(tresweight['Gres/gpu'])
-        else:
-          ptresweightgpu[partition["PartitionName"]] = 0.0
-
-        #Counters
-        presnode[partition["PartitionName"]] = 0
-        prescpu[partition["PartitionName"]] = 0
-        presmem[partition["PartitionName"]] = 0.0
-        presgpu[partition["PartitionName"]] = 0
-        pdownnode[partition["PartitionName"]] = 0
-        pdowncpu[partition["PartitionName"]] = 0
-        pdownmem[partition["PartitionName"]] = 0.0
-        pdowngpu[partition["PartitionName"]] = 0
-        ppwdnode[partition["PartitionName"]] = 0
-        ppwdcpu[partition["PartitionName"]] = 0
-        ppwdmem[partition["PartitionName"]] = 0.0
-        ppwdgpu[partition["PartitionName"]] = 0
-        ppendcnt[partition["PartitionName"]] = 0
-        ppendusercnt[partition["PartitionName"]] = 0
-        ppendacctcnt[partition["PartitionName"]] = 0
-        pruncpu[partition["PartitionName"]] = 0
-        prunmem[partition["PartitionName"]] = 0.0
-        prungpu[partition["PartitionName"]] = 0
-        pruncnt[partition["PartitionName"]] = 0
-        prunusercnt[partition["PartitionName"]] = 0
-        prunacctcnt[partition["PartitionName"]] = 0
-        prestarts[partition["PartitionName"]] = 0
-        pocc[partition["PartitionName"]] = 0.0
-        phcpu[partition["PartitionName"]] = 0
-        phmem[partition["PartitionName"]] = 0.0
-        phgpu[partition["PartitionName"]] = 0
-        plcpu[partition["PartitionName"]] = 0
-        plmem[partition["PartitionName"]] = 0.0
-        plgpu[partition["PartitionName"]] = 0
+      for partition in partitions:
+        stats[partition["PartitionName"]] = PartitionStats(partition)
 
     #Get node information
     ncpu={}
@@ -158,98 +192,62 @@ class SlurmPartStatusCollector(Collector):
     npgpu={}
 
     try:
-      proc = subprocess.Popen([
-      'timeout','-s','9','60s',
-      'scontrol',
-      '-o', 'show', 'node'
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      print("Exception")
+      nodes = slurm_instrument.records(self, slurm_nodes.inventory.nodes)
+    except Exception as e:
+      slurm_instrument.error(self, 'nodes', e)
     else:
-      for line in proc.stdout:
-        #Sanitize input
-        line = line.replace("'", "\\'")
-
-        #Turn partition information into a hash
-        node = dict(s.split("=", 1) for s in shlex.split(line) if '=' in s)
-
+      for node in nodes:
         #Get the configured TRES for a node
-        cfgtres = dict(s.split("=", 1) for s in shlex.split(node['CfgTRES'].replace(",", " ")) if '=' in s)
-        ncpu[node["NodeName"]] = int(cfgtres["cpu"])
-        nmem[node["NodeName"]] = float(cfgtres["mem"].strip("M"))/1024
-        if 'gres/gpu' in cfgtres:
-          ngpu[node["NodeName"]] = int(cfgtres['gres/gpu'])
-        else:
-          ngpu[node["NodeName"]] = 0
+        cfgtres = node.cfgtres
+        ncpu[node.name] = int(cfgtres["cpu"])
+        nmem[node.name] = float(cfgtres["mem"].strip("M"))/1024
+        ngpu[node.name] = node.gpus
 
         #Get the partitions that hit a node
-        npartition[node["NodeName"]] = node["Partitions"].split(',')
+        npartition[node.name] = node.partitions
 
         #Flag nodes by state
-        state = node["State"].split('+')
-
-        stateres = 0
-        statedown = 0
-        statepwd = 0
-
-        for s in state:
-          if s == "RESERVED":
-            stateres = 1
-          if s == "DOWN" or s == "DRAIN":
-            statedown = 1
-          if s == "POWERED_DOWN":
-            statepwd = 1
-
-        if stateres == 1:
-          for part in npartition[node["NodeName"]]:
-            presnode[part] = presnode[part]+1
-            prescpu[part] = prescpu[part]+ncpu[node["NodeName"]]
-            presmem[part] = presmem[part]+nmem[node["NodeName"]]
-            presgpu[part] = presgpu[part]+ngpu[node["NodeName"]]
-        if statedown == 1:
-          for part in npartition[node["NodeName"]]:
-            pdownnode[part] = pdownnode[part]+1
-            pdowncpu[part] = pdowncpu[part]+ncpu[node["NodeName"]]
-            pdownmem[part] = pdownmem[part]+nmem[node["NodeName"]]
-            pdowngpu[part] = pdowngpu[part]+ngpu[node["NodeName"]]
-        if statepwd == 1:
-          for part in npartition[node["NodeName"]]:
-            ppwdnode[part] = ppwdnode[part]+1
-            ppwdcpu[part] = ppwdcpu[part]+ncpu[node["NodeName"]]
-            ppwdmem[part] = ppwdmem[part]+nmem[node["NodeName"]]
-            ppwdgpu[part] = ppwdgpu[part]+ngpu[node["NodeName"]]
+        state = slurm_nodes.decode_state(node.state)
+
+        stateres = state & slurm_nodes.STATE['RESERVED']
+        statedown = state & (slurm_nodes.STATE['DOWN'] | slurm_nodes.STATE['DRAIN'])
+        statepwd = state & slurm_nodes.STATE['POWERED_DOWN']
+
+        if stateres:
+          for part in npartition[node.name]:
+            ps = stats[part]
+            ps.resnode = ps.resnode+1
+            ps.rescpu = ps.rescpu+ncpu[node.name]
+            ps.resmem = ps.resmem+nmem[node.name]
+            ps.resgpu = ps.resgpu+ngpu[node.name]
+        if statedown:
+          for part in npartition[node.name]:
+            ps = stats[part]
+            ps.downnode = ps.downnode+1
+            ps.downcpu = ps.downcpu+ncpu[node.name]
+            ps.downmem = ps.downmem+nmem[node.name]
+            ps.downgpu = ps.downgpu+ngpu[node.name]
+        if statepwd:
+          for part in npartition[node.name]:
+            ps = stats[part]
+            ps.pwdnode = ps.pwdnode+1
+            ps.pwdcpu = ps.pwdcpu+ncpu[node.name]
+            ps.pwdmem = ps.pwdmem+nmem[node.name]
+            ps.pwdgpu = ps.pwdgpu+ngpu[node.name]
 
 
         #Initializing Counters
-        for part in npartition[node["NodeName"]]:
-          try:
-            npcpu[node["NodeName"]][part] = 0
-            npmem[node["NodeName"]][part] = 0
-            npgpu[node["NodeName"]][part] = 0
-          except:
-            npcpu[node["NodeName"]]={part: 0}
-            npmem[node["NodeName"]]={part: 0.0}
-            npgpu[node["NodeName"]]={part: 0}
+        npcpu[node.name] = dict.fromkeys(npartition[node.name], 0)
+        npmem[node.name] = dict.fromkeys(npartition[node.name], 0.0)
+        npgpu[node.name] = dict.fromkeys(npartition[node.name], 0)
 
     #Get job information
     try:
-      proc = subprocess.Popen([
-      'timeout','-s','9','60s',
-      'scontrol',
-      '-od', 'show', 'job'
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      print("Exception")
+      jobs = slurm_instrument.records(self, self.get_jobs)
+    except Exception as e:
+      slurm_instrument.error(self, 'jobs', e)
     else:
-      for line in proc.stdout:
-        #Sanitize input
-        line = line.replace("'", "\\'")
-        line = line.replace('"', '\\"')
-
-        #Turn partition information into a hash
-        job = dict(s.split("=", 1) for s in shlex.split(line) if '=' in s)
+      for job, allocations in jobs:
 
         #Get user and account info
         #If the data is empty then there are no jobs to count.
@@ -266,7 +264,8 @@ class SlurmPartStatusCollector(Collector):
         #Count how many job restarts per partition
         if "CronJob" not in job:
           for part in jobpart:
-            prestarts[part] = prestarts[part] + int(job["Restarts"])
+            ps = stats[part]
+            ps.restarts = ps.restarts + int(job["Restarts"])
 
         #Count how many pending jobs per partition, user, and account
         if "PENDING" in job["JobState"]:
@@ -295,33 +294,14 @@ class SlurmPartStatusCollector(Collector):
             jobcnt = 1
 
           for part in jobpart:
-            ppendcnt[part] = ppendcnt[part]+jobcnt
-            try:
-              try:
-                ppenduser[part][user] = ppenduser[part][user]+jobcnt
-              except:
-                ppenduser[part][user] = jobcnt
-                ppendusercnt[part]=ppendusercnt[part]+1
-            except:
-              ppenduser[part]={user: jobcnt}
-              ppendusercnt[part]=ppendusercnt[part]+1
-
-            try:
-              try:
-                ppendacct[part][acct] = ppendacct[part][acct]+jobcnt
-              except:
-                ppendacct[part][acct] = jobcnt
-                ppendacctcnt[part]=ppendacctcnt[part]+1
-            except:
-              ppendacct[part]={acct: jobcnt}
-              ppendacctcnt[part]=ppendacctcnt[part]+1
+            stats[part].add_pending(user, acct, jobcnt)
 
         #Grab stats on Running jobs
         if "RUNNING" in job["JobState"]:
           #Strictly speaking there should only be one partition per job but to make this easy we will just have a meaningless for loop
           for part in jobpart:
             #Get overall stats for job
-            alloctres = dict(s.split("=", 1) for s in shlex.split(job['AllocTRES'].replace(",", " ")) if '=' in s)
+            alloctres = parse_tres(job['AllocTRES'])
             cpu = int(alloctres["cpu"])
             if "G" in alloctres["mem"]:
               mem = float(alloctres["mem"].strip("G"))
@@ -333,108 +313,23 @@ class SlurmPartStatusCollector(Collector):
             else:
               gpu = 0
 
-            #logging cpu, memory, and gpu per partition
-            pruncpu[part] = pruncpu[part] + cpu
-            prunmem[part] = prunmem[part] + mem
-            prungpu[part] = prungpu[part] + gpu
-            pruncnt[part] = pruncnt[part] + 1
-
-            #Counting running jobs per user and account as well as logging cpu, memory, and gpu usage.
-            try:
-              try:
-                prunuser[part][user] = prunuser[part][user]+1
-                pcpuuser[part][user] = pcpuuser[part][user]+cpu
-                pmemuser[part][user] = pmemuser[part][user]+mem
-                pgpuuser[part][user] = pgpuuser[part][user]+gpu
-              except:
-                prunuser[part][user] = 1
-                pcpuuser[part][user] = cpu
-                pmemuser[part][user] = mem
-                pgpuuser[part][user] = gpu
-                prunusercnt[part]=prunusercnt[part]+1
-            except:
-              prunuser[part]={user: 1}
-              pcpuuser[part]={user: cpu}
-              pmemuser[part]={user: mem}
-              pgpuuser[part]={user: gpu}
-              prunusercnt[part]=prunusercnt[part]+1
-
-            try:
-              try:
-                prunacct[part][acct] = prunacct[part][acct]+1
-                pcpuacct[part][acct] = pcpuacct[part][acct]+cpu
-                pmemacct[part][acct] = pmemacct[part][acct]+mem
-                pgpuacct[part][acct] = pgpuacct[part][acct]+gpu
-              except:
-                prunacct[part][acct] = 1
-                pcpuacct[part][acct] = cpu
-                pmemacct[part][acct] = mem
-                pgpuacct[part][acct] = gpu
-                prunacctcnt[part]=prunacctcnt[part]+1
-            except:
-              prunacct[part]={acct: 1}
-              pcpuacct[part]={acct: cpu}
-              pmemacct[part]={acct: mem}
-              pgpuacct[part]={acct: gpu}
-              prunacctcnt[part]=prunacctcnt[part]+1
-
-            #Grabbing node specific information
-            #First we need to reparse the scontrol data
-            jobsplit = line.split(' Nodes=')
-            for i in jobsplit:
-              if "NumNodes=" not in i:
-                if "CPU_IDs=" in i:
-                  j="Nodes=" + i
-                  nodestat = dict(s.split("=", 1) for s in shlex.split(j) if '=' in s)
-
-                  #Getting CPU count
-                  cpuid = nodestat["CPU_IDs"].split(',')
-
-                  cpucnt = 0
-                  for c in cpuid:
-                    if "-" in c:
-                      cs = c.split('-')
-
-                      if not cs[1]:
-                        cs[1] = 0
-
-                      cpucnt = max(int(cs[1]) - int(cs[0]),1) + 1 + cpucnt
-                    else:
-                      cpucnt = cpucnt + 1
-
-                  #Getting GPU count
-                  if "gpu" in nodestat["GRES"]:
-                    ggres = nodestat["GRES"].split(':')
-                    gpucnt = int(ggres[2].strip('(IDX'))
-                  else:
-                    gpucnt = 0
-
-                  #Recording data
-                  #Testing if single nodename or nodelist
-                  try:
-                    npcpu[nodestat["Nodes"]][part] = npcpu[nodestat["Nodes"]][part] + cpucnt
-                    npmem[nodestat["Nodes"]][part] = npmem[nodestat["Nodes"]][part] + float(nodestat["Mem"])/1024
-                    npgpu[nodestat["Nodes"]][part] = npgpu[nodestat["Nodes"]][part] + gpucnt
-                  except:
-                    #Splitting nodelist into node names
-                    proc2 = subprocess.Popen([
-                    'timeout','-s','9','60s',
-                    'scontrol',
-                    'show', 'hostnames', nodestat["Nodes"]
-                    ], stdout=subprocess.PIPE,
-                    universal_newlines=True)
-
-                    for n in proc2.stdout:
-                      n=n.strip("\n")
-                      #This is to cover cases where nodes were moved to a different partition but the jobs from the old partition still exist
-                      #In this case we will just drop the data and move on as this is a temporary state.
-                      try:
-                        npcpu[n][part] = npcpu[n][part] + cpucnt
-                        npmem[n][part] = npmem[n][part] + float(nodestat["Mem"])/1024
-                        npgpu[n][part] = npgpu[n][part] + gpucnt
-                      except:
-                        #Do not do anything
-                        continue
+            #logging cpu, memory, and gpu per partition, user and account
+            stats[part].add_running(user, acct, cpu, mem, gpu)
+
+            #Grabbing node specific information from the detail blocks
+            for nodelist, cpucnt, mem, gpucnt in allocations:
+              #Recording data
+              #Splitting nodelist into node names, a single nodename just expands to itself
+              for n in slurm_hostlist.expand(nodelist):
+                #This is to cover cases where nodes were moved to a different partition but the jobs from the old partition still exist
+                #In this case we will just drop the data and move on as this is a temporary state.
+                try:
+                  npcpu[n][part] = npcpu[n][part] + cpucnt
+                  npmem[n][part] = npmem[n][part] + mem/1024
+                  npgpu[n][part] = npgpu[n][part] + gpucnt
+                except:
+                  #Do not do anything
+                  continue
 
     #Doing node based sums
     for n in ncpu:
@@ -444,78 +339,79 @@ class SlurmPartStatusCollector(Collector):
       ingpu = 1/max(float(ngpu[n]),1)
 
       for p in npartition[n]:
+        ps = stats[p]
         #Calculation occupation
-        pocc[p] = pocc[p] + max(float(npcpu[n][p])*incpu,npmem[n][p]*inmem,float(npgpu[n][p])*ingpu)
+        ps.occ = ps.occ + max(float(npcpu[n][p])*incpu,npmem[n][p]*inmem,float(npgpu[n][p])*ingpu)
 
         #Calculating usage in partitions that are higher and lower priority than the current partition
         #Grabbing current priority
-        cprio = pprioritytier[p]
+        cprio = ps.tier
 
         #Look at the other partitions and sum based on relative priority
         for sp in npartition[n]:
           if sp != p:
-            if pprioritytier[sp] < cprio:
-              plcpu[p] = plcpu[p] + npcpu[n][sp]
-              plmem[p] = plmem[p] + npmem[n][sp]
-              plgpu[p] = plgpu[p] + npgpu[n][sp]
+            if stats[sp].tier < cprio:
+              ps.lcpu = ps.lcpu + npcpu[n][sp]
+              ps.lmem = ps.lmem + npmem[n][sp]
+              ps.lgpu = ps.lgpu + npgpu[n][sp]
             else:
-              phcpu[p] = phcpu[p] + npcpu[n][sp]
-              phmem[p] = phmem[p] + npmem[n][sp]
-              phgpu[p] = phgpu[p] + npgpu[n][sp]
+              ps.hcpu = ps.hcpu + npcpu[n][sp]
+              ps.hmem = ps.hmem + npmem[n][sp]
+              ps.hgpu = ps.hgpu + npgpu[n][sp]
 
     #Export data
     spart = GaugeMetricFamily('spart', 'Partition stats', labels=['partition','user','account','field'])
 
     #Current translation from TRES to Double Precision GFLOps
-    t2g=93.25
+    t2g=slurm_weights.weights.t2g
 
-    for p in pcpu:
+    for p, ps in stats.items():
       #General partition stats
-      spart.add_metric([p,'','','cpu'],pcpu[p])
-      spart.add_metric([p,'','','mem'],pmem[p])
-      spart.add_metric([p,'','','gpu'],pgpu[p])
-      spart.add_metric([p,'','','node'],pnode[p])
-      spart.add_metric([p,'','','rescpu'],prescpu[p])
-      spart.add_metric([p,'','','resmem'],presmem[p])
-      spart.add_metric([p,'','','resgpu'],presgpu[p])
-      spart.add_metric([p,'','','resnode'],presnode[p])
-      spart.add_metric([p,'','','downcpu'],pdowncpu[p])
-      spart.add_metric([p,'','','downmem'],pdownmem[p])
-      spart.add_metric([p,'','','downgpu'],pdowngpu[p])
-      spart.add_metric([p,'','','downnode'],pdownnode[p])
-      spart.add_metric([p,'','','pwdcpu'],ppwdcpu[p])
-      spart.add_metric([p,'','','pwdmem'],ppwdmem[p])
-      spart.add_metric([p,'','','pwdgpu'],ppwdgpu[p])
-      spart.add_metric([p,'','','pwdnode'],ppwdnode[p])
-      spart.add_metric([p,'','','perdown'],float(pdownnode[p])/max(float(pnode[p]),1.0))
-      spart.add_metric([p,'','','perres'],float(presnode[p])/max(float(pnode[p]),1.0))
-      spart.add_metric([p,'','','runcpu'],pruncpu[p])
-      spart.add_metric([p,'','','runmem'],prunmem[p])
-      spart.add_metric([p,'','','rungpu'],prungpu[p])
-      spart.add_metric([p,'','','occ'],pocc[p])
-      spart.add_metric([p,'','','perocc'],pocc[p]/max(float(pnode[p]),1.0))
-      spart.add_metric([p,'','','hcpu'],phcpu[p])
-      spart.add_metric([p,'','','hmem'],phmem[p])
-      spart.add_metric([p,'','','hgpu'],phgpu[p])
-      spart.add_metric([p,'','','lcpu'],plcpu[p])
-      spart.add_metric([p,'','','lmem'],plmem[p])
-      spart.add_metric([p,'','','lgpu'],plgpu[p])
-      spart.add_metric([p,'','','pendcnt'],ppendcnt[p])
-      spart.add_metric([p,'','','pendusercnt'],ppendusercnt[p])
-      spart.add_metric([p,'','','pendacctcnt'],ppendacctcnt[p])
-      spart.add_metric([p,'','','runcnt'],pruncnt[p])
-      spart.add_metric([p,'','','runusercnt'],prunusercnt[p])
-      spart.add_metric([p,'','','runacctcnt'],prunacctcnt[p])
-      spart.add_metric([p,'','','restarts'],prestarts[p])
+      spart.add_metric([p,'','','cpu'],ps.cpu)
+      spart.add_metric([p,'','','mem'],ps.mem)
+      spart.add_metric([p,'','','gpu'],ps.gpu)
+      spart.add_metric([p,'','','node'],ps.node)
+      spart.add_metric([p,'','','rescpu'],ps.rescpu)
+      spart.add_metric([p,'','','resmem'],ps.resmem)
+      spart.add_metric([p,'','','resgpu'],ps.resgpu)
+      spart.add_metric([p,'','','resnode'],ps.resnode)
+      spart.add_metric([p,'','','downcpu'],ps.downcpu)
+      spart.add_metric([p,'','','downmem'],ps.downmem)
+      spart.add_metric([p,'','','downgpu'],ps.downgpu)
+      spart.add_metric([p,'','','downnode'],ps.downnode)
+      spart.add_metric([p,'','','pwdcpu'],ps.pwdcpu)
+      spart.add_metric([p,'','','pwdmem'],ps.pwdmem)
+      spart.add_metric([p,'','','pwdgpu'],ps.pwdgpu)
+      spart.add_metric([p,'','','pwdnode'],ps.pwdnode)
+      spart.add_metric([p,'','','perdown'],float(ps.downnode)/max(float(ps.node),1.0))
+      spart.add_metric([p,'','','perres'],float(ps.resnode)/max(float(ps.node),1.0))
+      spart.add_metric([p,'','','runcpu'],ps.runcpu)
+      spart.add_metric([p,'','','runmem'],ps.runmem)
+      spart.add_metric([p,'','','rungpu'],ps.rungpu)
+      spart.add_metric([p,'','','occ'],ps.occ)
+      spart.add_metric([p,'','','perocc'],ps.occ/max(float(ps.node),1.0))
+      spart.add_metric([p,'','','hcpu'],ps.hcpu)
+      spart.add_metric([p,'','','hmem'],ps.hmem)
+      spart.add_metric([p,'','','hgpu'],ps.hgpu)
+      spart.add_metric([p,'','','lcpu'],ps.lcpu)
+      spart.add_metric([p,'','','lmem'],ps.lmem)
+      spart.add_metric([p,'','','lgpu'],ps.lgpu)
+      spart.add_metric([p,'','','pendcnt'],ps.pendcnt)
+      spart.add_metric([p,'','','pendusercnt'],len(ps.penduser))
+      spart.add_metric([p,'','','pendacctcnt'],len(ps.pendacct))
+      spart.add_metric([p,'','','runcnt'],ps.runcnt)
+      spart.add_metric([p,'','','runusercnt'],len(ps.runuser))
+      spart.add_metric([p,'','','runacctcnt'],len(ps.runacct))
+      spart.add_metric([p,'','','restarts'],ps.restarts)
 
       #TRES and FLOPS calculation
-      trescpu = ptresweightcpu[p]*float(pcpu[p])
-      tresmem = ptresweightmem[p]*pmem[p]
-      tresgpu = ptresweightgpu[p]*float(pgpu[p])
+      trescpu = ps.wcpu*float(ps.cpu)
+      tresmem = ps.wmem*ps.mem
+      tresgpu = ps.wgpu*float(ps.gpu)
       trestot = trescpu+tresmem+tresgpu
-      tresruncpu = ptresweightcpu[p]*float(pruncpu[p])
-      tresrunmem = ptresweightmem[p]*prunmem[p]
-      tresrungpu = ptresweightgpu[p]*float(prungpu[p])
+      tresruncpu = ps.wcpu*float(ps.runcpu)
+      tresrunmem = ps.wmem*ps.runmem
+      tresrungpu = ps.wgpu*float(ps.rungpu)
       tresruntot = tresruncpu+tresrunmem+tresrungpu
 
       flopscpu = t2g*trescpu
@@ -541,26 +437,26 @@ class SlurmPartStatusCollector(Collector):
       spart.add_metric([p,'','','flopsruntot'],flopsruntot)
 
       #Per User Data
-      try:
-        for u in ppenduser[p]:
-          spart.add_metric([p,u,'','penduser'],ppenduser[p][u])
-      except:
+      if ps.penduser:
+        for u in ps.penduser:
+          spart.add_metric([p,u,'','penduser'],ps.penduser[u])
+      else:
         spart.add_metric([p,'root(0)','','penduser'],0)
 
-      try:
-        for u in prunuser[p]:
-          spart.add_metric([p,u,'','runuser'],prunuser[p][u])
-          spart.add_metric([p,u,'','cpuuser'],pcpuuser[p][u])
-          spart.add_metric([p,u,'','memuser'],pmemuser[p][u])
-          spart.add_metric([p,u,'','gpuuser'],pgpuuser[p][u])
+      if ps.runuser:
+        for u, usage in ps.runuser.items():
+          spart.add_metric([p,u,'','runuser'],usage.run)
+          spart.add_metric([p,u,'','cpuuser'],usage.cpu)
+          spart.add_metric([p,u,'','memuser'],usage.mem)
+          spart.add_metric([p,u,'','gpuuser'],usage.gpu)
 
-          tresruncpu = ptresweightcpu[p]*float(pcpuuser[p][u])
-          tresrunmem = ptresweightmem[p]*pmemuser[p][u]
-          tresrungpu = ptresweightgpu[p]*float(pgpuuser[p][u])
+          tresruncpu = ps.wcpu*float(usage.cpu)
+          tresrunmem = ps.wmem*usage.mem
+          tresrungpu = ps.wgpu*float(usage.gpu)
           tresruntot = tresruncpu+tresrunmem+tresrungpu
 
           spart.add_metric([p,u,'','tresuser'],tresruntot)
-      except:
+      else:
         spart.add_metric([p,'root(0)','','runuser'],0)
         spart.add_metric([p,'root(0)','','cpuuser'],0)
         spart.add_metric([p,'root(0)','','memuser'],0)
@@ -568,26 +464,26 @@ class SlurmPartStatusCollector(Collector):
         spart.add_metric([p,'root(0)','','tresuser'],0)
 
       #Per Account Data
-      try:
-        for a in ppendacct[p]:
-          spart.add_metric([p,'',a,'pendacct'],ppendacct[p][a])
-      except:
+      if ps.pendacct:
+        for a in ps.pendacct:
+          spart.add_metric([p,'',a,'pendacct'],ps.pendacct[a])
+      else:
         spart.add_metric([p,'','root','pendacct'],0)
 
-      try:
-        for a in prunacct[p]:
-          spart.add_metric([p,'',a,'runacct'],prunacct[p][a])
-          spart.add_metric([p,'',a,'cpuacct'],pcpuacct[p][a])
-          spart.add_metric([p,'',a,'memacct'],pmemacct[p][a])
-          spart.add_metric([p,'',a,'gpuacct'],pgpuacct[p][a])
+      if ps.runacct:
+        for a, usage in ps.runacct.items():
+          spart.add_metric([p,'',a,'runacct'],usage.run)
+          spart.add_metric([p,'',a,'cpuacct'],usage.cpu)
+          spart.add_metric([p,'',a,'memacct'],usage.mem)
+          spart.add_metric([p,'',a,'gpuacct'],usage.gpu)
 
-          tresruncpu = ptresweightcpu[p]*float(pcpuacct[p][a])
-          tresrunmem = ptresweightmem[p]*pmemacct[p][a]
-          tresrungpu = ptresweightgpu[p]*float(pgpuacct[p][a])
+          tresruncpu = ps.wcpu*float(usage.cpu)
+          tresrunmem = ps.wmem*usage.mem
+          tresrungpu = ps.wgpu*float(usage.gpu)
           tresruntot = tresruncpu+tresrunmem+tresrungpu
 
           spart.add_metric([p,'',a,'tresacct'],tresruntot)
-      except:
+      else:
         spart.add_metric([p,'','root','runacct'],0)
         spart.add_metric([p,'','root','cpuacct'],0)
         spart.add_metric([p,'','root','memacct'],0)
@@ -597,8 +493,9 @@ class SlurmPartStatusCollector(Collector):
     yield spart
 
 if __name__ == "__main__":
+  slurm_weights.install_reload()
   start_http_server(9008)
-  REGISTRY.register(SlurmPartStatusCollector())
+  register(SlurmPartStatusCollector(), 55)
   while True: 
     # period between collection
     time.sleep(55)
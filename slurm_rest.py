@@ -0,0 +1,173 @@
+"""
+slurm_rest.py
+Client for slurmrestd with a pool of keep-alive connections.
+
+Rather than forking a slurm command (and paying for process start up, munge
+and an RPC) every scrape, the collectors can ask slurmrestd for nodes,
+partitions, jobs, diag and shares over connections that stay open between
+scrapes.  slurmrestd can be reached over TCP (http://host:port) or a unix
+socket (unix:/path/to/socket).
+
+Set SLURMRESTD_URL (and SLURM_JWT / SLURMRESTD_USER if slurmrestd wants
+them) or pass --slurmrestd to slurm_exporter.py to enable it.
+"""
+
+import codecs
+import http.client
+import json
+import os
+import queue
+import socket
+import time
+from urllib.parse import urlparse
+
+import slurm_json
+from slurm_instrument import instruments
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, path, timeout=60):
+    super().__init__('localhost', timeout=timeout)
+    self.socket_path = path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(self.timeout)
+    self.sock.connect(self.socket_path)
+
+class RestError(Exception):
+  pass
+
+class RestClient:
+  def __init__(self, url, token=None, user=None, version='v0.0.40', size=4, timeout=60):
+    self.url = urlparse(url)
+    self.token = token
+    self.user = user
+    self.version = version
+    self.timeout = timeout
+    #Idle connections ready to be reused, at most size of them are kept around.
+    self.pool = queue.LifoQueue(maxsize=size)
+    self.connects = 0
+    self.requests = 0
+
+  def connect(self):
+    self.connects = self.connects + 1
+    if self.url.scheme == 'unix':
+      return UnixHTTPConnection(self.url.path, timeout=self.timeout)
+    if self.url.scheme == 'https':
+      return http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+    return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+  def acquire(self):
+    try:
+      return self.pool.get_nowait()
+    except queue.Empty:
+      return self.connect()
+
+  def release(self, conn):
+    try:
+      self.pool.put_nowait(conn)
+    except queue.Full:
+      conn.close()
+
+  def request(self, endpoint):
+    """Send a GET for endpoint and return the connection and response."""
+    start = time.time()
+    path = f"/slurm/{self.version}/{endpoint}"
+    headers = {'Accept': 'application/json'}
+    if self.token:
+      headers['X-SLURM-USER-TOKEN'] = self.token
+    if self.user:
+      headers['X-SLURM-USER-NAME'] = self.user
+
+    conn = self.acquire()
+    #A pooled connection may have been closed by the server, so retry once on a fresh one.
+    for attempt in range(2):
+      try:
+        self.requests = self.requests + 1
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        break
+      except (http.client.HTTPException, OSError):
+        conn.close()
+        if attempt:
+          raise
+        conn = self.connect()
+
+    if resp.status != 200:
+      body = resp.read()
+      self.release(conn)
+      instruments.command('slurmrestd ' + endpoint, time.time() - start, len(body), resp.status)
+      raise RestError(f"{path} returned {resp.status}: {body[:200]!r}")
+    return conn, resp
+
+  def get(self, endpoint):
+    """Fetch and decode a whole document."""
+    start = time.time()
+    conn, resp = self.request(endpoint)
+    try:
+      body = resp.read()
+      doc = json.loads(body)
+    except:
+      conn.close()
+      raise
+    self.release(conn)
+    instruments.command('slurmrestd ' + endpoint, time.time() - start, len(body))
+    return doc
+
+  def stream(self, endpoint, key):
+    """Yield the elements of the array under key one at a time as they arrive."""
+    start = time.time()
+    conn, resp = self.request(endpoint)
+    read = [0]
+    def counted():
+      for chunk in chunks(resp):
+        read[0] = read[0] + len(chunk)
+        yield chunk
+    try:
+      yield from slurm_json.iter_array(counted(), key)
+      resp.read()
+    except:
+      conn.close()
+      raise
+    self.release(conn)
+    instruments.command('slurmrestd ' + endpoint, time.time() - start, read[0])
+
+  def nodes(self):
+    return self.stream('nodes', 'nodes')
+
+  def partitions(self):
+    return self.stream('partitions', 'partitions')
+
+  def jobs(self):
+    return self.stream('jobs', 'jobs')
+
+  def diag(self):
+    return self.get('diag')
+
+  def shares(self):
+    #Shares are nested as {"shares": {"shares": [...]}}
+    return self.get('shares').get('shares', {}).get('shares', [])
+
+def chunks(resp, size=65536):
+  """Decode a response body into text chunks without splitting characters."""
+  decoder = codecs.getincrementaldecoder('utf-8')()
+  while True:
+    data = resp.read(size)
+    if not data:
+      break
+    yield decoder.decode(data)
+  yield decoder.decode(b'', final=True)
+
+client = None
+
+def configure(url, token=None, user=None, version='v0.0.40', size=4):
+  global client
+  client = RestClient(url, token=token, user=user, version=version, size=size)
+  return client
+
+def get_client():
+  """Return the process wide client, setting it up from the environment if needed."""
+  if client is None and os.environ.get('SLURMRESTD_URL'):
+    configure(os.environ['SLURMRESTD_URL'], os.environ.get('SLURM_JWT'), os.environ.get('SLURMRESTD_USER'),
+      os.environ.get('SLURMRESTD_VERSION', 'v0.0.40'))
+  return client
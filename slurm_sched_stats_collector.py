@@ -18,33 +18,48 @@ sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client.registry import Collector
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_json
+import slurm_rest
+import slurm_source
+from slurm_http import start_http_server
+from slurm_snapshot import register
 
 class SlurmSchedStatsCollector(Collector):
   def __init__(self):
     pass
+  def get_stats(self):
+    """Return the sdiag statistics as a dict, from slurmrestd if one is configured."""
+    client = slurm_rest.get_client()
+    if client is not None:
+      return slurm_json.sdiag_stats(client.diag())
+
+    # Construct dictionary of stats
+    sd = dict()
+    pl = ""
+
+    for line in slurm_source.lines(['sdiag']):
+      if "Remote" in line:
+        break
+      elif "Main" in line:
+        pl = "m"
+      elif "Backfilling" in line:
+        pl = "b"
+      elif ":" in line:
+        line = line.replace(" ","").replace('\t',"").replace("(","").replace(")","")
+        line = pl + line
+        sd.update(dict(s.split(":", 1) for s in shlex.split(line) if ':' in s))
+    return sd
+
   def collect(self):
     try:
-      proc = subprocess.Popen('sdiag', stdout=subprocess.PIPE, universal_newlines=True)
-    except:
+      sd = slurm_instrument.parsed(self, self.get_stats)
+      slurm_instrument.count(self, len(sd))
+    except Exception as e:
+      slurm_instrument.error(self, 'stats', e)
       return
     else:
-      # Construct dictionary of stats
-      sd = dict()
-      pl = ""
-
-      for line in proc.stdout:
-        if "Remote" in line:
-          break
-        elif "Main" in line:
-          pl = "m"
-        elif "Backfilling" in line:
-          pl = "b"
-        elif ":" in line:
-          line = line.replace(" ","").replace('\t',"").replace("(","").replace(")","")
-          line = pl + line
-          sd.update(dict(s.split(":", 1) for s in shlex.split(line) if ':' in s))
-
       # Slurmctld Stats
       sdiag = GaugeMetricFamily('sdiag', 'Stats from sdiag', labels=['field'])
 
@@ -85,7 +100,7 @@ class SlurmSchedStatsCollector(Collector):
 
 if __name__ == "__main__":
   start_http_server(9001)
-  REGISTRY.register(SlurmSchedStatsCollector())
+  register(SlurmSchedStatsCollector(), 30)
   while True:
     # period between collection
     time.sleep(30)
@@ -5,7 +5,7 @@ slurm_seas_stats_collector.py
 A script to get stats for SEAS.
 """
 
-import sys,os,json,subprocess,shlex
+import sys,os,json,shlex
 import time
 from os import path
 
@@ -17,29 +17,46 @@ sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client.registry import Collector
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_source
+from slurm_http import start_http_server
+from slurm_snapshot import register
 
 class SlurmSeasStatsCollector(Collector):
-  def __init__(self):
-    pass
+  def __init__(self, deadline=None):
+    #Seconds a scrape waits for squeue and showq before exporting what it has
+    self.deadline = deadline or float(os.environ.get('SLURM_EXPORTER_DEADLINE', 25))
   def collect(self):
     seas = GaugeMetricFamily('seas', 'Stats for SEAS', labels=['field'])
-    try:
-      proc = subprocess.Popen(['timeout','-s','9','60s','/usr/bin/squeue',
+
+    #squeue and the two showq calls do not depend on each other so run them all at once.
+    squeue, compute, gpu = slurm_instrument.parsed(self, slurm_source.run_all, [
+      ['timeout','-s','9','60s','/usr/bin/squeue',
       '--account=acc_lab,aizenberg_lab,amin_lab,anderson_lab,aziz_lab,barak_lab,bertoldi_lab,brenner_lab,capasso_lab,chen_lab_seas,chong_lab_seas,clarke_lab,doshi-velez_lab,dwork_lab,bfarrell_lab,fdoyle_lab,gajos_lab,glassman_lab,hekstra_lab,hills_lab,hu_lab_seas,idreos_lab,jacob_lab,janapa_reddi_lab,jialiu_lab,jlewis_lab,kaxiras_lab,keith_lab_seas,keutsch_lab,kohler_lab,koumoutsakos_lab,kozinsky_lab,kung_lab,linz_lab,mahadevan_lab,manoharan_lab,martin_lab_seas,mazur_lab_seas,mccoll_lab,mcelroy_lab,mitragotri_lab,moorcroft_lab,nelson_lab,parkes_lab,pehlevan_lab,pfister_lab,protopapas_lab,rush_lab,seas_computing,spaepen_lab,sunderland_lab,suo_lab,tambe_lab,tziperman_lab,vadhan_lab,vlassak_lab,walsh_lab_seas,weitz_lab,wofsy_lab,wordsworth_lab,ysinger_group,yu_lab,zickler_lab',
       '--Format=RestartCnt,PendingTime,Partition',
       '--noheader',
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      return
-    else:
+      ],
+      ['timeout','-s','9','60s','/usr/local/bin/showq',
+      '-s',
+      '-p',
+      'seas_compute',
+      ],
+      ['timeout','-s','9','60s','/usr/local/bin/showq',
+      '-s',
+      '-p',
+      'seas_gpu',
+      ],
+    ], self.deadline)
+
+    if squeue is not None:
+      slurm_instrument.count(self, len(squeue))
       rtot = 0
       ptot = 0
       jcnt = 0
       jseas = 0
 
-      for line in proc.stdout:
+      for line in squeue:
         (RestartCnt, PendingTime, Partition) = (" ".join(line.split())).split(" ")
 
         # Summing total number of Restarts and Pending time for later average
@@ -69,25 +86,17 @@ class SlurmSeasStatsCollector(Collector):
         jcnt = jcnt + 1
 
       # Averaging Restart Count and Pending Time
-      rave = float(rtot)/float(jcnt)
-      pave = float(ptot)/float(jcnt)
+      if jcnt:
+        rave = float(rtot)/float(jcnt)
+        pave = float(ptot)/float(jcnt)
 
-      seas.add_metric(["restartave"],rave)
-      seas.add_metric(["pendingave"],pave)
+        seas.add_metric(["restartave"],rave)
+        seas.add_metric(["pendingave"],pave)
       seas.add_metric(["totseasjobs"],jcnt)
       seas.add_metric(["seaspartjobs"],jseas)
 
-    try:
-      proc = subprocess.Popen(['timeout','-s','9','60s','/usr/local/bin/showq',
-      '-s',
-      '-p',
-      'seas_compute',
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      exit
-    else:
-      for line in proc.stdout:
+    if compute is not None:
+      for line in compute:
         if "cores" in line:
           line = line.replace("("," ").replace(")"," ")
           summary = (" ".join(line.split())).split(" ")
@@ -102,17 +111,8 @@ class SlurmSeasStatsCollector(Collector):
           # Publishes number of pending jobs on seas compute partition
           seas.add_metric(["scpj"],summary[8])
 
-    try:
-      proc = subprocess.Popen(['timeout','-s','9','60s','/usr/local/bin/showq',
-      '-s',
-      '-p',
-      'seas_gpu',
-      ], stdout=subprocess.PIPE,
-      universal_newlines=True)
-    except:
-      exit
-    else:
-      for line in proc.stdout:
+    if gpu is not None:
+      for line in gpu:
         if "cores" in line:
           line = line.replace("("," ").replace(")"," ")
           summary = (" ".join(line.split())).split(" ")
@@ -132,7 +132,7 @@ class SlurmSeasStatsCollector(Collector):
 
 if __name__ == "__main__":
   start_http_server(9004)
-  REGISTRY.register(SlurmSeasStatsCollector())
+  register(SlurmSeasStatsCollector(), 30)
   while True: 
     # period between collection
     time.sleep(30)
@@ -0,0 +1,208 @@
+"""
+slurm_snapshot.py
+Background snapshot cache so that scrapes never run slurm commands inline.
+
+A SnapshotCollector wraps one of the regular collectors.  A refresher thread
+calls the wrapped collect() every interval and stores the resulting metric
+families as an immutable snapshot.  Scrapes then just hand back the latest
+snapshot along with a few stats on how old it is and how long it took to build.
+
+Collectors run inline go through a CoalescingCollector instead, which runs the
+collect on scrape but only once for all the scrapes that arrive while it is in
+flight (several Prometheus replicas scraping the same exporter), and can
+reuse the result for a short ttl.  Scrapes are counted as hits, misses and
+coalesced in slurm_exporter_scrape_collects_total.
+
+Both render their families to exposition text (and gzip) once per collect,
+which slurm_http serves to every scrape.  Either way the collector is timed
+through slurm_instrument, with the refresh counted as the collect and the
+rendering as serialization.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from prometheus_client.registry import Collector
+
+import slurm_http
+from slurm_instrument import instruments
+
+#Environment knobs so the systemd units can switch modes without code edits.
+MODE_ENV = 'SLURM_EXPORTER_MODE'
+INTERVAL_ENV = 'SLURM_EXPORTER_INTERVAL'
+TTL_ENV = 'SLURM_EXPORTER_SCRAPE_TTL'
+
+Snapshot = namedtuple('Snapshot', ['families', 'timestamp', 'duration', 'text', 'deflated'])
+
+def snapshot(collector, families, start):
+  """A Snapshot of families collected from collector since start, rendered for serving."""
+  text, deflated = slurm_http.render(instruments.collecting(collector, families, collect=False))
+  return Snapshot(families, time.time(), time.time() - start, text, deflated)
+
+class SnapshotCollector(Collector):
+  def __init__(self, collector, interval=30, name=None):
+    self.collector = collector
+    self.interval = float(interval)
+    self.name = name or type(collector).__name__
+    instruments.set_name(collector, self.name)
+    self.snapshot = Snapshot((), 0.0, 0.0, b'', b'')
+    self.errors = 0
+    self._thread = None
+    self._stop = threading.Event()
+
+  def refresh(self):
+    """Run the wrapped collector once and swap in the new snapshot."""
+    start = time.time()
+    try:
+      families = tuple(instruments.collecting(self.collector, self.collector.collect(), serialize=False))
+      current = snapshot(self.collector, families, start)
+    except Exception as e:
+      self.errors = self.errors + 1
+      print(f"Error refreshing {self.name}: {e}")
+      return
+    #Swapping the reference is atomic so readers never see a half built snapshot.
+    self.snapshot = current
+
+  def run(self):
+    while not self._stop.is_set():
+      start = time.time()
+      self.refresh()
+      self._stop.wait(max(self.interval - (time.time() - start), 0))
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self.run, name=f"refresh-{self.name}", daemon=True)
+      self._thread.start()
+    return self
+
+  def stop(self):
+    self._stop.set()
+
+  def describe(self):
+    #The wrapped families are only known once a refresh has run.
+    return []
+
+  def rendered(self):
+    return self.snapshot
+
+  def collect(self):
+    yield from self.snapshot.families
+
+class CoalescingCollector(Collector):
+  """Run the wrapped collector on scrape, sharing each collect with the scrapes that arrive while it runs.
+
+  The result is reused for ttl seconds, so with a ttl of zero only scrapes
+  that overlap share a collect.  A failed collect is raised to every scrape
+  waiting on it and is not cached.
+  """
+  def __init__(self, collector, ttl=0, name=None):
+    self.collector = collector
+    self.ttl = float(ttl)
+    self.name = name or type(collector).__name__
+    instruments.set_name(collector, self.name)
+    self.lock = threading.Lock()
+    self.snapshot = Snapshot((), 0.0, 0.0, b'', b'')
+    #Future of the collect in flight, if any
+    self.inflight = None
+
+  def rendered(self):
+    """The Snapshot of a collect, running one unless one is cached or in flight."""
+    with self.lock:
+      current = self.snapshot
+      if current.timestamp and time.time() - current.timestamp < self.ttl:
+        instruments.scrape(self.collector, 'hit')
+        return current
+      future = self.inflight
+      leader = future is None
+      if leader:
+        future = self.inflight = Future()
+    if not leader:
+      instruments.scrape(self.collector, 'coalesced')
+      return future.result()
+
+    instruments.scrape(self.collector, 'miss')
+    start = time.time()
+    try:
+      families = tuple(instruments.collecting(self.collector, self.collector.collect(), serialize=False))
+      current = snapshot(self.collector, families, start)
+    except BaseException as e:
+      with self.lock:
+        self.inflight = None
+      future.set_exception(e)
+      raise
+    with self.lock:
+      self.snapshot = current
+      self.inflight = None
+    future.set_result(current)
+    return current
+
+  def describe(self):
+    #Registering would otherwise run a collect to find the families.
+    return []
+
+  def collect(self):
+    yield from self.rendered().families
+
+class SnapshotStatsCollector(Collector):
+  """Report on the age and cost of every registered snapshot."""
+  def __init__(self):
+    self.snapshots = []
+
+  def add(self, snapshot):
+    self.snapshots.append(snapshot)
+
+  def collect(self):
+    labels = ['collector']
+    age = GaugeMetricFamily('slurm_exporter_snapshot_age_seconds', 'Seconds since the served snapshot was taken', labels=labels)
+    duration = GaugeMetricFamily('slurm_exporter_snapshot_refresh_seconds', 'Time taken to build the served snapshot', labels=labels)
+    errors = CounterMetricFamily('slurm_exporter_snapshot_errors', 'Number of failed snapshot refreshes', labels=labels)
+    now = time.time()
+    for s in self.snapshots:
+      snapshot = s.snapshot
+      if snapshot.timestamp:
+        age.add_metric([s.name], now - snapshot.timestamp)
+      else:
+        #No snapshot yet so report it as infinitely stale.
+        age.add_metric([s.name], float('inf'))
+      duration.add_metric([s.name], snapshot.duration)
+      errors.add_metric([s.name], s.errors)
+    yield age
+    yield duration
+    yield errors
+
+_stats = {}
+_instrumented = set()
+
+def register(collector, interval, registry=REGISTRY, mode=None, name=None, ttl=None):
+  """Register a collector either inline or behind a background snapshot.
+
+  The collector is served from its rendered snapshots by slurm_http, while
+  the snapshot stats and the exporter's own metrics go in registry.
+
+  Set SLURM_EXPORTER_MODE=snapshot to enable background refresh and
+  SLURM_EXPORTER_INTERVAL to override the refresh interval in seconds.
+  Inline collectors reuse their last collect for SLURM_EXPORTER_SCRAPE_TTL
+  seconds (or ttl), zero by default.
+  """
+  if mode is None:
+    mode = os.environ.get(MODE_ENV, 'inline')
+    interval = float(os.environ.get(INTERVAL_ENV, interval))
+  if ttl is None:
+    ttl = float(os.environ.get(TTL_ENV, 0))
+  if mode == 'snapshot':
+    collector = SnapshotCollector(collector, interval, name).start()
+    if registry not in _stats:
+      _stats[registry] = SnapshotStatsCollector()
+      registry.register(_stats[registry])
+    _stats[registry].add(collector)
+  else:
+    collector = CoalescingCollector(collector, ttl, name)
+  if registry not in _instrumented:
+    _instrumented.add(registry)
+    registry.register(instruments)
+  slurm_http.exposition(registry).add(collector)
+  return collector
@@ -0,0 +1,197 @@
+"""
+slurm_source.py
+Shared access to the output of slurm commands.
+
+When several collectors run in one process the output of a command is fetched
+once per cycle and handed to every collector that asks for it, rather than
+each collector hitting slurmctld on its own.
+
+Collectors that need several independent commands can run them side by side
+with run_all, which waits no longer than a deadline and hands back whatever
+finished in time.
+
+Per job dumps (scontrol show job, sacct) are read with stream, which hands the
+lines to the parser as they arrive and never keeps them for sharing, so
+memory does not grow with the number of jobs.
+
+Every command run is timed and measured through slurm_instrument.
+
+Setting SLURM_EXPORTER_BIN_DIR (or --slurm-bin-dir) runs the slurm commands
+from that directory instead, e.g. the fake commands benchmarks/synthetic_cluster.py
+writes out for load testing.
+"""
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from slurm_instrument import instruments
+
+#Slurm commands the collectors run, which bin_dir can stand in for
+SLURM_COMMANDS = ('scontrol', 'sinfo', 'squeue', 'sacct', 'sdiag', 'sshare', 'showq')
+
+#Directory to run the slurm commands from in place of wherever the collectors expect them
+bin_dir = os.environ.get('SLURM_EXPORTER_BIN_DIR')
+
+SHELL_COMMAND = re.compile(r'(^|[|;&]\s*)(?:\S*/)?(%s)(?=\s|$)' % '|'.join(SLURM_COMMANDS))
+
+def command(cmd):
+  """Point the slurm command in cmd, an argument list or a shell string, at bin_dir if one is set."""
+  if not bin_dir:
+    return cmd
+  if isinstance(cmd, str):
+    return SHELL_COMMAND.sub(lambda m: m.group(1) + os.path.join(bin_dir, m.group(2)), cmd)
+  cmd = list(cmd)
+  for i, arg in enumerate(cmd):
+    if os.path.basename(arg) in SLURM_COMMANDS:
+      cmd[i] = os.path.join(bin_dir, os.path.basename(arg))
+      break
+  return cmd
+
+def label(cmd):
+  """Name a command for its metrics, e.g. sacct or scontrol show job."""
+  words = cmd.split() if isinstance(cmd, str) else list(cmd)
+  for i, word in enumerate(words):
+    name = os.path.basename(word)
+    if name in SLURM_COMMANDS:
+      if name == 'scontrol':
+        return ' '.join([name] + [w for w in words[i+1:i+4] if not w.startswith('-')][:2])
+      return name
+  return os.path.basename(words[0]) if words else ''
+
+class CommandSource:
+  def __init__(self, ttl=0):
+    #How long (in seconds) to reuse a command's output.  Zero disables sharing.
+    self.ttl = ttl
+    self.cache = {}
+    self.locks = {}
+    self.lock = threading.Lock()
+    self.calls = 0
+    self.hits = 0
+    self.timeouts = 0
+    #Most commands any one run_all call runs at once
+    self.workers = 8
+
+  def popen(self, cmd, **kwargs):
+    self.calls = self.calls + 1
+    return subprocess.Popen(command(cmd), stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+
+  def stream(self, cmd):
+    """Yield the lines of output of cmd as they arrive.
+
+    Raises CalledProcessError once the output is read if cmd exited nonzero,
+    so a command that failed or was killed part way is not taken for one
+    with nothing to report.
+    """
+    start = time.time()
+    proc = self.popen(cmd)
+    nbytes = 0
+    finished = False
+    try:
+      for line in proc.stdout:
+        nbytes = nbytes + len(line)
+        yield line
+      finished = True
+    finally:
+      proc.stdout.close()
+      proc.wait()
+      #A reader that stops early leaves the command to die of a broken pipe, which is not its failure
+      instruments.command(label(cmd), time.time() - start, nbytes, proc.returncode if finished else None)
+    if proc.returncode:
+      raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+  def output(self, cmd, shell=False, check=True):
+    """Run cmd to completion and return its output as one string.
+
+    Raises CalledProcessError if cmd exits nonzero and check is set.
+    """
+    start = time.time()
+    proc = self.popen(cmd, shell=shell)
+    out, _ = proc.communicate()
+    instruments.command(label(cmd), time.time() - start, len(out), proc.returncode)
+    if check and proc.returncode:
+      raise subprocess.CalledProcessError(proc.returncode, cmd, out)
+    return out
+
+  def lines(self, cmd):
+    """Return the lines of output of cmd, reusing recent output if allowed."""
+    if not self.ttl:
+      return self.stream(cmd)
+
+    key = tuple(cmd)
+    with self.lock:
+      lock = self.locks.setdefault(key, threading.Lock())
+
+    #Holding the per command lock means concurrent callers wait for the fetch in flight.
+    with lock:
+      entry = self.cache.get(key)
+      if entry and time.time() - entry[0] < self.ttl:
+        self.hits = self.hits + 1
+        return entry[1]
+      out = tuple(self.stream(cmd))
+      self.cache[key] = (time.time(), out)
+      return out
+
+  def run(self, cmd, deadline):
+    """Return the lines of output of cmd, or None if it failed or was still running at deadline."""
+    key = tuple(cmd)
+    if self.ttl:
+      entry = self.cache.get(key)
+      if entry and time.time() - entry[0] < self.ttl:
+        self.hits = self.hits + 1
+        return entry[1]
+
+    start = time.time()
+    try:
+      #In its own session so the whole process group can be killed, timeout(1) and all.
+      proc = self.popen(cmd, start_new_session=True)
+    except OSError as e:
+      print(f"Error executing command {cmd}: {e}")
+      instruments.command(label(cmd), time.time() - start, 0, -1)
+      return None
+    try:
+      out, _ = proc.communicate(timeout=max(deadline - time.time(), 0))
+    except subprocess.TimeoutExpired:
+      os.killpg(proc.pid, signal.SIGKILL)
+      out, _ = proc.communicate()
+      self.timeouts = self.timeouts + 1
+      instruments.command(label(cmd), time.time() - start, len(out or ''), timed_out=True)
+      print(f"Command {cmd} did not finish in time")
+      return None
+    instruments.command(label(cmd), time.time() - start, len(out), proc.returncode)
+    if proc.returncode:
+      return None
+
+    out = tuple(out.splitlines())
+    if self.ttl:
+      self.cache[key] = (time.time(), out)
+    return out
+
+  def run_all(self, cmds, timeout=60):
+    """Run the commands concurrently and return their output lines in order.
+
+    Commands that fail or do not finish within timeout seconds are killed and
+    their output is None, so callers can still use the ones that did finish.
+    """
+    deadline = time.time() + timeout
+    with ThreadPoolExecutor(max_workers=max(min(len(cmds), self.workers), 1)) as pool:
+      return list(pool.map(lambda cmd: self.run(cmd, deadline), cmds))
+
+#Process wide source used by all the collectors.
+source = CommandSource()
+
+def lines(cmd):
+  return source.lines(cmd)
+
+def stream(cmd):
+  return source.stream(cmd)
+
+def output(cmd, shell=False, check=True):
+  return source.output(cmd, shell, check)
+
+def run_all(cmds, timeout=60):
+  return source.run_all(cmds, timeout)
@@ -17,24 +17,39 @@ sys.path = [prefix, external] + sys.path
 
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client.registry import Collector
-from prometheus_client import start_http_server
+
+import slurm_instrument
+import slurm_json
+import slurm_rest
+import slurm_source
+from slurm_http import start_http_server
+from slurm_snapshot import register
 
 class SlurmSshareCollector(Collector):
   def __init__(self):
     pass
+  def get_rows(self):
+    """Yield the sshare fields of each association, from slurmrestd if one is configured."""
+    client = slurm_rest.get_client()
+    if client is not None:
+      return (slurm_json.sshare_row(share) for share in client.shares())
+
+    # sshare command we will use to get the data
+    output = slurm_source.lines([
+    'sshare',
+    '-ahP', '--format=User,Account,RawShares,NormShares,RawUsage,NormUsage,Fairshare'
+    ])
+    return (line.strip().split('|') for line in output)
+
   def collect(self):
     try:
-      # sshare command we will use to get the data
-      proc = subprocess.Popen([
-      'sshare',
-      '-ahP', '--format=User,Account,RawShares,NormShares,RawUsage,NormUsage,Fairshare'
-      ], stdout=subprocess.PIPE, universal_newlines=True)
-    except:
+      rows = slurm_instrument.records(self, self.get_rows)
+    except Exception as e:
+      slurm_instrument.error(self, 'shares', e)
       return
     else:
       sshare = GaugeMetricFamily('sshare', 'Stats from sshare', labels=['account','user','field'])
-      for line in proc.stdout:
-        (User, Account, RawShares, NormShares, RawUsage, NormUsage, Fairshare) = line.strip().split('|')
+      for (User, Account, RawShares, NormShares, RawUsage, NormUsage, Fairshare) in rows:
         Account=Account.replace(" ","")
         User=User.replace(" ","")
         # Need to deal with users that are set to parent for their Shares.
@@ -54,7 +69,7 @@ class SlurmSshareCollector(Collector):
 
 if __name__ == "__main__":
   start_http_server(9003)
-  REGISTRY.register(SlurmSshareCollector())
+  register(SlurmSshareCollector(), 55)
   while True: 
     # period between collection
     time.sleep(55)
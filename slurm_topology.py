@@ -0,0 +1,165 @@
+"""
+slurm_topology.py
+Shared registry of the partitions and the nodes in each.
+
+Which nodes are in which partition changes a few times a year, yet the
+collectors that filter by partition asked sinfo for it on every scrape.  The
+registry fetches every partition and its nodes with one sinfo call (or from
+slurmrestd if one is configured) and hands the same Topology to every
+collector until it is ttl seconds old or slurm.conf has changed.  A partition
+change means an edit to slurm.conf and an scontrol reconfigure, so the
+registry stats slurm.conf (and the directory it is in, for files replaced by
+a rename) on each lookup and fetches again when either was modified.  That
+stat is all a lookup costs while the topology is fresh.
+"""
+
+import os
+import threading
+import time
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+import slurm_json
+import slurm_rest
+import slurm_source
+from slurm_hostlist import expand
+
+#One line per partition and state, with the nodes as a hostlist
+TOPOLOGY_CMD = ['timeout','-s','9','60s','sinfo','-h','-o','%R %N']
+TTL_ENV = 'SLURM_EXPORTER_TOPOLOGY_TTL'
+#Where slurm looks for its config unless SLURM_CONF says otherwise
+DEFAULT_CONF = '/etc/slurm/slurm.conf'
+
+class Topology:
+  """Partitions and their nodes as of one fetch."""
+  def __init__(self, hostlists):
+    #Hostlists of each partition in the order slurm lists them, e.g. {'kempner': ['holygpu8a[1-4]']}
+    self.hostlists = hostlists
+    self.partitions = {p: tuple(dict.fromkeys(n for h in hl for n in expand(h))) for p, hl in hostlists.items()}
+    self.node_partitions = {}
+    for p, nodes in self.partitions.items():
+      for n in nodes:
+        self.node_partitions[n] = self.node_partitions.get(n, ()) + (p,)
+    #Sets of the nodes of each partition, made the first time they are asked for
+    self.nodesets = {}
+
+  def names(self, predicate=None):
+    """Names of the partitions, just those predicate(name) is true for if one is given."""
+    return [p for p in self.partitions if predicate is None or predicate(p)]
+
+  def nodes(self, partition):
+    """Names of the nodes in partition, none if there is no such partition."""
+    return self.partitions.get(partition, ())
+
+  def nodeset(self, partition):
+    """The nodes in partition as a frozenset, for membership tests."""
+    nodes = self.nodesets.get(partition)
+    if nodes is None:
+      nodes = self.nodesets[partition] = frozenset(self.nodes(partition))
+    return nodes
+
+  def hostlist(self, partition):
+    """The nodes in partition as sinfo lists them, comma separated hostlists."""
+    return ','.join(self.hostlists.get(partition, ()))
+
+  def partitions_of(self, node):
+    """Names of the partitions node is in."""
+    return self.node_partitions.get(node, ())
+
+def parse_topology(lines):
+  """Build a Topology from the lines of sinfo -h -o '%R %N'.
+
+  A partition with no nodes has an empty %N and is kept, with no nodes.
+  """
+  hostlists = {}
+  for line in lines:
+    fields = line.split()
+    if fields:
+      nodes = hostlists.setdefault(fields[0], [])
+      if len(fields) == 2 and fields[1] != '(null)':
+        nodes.append(fields[1])
+  return Topology(hostlists)
+
+class TopologyRegistry(Collector):
+  def __init__(self, cmd=TOPOLOGY_CMD, ttl=3600, conf=None):
+    self.cmd = cmd
+    #Seconds a topology is used for when slurm.conf has not changed
+    self.ttl = ttl
+    self.conf = conf or os.environ.get('SLURM_CONF') or DEFAULT_CONF
+    self.lock = threading.Lock()
+    self.topology = None
+    self.fetched = 0
+    self.signature = None
+    self.fetches = 0
+    self.reconfigures = 0
+    self.errors = 0
+
+  def config_signature(self):
+    """Modification times of slurm.conf and its directory, None for either that cannot be read."""
+    stamps = []
+    for p in (self.conf, os.path.dirname(self.conf)):
+      try:
+        stamps.append(os.stat(p).st_mtime_ns)
+      except OSError:
+        stamps.append(None)
+    return tuple(stamps)
+
+  def current(self):
+    """The current Topology, fetched again if it is too old or slurm.conf changed.
+
+    If a fetch fails the last topology is kept until the ttl runs out again,
+    and only with no topology to fall back on is the error raised.
+    """
+    signature = self.config_signature()
+    with self.lock:
+      if self.topology is not None and time.time() - self.fetched < self.ttl:
+        if signature == self.signature:
+          return self.topology
+        self.reconfigures = self.reconfigures + 1
+      try:
+        self.topology = self.fetch()
+      except Exception as e:
+        self.errors = self.errors + 1
+        if self.topology is None:
+          raise
+        print(f"Keeping the partition topology from {time.ctime(self.fetched)}, could not fetch it: {e!r}")
+      self.fetched = time.time()
+      self.signature = signature
+      return self.topology
+
+  def fetch(self):
+    self.fetches = self.fetches + 1
+    client = slurm_rest.get_client()
+    if client is not None:
+      hostlists = {}
+      for p in map(slurm_json.scontrol_partition, client.partitions()):
+        hostlists[p['PartitionName']] = [p['Nodes']] if p['Nodes'] else []
+      return Topology(hostlists)
+    return parse_topology(slurm_source.output(self.cmd).splitlines())
+
+  def invalidate(self):
+    """Fetch the topology again on the next lookup."""
+    with self.lock:
+      self.fetched = 0
+
+  def collect(self):
+    fetches = CounterMetricFamily('slurm_exporter_topology_fetches', 'Number of times the partition topology was fetched')
+    reconfigures = CounterMetricFamily('slurm_exporter_topology_reconfigures', 'Number of times the partition topology was fetched early because slurm.conf changed')
+    errors = CounterMetricFamily('slurm_exporter_topology_errors', 'Number of failed partition topology fetches')
+    age = GaugeMetricFamily('slurm_exporter_topology_age_seconds', 'Seconds since the partition topology was fetched')
+    partitions = GaugeMetricFamily('slurm_exporter_topology_partitions', 'Number of partitions in the partition topology')
+    fetches.add_metric([], self.fetches)
+    reconfigures.add_metric([], self.reconfigures)
+    errors.add_metric([], self.errors)
+    topology = self.topology
+    age.add_metric([], time.time() - self.fetched if topology is not None else float('inf'))
+    partitions.add_metric([], len(topology.partitions) if topology is not None else 0)
+    yield fetches
+    yield reconfigures
+    yield errors
+    yield age
+    yield partitions
+
+#Process wide registry shared by all the collectors.
+topology = TopologyRegistry(ttl=float(os.environ.get(TTL_ENV, 3600)))
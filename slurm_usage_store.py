@@ -0,0 +1,139 @@
+"""
+slurm_usage_store.py
+SQLite store for daily usage rollups.
+
+Usage is kept as one row per day per partition, group or user so ingesting a
+day is a single upsert, cumulative totals are one indexed aggregate and any
+window (last 7 days, last 30 days, this quarter) can be summed without going
+back to sacct.  The database runs in WAL mode so the exporter can read it
+while a backfill is writing.
+
+The ingest watermark and the list of days already ingested live in the same
+database and are committed in the same transaction as the day's rows.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+KINDS = ('partition', 'group', 'user')
+
+#Day used for totals carried over from before per day rows were kept
+BASELINE = '0000-00-00'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS usage (
+  kind TEXT NOT NULL,
+  name TEXT NOT NULL,
+  day TEXT NOT NULL,
+  cpu_hours REAL NOT NULL DEFAULT 0,
+  gpu_hours REAL NOT NULL DEFAULT 0,
+  gpu_tres_hours REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY (kind, name, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS usage_day ON usage (kind, day);
+CREATE TABLE IF NOT EXISTS ingested (
+  day TEXT PRIMARY KEY,
+  jobs INTEGER NOT NULL DEFAULT 0,
+  at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+'''
+
+def window_start(window, today=None):
+  """Return the first day of a window such as 7d, 30d or quarter (to date)."""
+  today = today or date.today()
+  if window == 'quarter':
+    return str(date(today.year, 3 * ((today.month - 1) // 3) + 1, 1))
+  if window.endswith('d'):
+    return str(today - timedelta(days=int(window[:-1])))
+  raise ValueError(f"Unknown window {window}")
+
+class UsageStore:
+  def __init__(self, path):
+    #The snapshot refresher reads from its own thread so share one connection under a lock.
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.lock = threading.Lock()
+    with self.lock, self.db:
+      self.db.execute('PRAGMA journal_mode=WAL')
+      self.db.execute('PRAGMA synchronous=NORMAL')
+      self.db.executescript(SCHEMA)
+
+  def days(self):
+    """Return the set of days that have been ingested."""
+    with self.lock:
+      return {row[0] for row in self.db.execute('SELECT day FROM ingested')}
+
+  def latest_day(self):
+    with self.lock:
+      return self.db.execute('SELECT max(day) FROM ingested').fetchone()[0]
+
+  def get_meta(self, key):
+    with self.lock:
+      row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+  def watermark(self):
+    """Exclusive end time of the jobs ingested so far."""
+    return self.get_meta('watermark')
+
+  def set_meta(self, key, value):
+    with self.lock, self.db:
+      self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+  def upsert(self, day, usage):
+    """Write the rows of usage for a day, replacing any the day already had."""
+    rows = [(kind, name, day, v['cpu_hours'], v['gpu_hours'], v['gpu_tres_hours'])
+      for kind in KINDS for name, v in usage.get(kind, {}).items()]
+    self.db.executemany('''INSERT INTO usage (kind, name, day, cpu_hours, gpu_hours, gpu_tres_hours)
+      VALUES (?, ?, ?, ?, ?, ?)
+      ON CONFLICT (kind, name, day) DO UPDATE SET
+        cpu_hours = excluded.cpu_hours,
+        gpu_hours = excluded.gpu_hours,
+        gpu_tres_hours = excluded.gpu_tres_hours''', rows)
+
+  def commit_day(self, day, usage, jobs=0, watermark=None):
+    """Upsert the rollups for a day and mark it ingested in one transaction.
+
+    usage maps each kind to {name: {'cpu_hours', 'gpu_hours', 'gpu_tres_hours'}}.
+    """
+    with self.lock, self.db:
+      self.upsert(day, usage)
+      self.db.execute('INSERT OR REPLACE INTO ingested (day, jobs, at) VALUES (?, ?, ?)', (day, jobs, time.time()))
+      if watermark:
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('watermark', watermark))
+
+  def import_baseline(self, usage):
+    """Store totals that predate the per day rows so cumulative sums carry on from them."""
+    with self.lock, self.db:
+      self.upsert(BASELINE, usage)
+
+  def mark_ingested(self, days):
+    """Record days as ingested without any rows, e.g. when importing older state."""
+    with self.lock, self.db:
+      self.db.executemany('INSERT OR IGNORE INTO ingested (day, jobs, at) VALUES (?, 0, ?)',
+        [(day, time.time()) for day in days])
+
+  def totals(self, kind, start=None, end=None):
+    """Sum usage per name for days in [start, end], largest GPU users first.
+
+    Returns a list of (name, cpu_hours, gpu_hours, gpu_tres_hours).
+    """
+    query = 'SELECT name, sum(cpu_hours), sum(gpu_hours), sum(gpu_tres_hours) FROM usage WHERE kind = ?'
+    args = [kind]
+    if start:
+      query = query + ' AND day >= ?'
+      args.append(start)
+    if end:
+      query = query + ' AND day <= ?'
+      args.append(end)
+    query = query + ' GROUP BY name ORDER BY sum(gpu_hours) DESC, name'
+    with self.lock:
+      return self.db.execute(query, args).fetchall()
+
+  def close(self):
+    self.db.close()
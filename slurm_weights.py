@@ -0,0 +1,135 @@
+"""
+slurm_weights.py
+TRES weights of the CPU and GPU types, shared by every collector.
+
+The weights live in tres_weights.json next to the collectors (or the file
+SLURM_EXPORTER_WEIGHTS names): t2g, the GFLOps per unit of TRES, and the
+weight of each CPU and GPU type keyed by the node feature that marks it.
+Adding a type is an edit to that file.  It is read once and again whenever
+the process gets SIGHUP (systemctl reload), keeping the old weights if the
+new file does not load.
+
+Per type totals are turned into TRES with one dot product against the
+weights, kept as vectors in catalog order.
+"""
+
+import json
+import os
+import re
+import signal
+import threading
+from array import array
+from operator import mul, or_
+
+#Node features that never name a CPU model: vendors, instruction sets, interconnects, GPU flags and compute capabilities
+NOT_CPU_MODEL = re.compile(r'(amd|intel|arm|aarch64|x86_64|avx\w*|sse\w*|holy\w*|gpu|cc[0-9.]+)$')
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tres_weights.json')
+#File the weights are loaded from
+path = os.environ.get('SLURM_EXPORTER_WEIGHTS') or DEFAULT_PATH
+
+class Weights:
+  def __init__(self, config):
+    self.t2g = float(config['t2g'])
+    self.cpu = {t: float(w) for t, w in config['cpu'].items()}
+    self.gpu = {t: float(w) for t, w in config['gpu'].items()}
+    self.cpu_vector = array('d', self.cpu.values())
+    self.gpu_vector = array('d', self.gpu.values())
+    #Longest names first so a100-mig is tried before a100, and not inside a longer model number (a40 in rtx_a4000)
+    self.gpu_patterns = [(t, re.compile(r'(?<![a-z0-9])' + re.escape(t.lower()) + r'(?![0-9])'))
+      for t in sorted(self.gpu, key=len, reverse=True)]
+
+  def cpu_tres(self, totals):
+    """TRES of per CPU type totals, a dict keyed by type."""
+    return sum(map(mul, self.cpu_vector, [totals.get(t, 0) for t in self.cpu]))
+
+  def gpu_tres(self, totals):
+    """TRES of per GPU type totals, a dict keyed by type."""
+    return sum(map(mul, self.gpu_vector, [totals.get(t, 0) for t in self.gpu]))
+
+  def gpu_type(self, model):
+    """The GPU type a slurm GRES model such as nvidia_h100_80gb_hbm3 is, or None."""
+    model = model.lower()
+    for t, pattern in self.gpu_patterns:
+      if pattern.search(model):
+        return t
+    return None
+
+  def gpu_weight(self, model):
+    """Weight of a slurm GRES model, 0 for models of no known type."""
+    t = self.gpu_type(model)
+    return self.gpu[t] if t else 0.0
+
+  def cpu_model(self, features):
+    """The first of a node's features that could name its CPU model, or None."""
+    for f in features:
+      if not NOT_CPU_MODEL.match(f.lower()) and self.gpu_type(f) is None:
+        return f
+    return None
+
+  def cpu_nodes(self, table):
+    """Masks of the nodes of a slurm_nodes.NodeTable by CPU type.
+
+    Nodes are typed by their feature, and nodes with none of the weighted
+    features by the first of their features that could name a CPU model.
+    Models of no known type are kept under their own name, with no weight,
+    and logged.
+    """
+    nodes = {t: table.feature(t) for t in self.cpu}
+    for model, mask in table.cpumodels(self.cpu, self.cpu_model).items():
+      t = model or 'unknown'
+      warn_unweighted(t, 'CPU')
+      nodes[t] = mask
+    return nodes
+
+  def gpu_nodes(self, table):
+    """Masks of the GPU nodes of a slurm_nodes.NodeTable by GPU type.
+
+    Nodes are typed by their feature, and GPU nodes with none of the weighted
+    features by the model in their Gres.  Models of no known type are kept
+    under their own name, with no weight, and logged.
+    """
+    nodes = {t: table.feature(t) for t in self.gpu}
+    for model, mask in table.gpumodels(self.gpu).items():
+      t = self.gpu_type(model)
+      if t is None:
+        t = model or 'unknown'
+        warn_unweighted(t, 'GPU')
+      nodes[t] = bytes(map(or_, nodes[t], mask)) if t in nodes else mask
+    return nodes
+
+def load(filename=None):
+  with open(filename or path) as f:
+    return Weights(json.load(f))
+
+#Current weights.  Collectors should read this once per collect so one collect uses one set.
+weights = load()
+
+lock = threading.Lock()
+#Discovered CPU and GPU models that have been warned about, as (kind, model)
+unweighted = set()
+
+def reload():
+  """Load the weights again, keeping the current ones if the file does not load."""
+  global weights
+  try:
+    new = load()
+  except (OSError, ValueError, KeyError, TypeError) as e:
+    print(f"Keeping the current TRES weights, could not load new ones: {e!r}")
+    return
+  with lock:
+    weights = new
+    unweighted.clear()
+  print(f"Loaded TRES weights for {', '.join(list(new.cpu) + list(new.gpu))}")
+
+def install_reload():
+  """Reload the weights on SIGHUP.  Must be called from the main thread."""
+  signal.signal(signal.SIGHUP, lambda signum, frame: reload())
+
+def warn_unweighted(model, kind='GPU'):
+  """Log a CPU or GPU model with no weight, once until the weights are reloaded."""
+  with lock:
+    if (kind, model) in unweighted:
+      return
+    unweighted.add((kind, model))
+  print(f"No TRES weight for {kind} model {model}, add its type to {path}")
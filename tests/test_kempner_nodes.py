@@ -0,0 +1,98 @@
+"""
+test_kempner_nodes.py
+Which partition ksacct counts a job's usage under, for node names where one
+is a prefix of another (holygpu8a1 and holygpu8a11), zero padded names and
+NodeLists given as bracketed hostlists.
+"""
+
+import sys, os
+
+PREFIX = os.path.normpath(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+EXTERNAL = os.path.join(PREFIX, 'external')
+sys.path = [PREFIX, EXTERNAL] + sys.path
+
+import pytest
+
+import slurm_weights
+from slurm_hostlist import expand
+from slurm_kempner_sacct_collector import UsageColumns, check_kempner_node
+
+WEIGHTS = slurm_weights.Weights({'t2g': 1.0, 'cpu': {'genoa': 1.0}, 'gpu': {'a100': 2.0, 'h100': 4.0}})
+H100 = 'billing=8,cpu=8,gres/gpu=2,gres/gpu:nvidia_h100_80gb_hbm3=2,mem=32G,node=1'
+
+
+def sacct_line(job_id, partition, node_list, elapsed='01:00:00', tres=H100, cpus=8, user='alice', account='kempner_lab'):
+    """A line of sacct -X -p output in the fields ksacct asks for."""
+    return (f"{job_id}|COMPLETED|{user}|{account}|{partition}|{elapsed}|{tres}|{node_list}|32G||0:0|{cpus}|"
+            f"00:10:00|{elapsed}|cpu={cpus}|2024-01-01T00:00:00|2024-01-01T01:00:00|")
+
+
+def partition_totals(lines, kempner_nodes):
+    return UsageColumns(lines, frozenset(kempner_nodes), WEIGHTS).totals('partition')
+
+
+@pytest.mark.parametrize('node_list, kempner_nodes, counted', [
+    # A node whose name starts with a kempner node's name is not that node
+    ('holygpu8a11', ['holygpu8a1'], 'gpu'),
+    ('holygpu8a1', ['holygpu8a11'], 'gpu'),
+    ('holygpu8a1', ['holygpu8a1'], 'fasrc_h100'),
+    ('holygpu8a11', ['holygpu8a1', 'holygpu8a11'], 'fasrc_h100'),
+    # Zero padded names only match with the same padding
+    ('holygpu8a01', ['holygpu8a1'], 'gpu'),
+    ('holygpu8a1', expand('holygpu8a[01-03]'), 'gpu'),
+    ('holygpu8a02', expand('holygpu8a[01-03]'), 'fasrc_h100'),
+    ('holygpu8a011', expand('holygpu8a[01-03]'), 'gpu'),
+    # Bracketed NodeLists are matched node by node
+    ('holygpu8a[10-12]', ['holygpu8a1'], 'gpu'),
+    ('holygpu8a[01-03,11-12]', ['holygpu8a1', 'holygpu8a2'], 'gpu'),
+    ('holygpu8a[01-03,11-12]', ['holygpu8a12'], 'fasrc_h100'),
+    ('holygpu8a[01-03,11-12]', ['holygpu8a03'], 'fasrc_h100'),
+    ('holygpu7c[01-02],holygpu8a[11-12]', ['holygpu8a1'], 'gpu'),
+    ('holygpu7c[01-02],holygpu8a[11-12]', ['holygpu7c02'], 'fasrc_h100'),
+])
+def test_check_kempner_node(node_list, kempner_nodes, counted):
+    assert check_kempner_node(node_list, frozenset(kempner_nodes), 'gpu', 'h100') == counted
+
+
+def test_check_kempner_node_keeps_kempner_partitions():
+    assert check_kempner_node('holygpu8a1', frozenset(['holygpu8a1']), 'kempner_h100', 'h100') == 'kempner_h100'
+
+
+def test_check_kempner_node_without_gpu_type():
+    assert check_kempner_node('holygpu8a1', frozenset(['holygpu8a1']), 'gpu', None) == 'fasrc_cpu'
+
+
+def test_usage_columns_prefix_names():
+    lines = [
+        sacct_line(1, 'gpu', 'holygpu8a1'),
+        sacct_line(2, 'gpu', 'holygpu8a11', elapsed='02:00:00'),
+        sacct_line(3, 'gpu', 'holygpu8a01', elapsed='04:00:00'),
+    ]
+    totals = partition_totals(lines, ['holygpu8a1'])
+    assert totals['fasrc_h100']['total_hours'] == 1.0
+    assert totals['gpu']['total_hours'] == 6.0
+    assert totals['fasrc_h100']['gpu_hours'] == 2.0
+    assert totals['fasrc_h100']['gpu_tres_hours'] == 8.0
+    assert totals['fasrc_h100']['cpu_hours'] == 8.0
+
+
+def test_usage_columns_bracketed_node_lists():
+    kempner_nodes = expand('holygpu8a[01-03]')
+    lines = [
+        # Only the 11 and 12 of these are outside the kempner nodes
+        sacct_line(1, 'gpu', 'holygpu8a[01-03,11-12]'),
+        # holygpu8a1 and holygpu8a11 are neither of them holygpu8a01
+        sacct_line(2, 'gpu', 'holygpu8a[1,11]', elapsed='02:00:00'),
+        sacct_line(3, 'gpu', 'holygpu7c[01-02],holygpu8a[03-04]', elapsed='04:00:00'),
+        sacct_line(4, 'kempner_h100', 'holygpu8a[02-03]', elapsed='08:00:00'),
+    ]
+    totals = partition_totals(lines, kempner_nodes)
+    assert {name: t['total_hours'] for name, t in totals.items()} == {
+        'fasrc_h100': 5.0, 'gpu': 2.0, 'kempner_h100': 8.0}
+
+
+def test_usage_columns_same_node_list_different_kempner_nodes():
+    # The NodeList lookup is cached per UsageColumns, not across them
+    lines = [sacct_line(1, 'gpu', 'holygpu8a[10-11]')]
+    assert set(partition_totals(lines, ['holygpu8a1'])) == {'gpu'}
+    assert set(partition_totals(lines, ['holygpu8a11'])) == {'fasrc_h100'}
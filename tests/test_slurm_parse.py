@@ -0,0 +1,63 @@
+"""
+test_slurm_parse.py
+Splitting scontrol -o records into fields, in particular free text values
+such as Comment= and Command= that hold something that looks like a field.
+"""
+
+import sys,os
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+from slurm_parse import parse_job, parse_record, parse_timestamp
+
+fixtures = os.path.join(prefix, 'benchmarks', 'fixtures')
+
+JOB = ('JobId=42 JobName=train UserId=alice(1001) GroupId=lab(2001) Account=kempner_lab JobState=RUNNING '
+  'Reason=None Dependency=(null) Partition=kempner NumCPUs=8 '
+  'Command=/n/home/alice/train.sh --lr=0.1  epochs=3 WorkDir=/n/home/alice/run dir=2 '
+  'Comment=sweep lr=0.1 batch=64 StdErr=/n/home/alice/err StdIn=/dev/null StdOut=/n/home/alice/out key=1 '
+  'Power= TresPerNode=gres:gpu:1 '
+  'Nodes=holygpu8a1 CPU_IDs=0-7 Mem=32768 GRES=gpu:nvidia_h100_80gb_hbm3:1(IDX:0)')
+
+def test_free_text_values_are_kept_whole():
+  job = parse_record(JOB)
+  assert job['Command'] == '/n/home/alice/train.sh --lr=0.1  epochs=3'
+  assert job['WorkDir'] == '/n/home/alice/run dir=2'
+  assert job['Comment'] == 'sweep lr=0.1 batch=64'
+  assert job['StdOut'] == '/n/home/alice/out key=1'
+  for fake in ('epochs', 'dir', 'batch', 'key'):
+    assert fake not in job
+  assert job['Power'] == ''
+  assert job['TresPerNode'] == 'gres:gpu:1'
+
+def test_free_text_values_in_jobs():
+  job, details = parse_job(JOB)
+  assert job['Comment'] == 'sweep lr=0.1 batch=64'
+  assert job['NumCPUs'] == '8'
+  assert details == [{'Nodes': 'holygpu8a1', 'CPU_IDs': '0-7', 'Mem': '32768',
+    'GRES': 'gpu:nvidia_h100_80gb_hbm3:1(IDX:0)'}]
+
+def test_node_reason():
+  node = parse_record('NodeName=holy7c01 State=DOWN+DRAIN Reason=bad dimm slot=3 [root@2024-01-01T10:00:00] '
+    'Comment=(null) CfgTRES=cpu=48,mem=187G')
+  assert node['Reason'] == 'bad dimm slot=3 [root@2024-01-01T10:00:00]'
+  assert node['Comment'] == '(null)'
+  assert node['CfgTRES'] == 'cpu=48,mem=187G'
+
+def test_fixtures_split_on_every_key():
+  #Every line of the fixtures splits on each key, as it did before free text was handled
+  for name in ('scontrol_show_node.txt', 'scontrol_show_partition.txt', 'scontrol_show_job.txt'):
+    with open(os.path.join(fixtures, name)) as f:
+      for line in f:
+        if line.strip():
+          record = parse_record(line)
+          assert len(record) == line.count('=') - sum(v.count('=') for v in record.values())
+
+def test_parse_timestamp():
+  assert parse_timestamp(None) is None
+  assert parse_timestamp('Unknown') is None
+  assert parse_timestamp('2024-01-01T10:00:00') is not None
@@ -0,0 +1,28 @@
+"""
+test_slurm_topology.py
+Building the partition topology from sinfo -h -o '%R %N'.
+"""
+
+import sys,os
+
+prefix = os.path.normpath(
+  os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+)
+external = os.path.join(prefix, 'external')
+sys.path = [prefix, external] + sys.path
+
+from slurm_topology import parse_topology
+
+def test_partitions_and_nodes():
+  topology = parse_topology(['kempner holygpu8a[1-2]\n', 'kempner holygpu8a11\n', 'gpu holygpu8a[1,11]\n'])
+  assert topology.names() == ['kempner', 'gpu']
+  assert topology.nodes('kempner') == ('holygpu8a1', 'holygpu8a2', 'holygpu8a11')
+  assert topology.hostlist('kempner') == 'holygpu8a[1-2],holygpu8a11'
+  assert topology.partitions_of('holygpu8a11') == ('kempner', 'gpu')
+
+def test_partitions_without_nodes_are_kept():
+  topology = parse_topology(['kempner holygpu8a1\n', 'kempner_dev \n', 'kempner_new (null)\n'])
+  assert topology.names(lambda p: 'kempner' in p) == ['kempner', 'kempner_dev', 'kempner_new']
+  assert topology.nodes('kempner_dev') == ()
+  assert topology.nodeset('kempner_new') == frozenset()
+  assert topology.hostlist('kempner_dev') == ''